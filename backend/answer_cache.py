@@ -0,0 +1,159 @@
+"""Answer cache for repeated questions about the same collection."""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+class _Entry:
+    __slots__ = ("answer", "embedding", "index_version", "expires_at")
+
+    def __init__(self, answer: Any, embedding: Optional[np.ndarray], index_version: int, expires_at: float):
+        self.answer = answer
+        self.embedding = embedding
+        self.index_version = index_version
+        self.expires_at = expires_at
+
+
+class AnswerCache:
+    """LRU answer cache with TTL and an optional semantic lookup.
+
+    Entries are keyed by ``(collection_id, scope, normalize_query(query))``,
+    where ``scope`` names how a question was answered (e.g. the retrieval
+    mode and page range), and tagged with the collection's
+    ``index_version``; an entry stored for an older
+    version of the index is never returned. When ``semantic_threshold`` is set,
+    ``get_similar`` also returns the answer of a cached query whose embedding
+    has at least that cosine similarity with the new one.
+
+    Args:
+        max_entries: Number of answers kept across all collections.
+        ttl: Seconds an answer stays valid.
+        semantic_threshold: Minimum cosine similarity for a semantic hit, or
+            ``None`` to only serve exact (normalized) matches.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600, semantic_threshold: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str, str], _Entry]" = OrderedDict()
+        # Stacked query embeddings per (collection, scope), rebuilt after changes
+        self._matrices: Dict[Tuple[str, str], Tuple[List[Tuple[str, str, str]], np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def semantic(self) -> bool:
+        return self.semantic_threshold is not None
+
+    def _live(self, key: Tuple[str, str, str], index_version: int, now: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < now or entry.index_version != index_version:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _drop(self, key: Tuple[str, str, str]) -> None:
+        del self._entries[key]
+        self._matrices.pop(key[:2], None)
+
+    def get(self, collection_id: str, index_version: int, query: str, scope: str = "") -> Optional[Any]:
+        """Return the answer cached for exactly this (normalized) query."""
+        with self._lock:
+            entry = self._live((collection_id, scope, normalize_query(query)), index_version, time.time())
+            if entry is None:
+                if not self.semantic:
+                    self.misses += 1
+                return None
+            self.hits += 1
+            return entry.answer
+
+    def get_similar(
+        self, collection_id: str, index_version: int, embedding: Sequence[float], scope: str = ""
+    ) -> Optional[Any]:
+        """Return the answer of the most similar cached query above the threshold."""
+        if not self.semantic:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            keys, matrix = self._matrix(collection_id, scope)
+            if not keys:
+                self.misses += 1
+                return None
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.semantic_threshold:
+                entry = self._live(keys[best], index_version, time.time())
+                if entry is not None:
+                    self.semantic_hits += 1
+                    return entry.answer
+            self.misses += 1
+            return None
+
+    def _matrix(self, collection_id: str, scope: str) -> Tuple[List[Tuple[str, str, str]], np.ndarray]:
+        if (collection_id, scope) not in self._matrices:
+            keys = [
+                key for key, entry in self._entries.items()
+                if key[:2] == (collection_id, scope) and entry.embedding is not None
+            ]
+            vectors = [self._entries[key].embedding for key in keys]
+            matrix = np.stack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+            self._matrices[collection_id, scope] = (keys, matrix)
+        return self._matrices[collection_id, scope]
+
+    def put(
+        self,
+        collection_id: str,
+        index_version: int,
+        query: str,
+        answer: Any,
+        embedding: Optional[Sequence[float]] = None,
+        scope: str = "",
+    ) -> None:
+        vector = None
+        if embedding is not None and self.semantic:
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        key = (collection_id, scope, normalize_query(query))
+        with self._lock:
+            self._entries[key] = _Entry(answer, vector, index_version, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            self._matrices.pop(key[:2], None)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, collection_id: str) -> None:
+        """Forget every answer about ``collection_id``."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == collection_id]:
+                del self._entries[key]
+            for key in [key for key in self._matrices if key[0] == collection_id]:
+                del self._matrices[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "semantic_threshold": self.semantic_threshold,
+            }
@@ -0,0 +1,113 @@
+"""Bulk ingestion of many PDFs: one pipeline across documents versus one upload at a time.
+
+Builds a corpus of distinct documents out of page ranges of one PDF, plus a
+few byte-identical copies, and indexes it twice through the real app
+(main.py) against the local fake OpenAI server:
+
+* sequential: ``load_document`` per file, as a client looping over
+  /load_document/ would,
+* bulk: ``load_documents`` over the whole corpus, as /load_documents/ and
+  ``main_proto.py ingest`` do.
+
+The embedding cache is cleared between the two, so both embed every chunk.
+Reports wall time, pages/s, chunks/s, how many embedding requests were sent
+and the most that were in flight at once; with ``--concurrency`` above 1 the
+bulk run must have overlapped requests.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_bulk --pdf "documents/Attention is all you need.pdf" --latency 0.2
+"""
+import argparse
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from fake_openai import FakeOpenAIServer
+
+
+def build_corpus(pdf, directory, docs, pages_per_doc, duplicates):
+    """Write ``docs`` PDFs of consecutive page ranges and ``duplicates`` copies of the first ones."""
+    import pypdf
+
+    reader = pypdf.PdfReader(pdf)
+    docs = min(docs, len(reader.pages) // pages_per_doc)
+    if not docs:
+        sys.exit(f"{pdf} has fewer than {pages_per_doc} pages")
+    os.makedirs(directory)
+    for i in range(docs):
+        writer = pypdf.PdfWriter()
+        for page in reader.pages[i * pages_per_doc:(i + 1) * pages_per_doc]:
+            writer.add_page(page)
+        writer.write(os.path.join(directory, f"doc{i:03}.pdf"))
+    for i in range(min(duplicates, docs)):
+        shutil.copy(os.path.join(directory, f"doc{i:03}.pdf"), os.path.join(directory, f"copy{i:03}.pdf"))
+    return docs
+
+
+def report(name, seconds, pages, chunks, requests, in_flight):
+    print(f"{name:<11} {seconds:7.2f}s  {pages / seconds:7.1f} pages/s  {chunks / seconds:8.1f} chunks/s  "
+          f"{requests:4} embedding requests  max_in_flight={in_flight}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", default=os.path.join("documents", "Attention is all you need.pdf"))
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--pages-per-doc", type=int, default=5)
+    parser.add_argument("--duplicates", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake OpenAI latency per request")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--concurrency", type=int, default=4, help="EMBEDDING_MAX_CONCURRENCY")
+    args = parser.parse_args()
+
+    pdf = os.path.abspath(args.pdf)
+    if not os.path.exists(pdf):
+        parser.error(f"{args.pdf} does not exist, pass a PDF with --pdf")
+    server = FakeOpenAIServer(latency=args.latency, dim=args.dim).start()
+    os.environ["OPENAI_API_BASE"] = server.url
+    os.environ["OPENAI_API_KEY"] = "fake"
+    os.environ["EMBEDDING_MAX_CONCURRENCY"] = str(args.concurrency)
+    workdir = tempfile.mkdtemp(prefix="bench_bulk-")
+    os.chdir(workdir)
+    # Registered before main is imported so it runs after Chroma persists at exit
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    docs = build_corpus(pdf, "corpus", args.docs, args.pages_per_doc, args.duplicates)
+    print(f"{docs} documents of {args.pages_per_doc} pages and {min(args.duplicates, docs)} copies")
+
+    import main
+    from bulk import collect_files
+
+    try:
+        files = collect_files("corpus", "extracted").files
+
+        chat = main.registry.get("sequential")
+        requests = server.stats()["requests"]
+        server.max_in_flight = 0
+        start = time.perf_counter()
+        pages = chunks = 0
+        for file in files:
+            if chat.ingested_source(file.content_hash) is None:
+                stats = chat.load_document(file.path, content_hash=file.content_hash)
+                pages += stats["pages"]
+                chunks += stats["added"] + stats["kept"]
+        report("sequential", time.perf_counter() - start, pages, chunks, server.stats()["requests"] - requests,
+               server.max_in_flight)
+
+        main.get_embeddings().cache.clear()
+        chat = main.registry.get("bulk")
+        requests = server.stats()["requests"]
+        server.max_in_flight = 0
+        result = chat.load_documents(files)
+        report("bulk", result["seconds"], result["pages"], result["chunks"], server.stats()["requests"] - requests,
+               server.max_in_flight)
+        print(f"{'':<11} {result['indexed']} indexed, {result['duplicates']} duplicates, {result['failed']} failed")
+        # Ingest batches are smaller than one embedding request, so only concurrent batches
+        # overlap requests
+        if args.concurrency > 1:
+            assert server.max_in_flight > 1, "bulk ingestion never had more than one embedding request in flight"
+    finally:
+        main.registry.close_all()
+        server.stop()
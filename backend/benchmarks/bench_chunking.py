@@ -0,0 +1,157 @@
+"""Compare text splitter configurations on indexing cost and retrieval quality.
+
+Every configuration splits the same pages, embeds the chunks through
+OpenAIEmbeddings against the local fake server (bag-of-tokens vectors, so
+retrieval is meaningful) and answers a fixed question set. A question is a
+hit when one of the top k chunks contains its expected answer.
+
+Configurations are ``chars:<size>[:<overlap>]`` or ``tokens:<size>[:<overlap>]``.
+Without ``--pdf`` a synthetic mixed English/Korean corpus is generated;
+``--questions`` is a JSON list of ``{"question": ..., "answer": ...}``.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_chunking
+    python -m benchmarks.bench_chunking --pdf documents/report.pdf --questions questions.json \\
+        --configs chars:500 tokens:256:32 tokens:512:64
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+import tiktoken
+from langchain.chains.question_answering.stuff_prompt import CHAT_PROMPT
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from fake_openai import FakeOpenAIServer
+from ingest import iter_pdf_pages, token_text_splitter
+from modify import OpenAIEmbeddings
+
+MODEL = "text-embedding-ada-002"
+
+_WORDS_EN = ["report", "market", "river", "engine", "policy", "garden", "signal", "budget", "station", "harvest"]
+_WORDS_KO = ["보고서", "시장", "강", "엔진", "정책", "정원", "신호", "예산", "정거장", "수확"]
+
+
+def synthetic_corpus(pages, seed=0):
+    """Pages of filler text in English and Korean, each hiding one fact, and questions about them."""
+    rng = random.Random(seed)
+    documents, questions = [], []
+    for page in range(pages):
+        sentences = []
+        for _ in range(rng.randint(8, 16)):
+            if rng.random() < 0.5:
+                a, b, c = rng.sample(_WORDS_EN, 3)
+                sentences.append(f"The {a} near the {b} changed how the {c} was planned this year.")
+            else:
+                a, b, c = rng.sample(_WORDS_KO, 3)
+                sentences.append(f"올해 {a} 근처의 {b} 때문에 {c} 계획이 바뀌었습니다.")
+        name = f"P{page:04d}{rng.choice('XYZW')}"
+        code = f"{rng.randrange(10**6):06d}"
+        if page % 2:
+            fact = f"The access code for project {name} is {code}."
+            question = f"What is the access code for project {name}?"
+        else:
+            fact = f"프로젝트 {name}의 접근 코드는 {code}입니다."
+            question = f"프로젝트 {name}의 접근 코드는 무엇입니까?"
+        sentences.insert(rng.randrange(len(sentences) + 1), fact)
+        text = "\n".join(" ".join(sentences[i:i + 3]) for i in range(0, len(sentences), 3))
+        documents.append(Document(page_content=text, metadata={"source": "synthetic", "page": page}))
+        questions.append({"question": question, "answer": code})
+    return documents, questions
+
+
+def make_splitter(config):
+    kind, *sizes = config.split(":")
+    size = int(sizes[0])
+    overlap = int(sizes[1]) if len(sizes) > 1 else 0
+    if kind == "chars":
+        return RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=overlap)
+    if kind == "tokens":
+        return token_text_splitter(size, overlap, model_name=MODEL)
+    raise ValueError(f"Unknown splitter {config!r}, use chars:<size> or tokens:<size>")
+
+
+def run(config, pages, questions, server, k, batch):
+    encoding = tiktoken.encoding_for_model(MODEL)
+    splitter = make_splitter(config)
+    embeddings = OpenAIEmbeddings(
+        openai_api_key="fake", openai_api_base=server.url, model=MODEL, chunk_size=batch
+    )
+
+    start = time.perf_counter()
+    chunks = [chunk.page_content for chunk in splitter.split_documents(pages)]
+    split_seconds = time.perf_counter() - start
+    tokens = [len(t) for t in encoding.encode_batch(chunks)]
+
+    requests = server.requests
+    start = time.perf_counter()
+    vectors = embeddings.embed_documents_array(chunks)
+    embed_seconds = time.perf_counter() - start
+    calls = server.requests - requests
+
+    queries = embeddings.embed_documents_array([q["question"] for q in questions])
+    top = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+    hits, prompt_tokens = 0, []
+    for question, rows in zip(questions, top):
+        context = [chunks[row] for row in rows]
+        hits += any(question["answer"] in text for text in context)
+        # Size of the "stuff" prompt the chat model would receive
+        prompt = CHAT_PROMPT.format(context="\n\n".join(context), question=question["question"])
+        prompt_tokens.append(len(encoding.encode(prompt)))
+
+    return {
+        "config": config,
+        "chunks": len(chunks),
+        "tokens_embedded": int(sum(tokens)),
+        "tokens_per_chunk_p50": float(np.median(tokens)),
+        "tokens_per_chunk_max": int(max(tokens)),
+        "embedding_calls": calls,
+        "split_s": split_seconds,
+        "embed_s": embed_seconds,
+        "prompt_tokens_per_query": float(np.mean(prompt_tokens)),
+        "hit_rate": hits / len(questions),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", help="PDF to split instead of the synthetic corpus")
+    parser.add_argument("--questions", help="JSON question set, required with --pdf")
+    parser.add_argument("--pages", type=int, default=200, help="synthetic corpus size")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=1000, help="texts per embedding request")
+    parser.add_argument(
+        "--configs",
+        nargs="+",
+        default=["chars:250", "chars:500", "chars:1000", "tokens:128:16", "tokens:256:32", "tokens:512:64"],
+    )
+    parser.add_argument("--json", action="store_true", help="print one JSON object per configuration")
+    args = parser.parse_args()
+
+    if args.pdf:
+        if not args.questions:
+            parser.error("--questions is required with --pdf")
+        pages = list(iter_pdf_pages(args.pdf))
+        with open(args.questions, encoding="utf-8") as f:
+            questions = json.load(f)
+    else:
+        pages, questions = synthetic_corpus(args.pages)
+
+    server = FakeOpenAIServer(lexical=True).start()
+    try:
+        for config in args.configs:
+            result = run(config, pages, questions, server, args.k, args.batch)
+            if args.json:
+                print(json.dumps(result))
+                continue
+            print(
+                f"{config:<14} chunks={result['chunks']:<6} tokens={result['tokens_embedded']:<8} "
+                f"p50={result['tokens_per_chunk_p50']:<6.0f} max={result['tokens_per_chunk_max']:<5} "
+                f"calls={result['embedding_calls']:<4} prompt_tokens/query={result['prompt_tokens_per_query']:<7.0f} "
+                f"hit_rate={result['hit_rate']:.2f}"
+            )
+    finally:
+        server.stop()
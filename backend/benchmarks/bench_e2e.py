@@ -0,0 +1,259 @@
+"""End-to-end benchmark of the FastAPI service against the local fake OpenAI server.
+
+Runs the real app (main.py) in a scratch directory with every OpenAI call
+served by fake_openai.FakeOpenAIServer, and measures:
+
+* ingest: pages/s and chunks/s of indexing one PDF,
+* query: latency percentiles of distinct questions asked in process,
+* load: throughput and latency percentiles of concurrent users calling
+  /ask_question on a uvicorn server, at every ``--users`` level,
+* memory: peak resident set size after every phase.
+
+Results are written as JSON so runs can be compared; ``--compare`` prints
+the change of every metric against an earlier result file.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_e2e --pdf "documents/Attention is all you need.pdf" \\
+        --output bench_e2e.json
+    python -m benchmarks.bench_e2e --latency 0.2 --users 1 8 32 --compare bench_e2e.json
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from fake_openai import FakeOpenAIServer
+
+QUESTIONS = [
+    "What is the main contribution of this document?",
+    "How is attention computed?",
+    "What datasets were used in the experiments?",
+    "Which results are reported?",
+    "What are the limitations?",
+    "How does the model compare to previous work?",
+    "What hyperparameters were chosen?",
+    "How long did training take?",
+]
+
+# Metrics where a larger value is better, everything else is a cost
+_HIGHER_IS_BETTER = ("pages_per_s", "chunks_per_s", "requests_per_s")
+
+
+def peak_rss_mb():
+    """High-water resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def percentiles(seconds):
+    values = np.array(seconds) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(values.max()),
+    }
+
+
+def question(i):
+    # Distinct wording so every call goes through retrieval and the LLM, not the answer cache
+    return f"{QUESTIONS[i % len(QUESTIONS)]} ({i})"
+
+
+def bench_ingest(main, pdf):
+    chat = main.registry.get("bench")
+    start = time.perf_counter()
+    stats = chat.load_document(pdf)
+    elapsed = time.perf_counter() - start
+    return {
+        "pages": stats["pages"],
+        "chunks": stats["added"],
+        "seconds": elapsed,
+        "pages_per_s": stats["pages"] / elapsed,
+        "chunks_per_s": stats["added"] / elapsed,
+    }
+
+
+def bench_query(main, queries):
+    chat = main.registry.get("bench")
+    seconds = []
+    for i in range(queries):
+        start = time.perf_counter()
+        chat.answer_question(question(i))
+        seconds.append(time.perf_counter() - start)
+    return {"latency": percentiles(seconds), "stages": main.latency.summary()}
+
+
+def start_app(app):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    host, port = server.servers[0].sockets[0].getsockname()[:2]
+    return server, thread, f"http://{host}:{port}"
+
+
+def bench_load(base_url, users, requests_per_user, offset):
+    import httpx
+
+    def user(u):
+        seconds, errors = [], 0
+        with httpx.Client(base_url=base_url, timeout=120) as client:
+            for r in range(requests_per_user):
+                start = time.perf_counter()
+                try:
+                    response = client.post("/ask_question", params={
+                        "query": question(offset + u * requests_per_user + r),
+                        "collection_id": "bench",
+                    })
+                    failed = response.status_code != 200 or "error" in response.json()
+                except httpx.HTTPError:
+                    failed = True
+                seconds.append(time.perf_counter() - start)
+                errors += failed
+        return seconds, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        results = list(pool.map(user, range(users)))
+    elapsed = time.perf_counter() - start
+    seconds = [s for user_seconds, _ in results for s in user_seconds]
+    return {
+        "users": users,
+        "requests": len(seconds),
+        "errors": sum(errors for _, errors in results),
+        "seconds": elapsed,
+        "requests_per_s": len(seconds) / elapsed,
+        "latency": percentiles(seconds),
+    }
+
+
+def flatten(result, prefix=""):
+    """``{"a": {"b": 1}}`` as ``{"a.b": 1}``; load levels are keyed by their user count."""
+    flat = {}
+    for key, value in result.items():
+        if key in ("config", "environment", "stages"):
+            continue
+        if key == "load":
+            value = {f"users={level['users']}": level for level in value}
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(result, baseline):
+    current, previous = flatten(result), flatten(baseline)
+    print(f"\n{'metric':<40} {'baseline':>12} {'current':>12} {'change':>9}")
+    for key in sorted(current.keys() & previous.keys()):
+        before, after = previous[key], current[key]
+        change = (after - before) / before * 100 if before else 0.0
+        worse = change < 0 if key.endswith(_HIGHER_IS_BETTER) else change > 0
+        flag = " !" if worse and abs(change) >= 10 else ""
+        print(f"{key:<40} {before:>12.2f} {after:>12.2f} {change:>+8.1f}%{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", default=os.path.join("documents", "Attention is all you need.pdf"))
+    parser.add_argument("--queries", type=int, default=50, help="questions asked in process")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16], help="concurrent users per load level")
+    parser.add_argument("--requests-per-user", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake OpenAI latency per request")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="fake latency per streamed token")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of OpenAI calls answered 429")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="earlier JSON result to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    pdf = os.path.abspath(args.pdf)
+    if not os.path.exists(pdf):
+        parser.error(f"{args.pdf} does not exist, pass a PDF with --pdf")
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    server = FakeOpenAIServer(latency=args.latency, dim=args.dim, lexical=True,
+                              token_latency=args.token_latency,
+                              rate_limit_rate=args.rate_limit_rate).start()
+    os.environ["OPENAI_API_BASE"] = server.url
+    os.environ["OPENAI_API_KEY"] = "fake"
+    # Indexes, caches and uploads go to a scratch directory so runs start cold
+    workdir = tempfile.mkdtemp(prefix="bench_e2e-")
+    os.chdir(workdir)
+    # Registered before main is imported so it runs after Chroma persists at exit
+    if not args.keep:
+        atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+
+    result = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "keep")},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "memory": {},
+    }
+    app_server = None
+    try:
+        start = time.perf_counter()
+        import main
+        result["startup_s"] = time.perf_counter() - start
+        result["memory"]["startup_peak_rss_mb"] = peak_rss_mb()
+
+        result["ingest"] = bench_ingest(main, pdf)
+        result["memory"]["ingest_peak_rss_mb"] = peak_rss_mb()
+        print(f"ingest: {result['ingest']['pages']} pages, {result['ingest']['chunks']} chunks, "
+              f"{result['ingest']['pages_per_s']:.1f} pages/s, {result['ingest']['chunks_per_s']:.1f} chunks/s")
+
+        result["query"] = bench_query(main, args.queries)
+        result["memory"]["query_peak_rss_mb"] = peak_rss_mb()
+        query = result["query"]["latency"]
+        print(f"query:  p50 {query['p50_ms']:.1f} ms, p95 {query['p95_ms']:.1f} ms, p99 {query['p99_ms']:.1f} ms")
+
+        app_server, app_thread, base_url = start_app(main.app)
+        result["load"] = []
+        offset = args.queries
+        for users in args.users:
+            level = bench_load(base_url, users, args.requests_per_user, offset)
+            offset += level["requests"]
+            result["load"].append(level)
+            print(f"load:   {users:>3} users {level['requests_per_s']:7.1f} req/s, "
+                  f"p50 {level['latency']['p50_ms']:.1f} ms, p99 {level['latency']['p99_ms']:.1f} ms, "
+                  f"{level['errors']} errors")
+        result["memory"]["load_peak_rss_mb"] = peak_rss_mb()
+        result["openai"] = server.stats()
+        print(f"memory: peak RSS {result['memory']['load_peak_rss_mb']:.0f} MiB")
+    finally:
+        if app_server is not None:
+            app_server.should_exit = True
+            app_thread.join()
+        server.stop()
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {output}")
+    if baseline:
+        with open(baseline, "r") as f:
+            compare(result, json.load(f))
@@ -0,0 +1,50 @@
+"""Per-chunk memory of embeddings as List[List[float]] versus a float32 matrix.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_embedding_memory --chunks 2000
+"""
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from fake_openai import FakeOpenAIServer
+from modify import OpenAIEmbeddings
+
+
+def measure(func):
+    """Return (result, bytes still allocated by it, peak bytes while it ran)."""
+    tracemalloc.start()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+
+    texts = [f"chunk {i}: attention is all you need" for i in range(args.chunks)]
+    server = FakeOpenAIServer(dim=args.dim).start()
+    try:
+        embeddings = OpenAIEmbeddings(
+            openai_api_key="fake", openai_api_base=server.url, chunk_size=args.batch
+        )
+        rows = [
+            ("List[List[float]]", lambda: embeddings.embed_documents(texts)),
+            ("float32 matrix", lambda: embeddings.embed_documents_array(texts)),
+        ]
+        print(f"{args.chunks} chunks, dim={args.dim}")
+        for name, func in rows:
+            _, kept, peak = measure(func)
+            print(
+                f"{name:<18} resident {kept / args.chunks / 1024:7.1f} KiB/chunk  "
+                f"peak {peak / args.chunks / 1024:7.1f} KiB/chunk"
+            )
+    finally:
+        server.stop()
+    print(f"(raw float32 vector: {np.dtype(np.float32).itemsize * args.dim / 1024:.1f} KiB)")
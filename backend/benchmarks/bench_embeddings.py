@@ -0,0 +1,54 @@
+"""Compare serial and concurrent embedding against the local fake server.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_embeddings --texts 2000 --batch 100 --latency 0.2
+"""
+import argparse
+import time
+
+import numpy as np
+
+from fake_openai import FakeOpenAIServer
+from modify import OpenAIEmbeddings
+
+
+def run(texts, server, **kwargs):
+    embeddings = OpenAIEmbeddings(openai_api_key="fake", openai_api_base=server.url, **kwargs)
+    server.max_in_flight = 0
+    start = time.perf_counter()
+    vectors = embeddings.embed_documents(texts)
+    return time.perf_counter() - start, np.asarray(vectors), server.max_in_flight
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--rpm", type=int, default=None)
+    parser.add_argument("--tpm", type=int, default=None)
+    args = parser.parse_args()
+
+    texts = [f"chunk {i}: attention is all you need" for i in range(args.texts)]
+    server = FakeOpenAIServer(latency=args.latency).start()
+    try:
+        baseline = None
+        for concurrency in args.concurrency:
+            elapsed, vectors, in_flight = run(
+                texts,
+                server,
+                chunk_size=args.batch,
+                max_concurrency=concurrency,
+                requests_per_minute=args.rpm,
+                tokens_per_minute=args.tpm,
+            )
+            if baseline is None:
+                baseline = vectors
+            in_order = np.allclose(vectors, baseline)
+            print(
+                f"concurrency={concurrency:<3} {elapsed:7.2f}s "
+                f"{len(texts) / elapsed:8.1f} texts/s  max_in_flight={in_flight}  in_order={in_order}"
+            )
+    finally:
+        server.stop()
@@ -0,0 +1,38 @@
+"""Compare serial and multi-process PDF text extraction.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_pdf_extract --workers 2 4 8
+"""
+import argparse
+import os
+import time
+
+from ingest import iter_pdf_pages, iter_pdf_pages_parallel
+
+
+def extract(pages):
+    start = time.perf_counter()
+    texts = [(page.metadata["page"], page.page_content) for page in pages]
+    return time.perf_counter() - start, texts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", nargs="?", default=os.path.join("documents", "Attention is all you need.pdf"))
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, os.cpu_count() or 1])
+    parser.add_argument("--pages-per-task", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    serial, expected = min(extract(iter_pdf_pages(args.path)) for _ in range(args.repeat))
+    print(f"{len(expected)} pages from {args.path}")
+    print(f"serial       {serial:7.3f}s  {len(expected) / serial:8.1f} pages/s")
+    for workers in args.workers:
+        elapsed, texts = min(
+            extract(iter_pdf_pages_parallel(args.path, workers, args.pages_per_task))
+            for _ in range(args.repeat)
+        )
+        print(
+            f"workers={workers:<4} {elapsed:7.3f}s  {len(texts) / elapsed:8.1f} pages/s  "
+            f"speedup={serial / elapsed:4.2f}x  identical={texts == expected}"
+        )
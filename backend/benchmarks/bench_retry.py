@@ -0,0 +1,132 @@
+"""Exercise retries, rate limiting, batch splitting and the circuit breaker of OpenAIEmbeddings.
+
+Each scenario embeds the same texts through the local fake server with a
+different kind of failure injected, and reports wall time, what the server
+saw and the client's retry counters:
+
+* rate_limits: a fraction of requests answered 429 with Retry-After,
+* server_errors: a fraction of requests answered 500/503,
+* rpm_budget: a real requests-per-minute budget the client learns from
+  the x-ratelimit-* headers,
+* batch_size: requests over a token limit rejected as too large,
+* outage: every request fails until the circuit opens, calls then fail
+  fast, and the circuit closes again once the server recovers.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_retry --texts 2000 --batch 50 --concurrency 4
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from fake_openai import FakeOpenAIServer
+from modify import OpenAIEmbeddings
+from retry import CircuitOpenError
+
+
+def make_embeddings(server, args, **kwargs):
+    return OpenAIEmbeddings(
+        openai_api_key="fake",
+        openai_api_base=server.url,
+        chunk_size=args.batch,
+        max_concurrency=args.concurrency,
+        retry_base_delay=args.base_delay,
+        retry_max_delay=1.0,
+        **kwargs,
+    )
+
+
+def run(name, server_options, args, texts, **embedding_options):
+    server = FakeOpenAIServer(dim=args.dim, latency=args.latency, **server_options).start()
+    try:
+        embeddings = make_embeddings(server, args, **embedding_options)
+        start = time.perf_counter()
+        vectors = embeddings.embed_documents_array(texts)
+        elapsed = time.perf_counter() - start
+        assert vectors.shape == (len(texts), args.dim) and np.isfinite(vectors).all()
+        return {"scenario": name, "seconds": elapsed, "server": server.stats(),
+                "client": embeddings.retry_policy.stats()}
+    finally:
+        server.stop()
+
+
+def outage(args, texts):
+    """Fail every request, check calls fail fast once the circuit opens, then recover."""
+    server = FakeOpenAIServer(dim=args.dim, latency=args.latency, error_rate=1.0).start()
+    try:
+        embeddings = make_embeddings(server, args, max_retries=2,
+                                     circuit_failure_threshold=3, circuit_reset_timeout=1.0)
+        failures = []
+        for text in texts[:10]:
+            start = time.perf_counter()
+            try:
+                embeddings.embed_query(text)
+            except CircuitOpenError:
+                failures.append(("circuit_open", time.perf_counter() - start))
+            except Exception:
+                failures.append(("api_error", time.perf_counter() - start))
+        requests_during_outage = server.stats()["requests"]
+
+        server.error_rate = 0.0
+        time.sleep(1.0)
+        start = time.perf_counter()
+        embeddings.embed_query("recovered")
+        fast = [seconds for kind, seconds in failures if kind == "circuit_open"]
+        return {
+            "scenario": "outage",
+            "api_errors": sum(kind == "api_error" for kind, _ in failures),
+            "failed_fast": len(fast),
+            "fail_fast_ms": float(np.mean(fast) * 1000) if fast else None,
+            "requests_during_outage": requests_during_outage,
+            "recovery_seconds": time.perf_counter() - start,
+            "client": embeddings.retry_policy.stats(),
+        }
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--base-delay", type=float, default=0.05, help="first retry backoff window")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--json", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    texts = [f"chunk {i}: attention is all you need" for i in range(args.texts)]
+    batches = -(-args.texts // args.batch)
+    results = [
+        run("baseline", {}, args, texts),
+        run("rate_limits", {"rate_limit_rate": 0.3, "retry_after": 0.2}, args, texts),
+        run("server_errors", {"error_rate": 0.3, "error_status": 503}, args, texts),
+        # A budget of half the batches per minute would stall for a minute, so allow them all
+        # and let the client learn the remaining budget from the headers
+        run("rpm_budget", {"requests_per_minute": batches + args.concurrency}, args, texts),
+        # Texts are about 15 tokens, so a full batch is about 1.5 times the limit
+        run("batch_size", {"max_batch_tokens": args.batch * 10}, args, texts),
+        outage(args, texts),
+    ]
+    for result in results:
+        client = result["client"]
+        line = f"{result['scenario']:<14}"
+        if "seconds" in result:
+            line += (f" {result['seconds']:6.2f}s  server: {result['server']['requests']:4} requests, "
+                     f"{result['server']['rate_limited']:3} x 429, {result['server']['errors']:3} x 5xx")
+        else:
+            line += (f" {result['api_errors']} API errors, then {result['failed_fast']} calls failed fast "
+                     f"in {result['fail_fast_ms'] or 0:.2f} ms, {result['requests_during_outage']} requests "
+                     f"reached the server; recovered in {result['recovery_seconds'] * 1000:.0f} ms")
+        print(line)
+        print(f"{'':<14} client: {client['retries']} retries, {client['split_batches']} splits, "
+              f"{client['gave_up']} gave up, circuit {client['circuit']['state']} "
+              f"(opened {client['circuit']['opened']}x), "
+              f"{client['rate_limiter']['pauses']} pauses, {client['rate_limiter']['waits']} budget waits, "
+              f"learned rpm {client['rate_limiter']['requests_per_minute']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
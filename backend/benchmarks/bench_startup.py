@@ -0,0 +1,164 @@
+"""Cold start of main.py: import, startup and first question, with an import-time profile.
+
+Every run is a fresh interpreter started with ``python -X importtime``, like
+a new worker. It reports, averaged over the runs:
+
+* import: ``import main``,
+* ready: import plus the app's startup, when the server accepts requests,
+* first question: the first /ask_question on a collection persisted by an
+  earlier process, answered through the local fake OpenAI server,
+
+and a profile of the imports, per phase and grouped by top-level package,
+so it is visible what each phase loads and which packages stay unloaded
+until a feature needs them.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_startup --runs 5 --pdf ../documents/report.pdf
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+import numpy as np
+
+from fake_openai import FakeOpenAIServer
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Packages whose presence in sys.modules is reported after each phase
+HEAVY = ["langchain", "openai", "chromadb", "pandas", "duckdb", "PyPDF2", "tiktoken", "numpy"]
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+_SETUP = """
+import main
+main.registry.get("default").load_document({pdf!r})
+main.registry.close_all()
+"""
+
+_RUN = """
+import json, sys, time
+
+def loaded():
+    return [name for name in {heavy!r} if name in sys.modules]
+
+def mark(phase):
+    print("### " + phase, file=sys.stderr, flush=True)
+
+result = {{}}
+start = time.perf_counter()
+import main
+result["import_s"] = time.perf_counter() - start
+result["loaded_after_import"] = loaded()
+mark("startup")
+
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    result["ready_s"] = time.perf_counter() - start
+    result["loaded_when_ready"] = loaded()
+    if {ask!r}:
+        mark("first question")
+        asked = time.perf_counter()
+        response = client.post("/ask_question", params={{"query": "What is this about?"}})
+        assert response.status_code == 200 and "answer" in response.json(), response.text
+        result["first_question_s"] = time.perf_counter() - asked
+        result["loaded_after_question"] = loaded()
+print(json.dumps(result))
+"""
+
+
+def run_child(code, workdir, env, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    process = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    if process.returncode:
+        sys.exit(f"child process failed:\n{process.stderr[-3000:]}")
+    return process.stdout, process.stderr
+
+
+def parse_importtime(stderr):
+    """Self time in seconds per module, split into phases by the child's ### markers."""
+    phases = defaultdict(list)
+    phase = "import"
+    for line in stderr.splitlines():
+        if line.startswith("### "):
+            phase = line[4:]
+            continue
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            phases[phase].append((module, int(self_us) / 1e6, int(cumulative_us) / 1e6, len(indent)))
+    return phases
+
+
+def by_package(entries):
+    totals = defaultdict(float)
+    for module, self_s, _, _ in entries:
+        totals[module.split(".")[0]] += self_s
+    return totals
+
+
+def report(results, profiles, top):
+    print(f"cold start over {len(results)} runs")
+    for key, label in [("import_s", "import main"), ("ready_s", "ready"), ("first_question_s", "first question")]:
+        values = [result[key] for result in results if key in result]
+        if values:
+            print(f"  {label:<16} mean {np.mean(values) * 1000:8.1f} ms, "
+                  f"min {np.min(values) * 1000:8.1f} ms")
+    last = results[-1]
+    for key in ("loaded_after_import", "loaded_when_ready", "loaded_after_question"):
+        if key in last:
+            print(f"  {key.replace('_', ' '):<24} {', '.join(last[key]) or '-'}")
+
+    for phase in profiles[0]:
+        totals = defaultdict(float)
+        for profile in profiles:
+            for package, seconds in by_package(profile.get(phase, [])).items():
+                totals[package] += seconds / len(profiles)
+        print(f"\nimports during {phase}: {sum(totals.values()) * 1000:.1f} ms, top packages by self time")
+        for package, seconds in sorted(totals.items(), key=lambda item: -item[1])[:top]:
+            print(f"  {package:<28} {seconds * 1000:8.1f} ms")
+
+    print("\nslowest modules of the last run (self / cumulative)")
+    entries = [entry for phase_entries in profiles[-1].values() for entry in phase_entries]
+    for module, self_s, cumulative_s, _ in sorted(entries, key=lambda entry: -entry[1])[:top]:
+        print(f"  {module:<48} {self_s * 1000:8.1f} ms / {cumulative_s * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--pdf", help="PDF indexed before the runs; without it no question is asked")
+    parser.add_argument("--top", type=int, default=15, help="rows of each profile table")
+    parser.add_argument("--prewarm", type=int, default=0, help="PREWARM_COLLECTIONS of the runs")
+    parser.add_argument("--output", help="write the timings and profiles to this JSON file")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(latency=0.01, dim=256, lexical=True).start()
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(os.environ, OPENAI_API_BASE=server.url, OPENAI_API_KEY="fake",
+               PREWARM_COLLECTIONS=str(args.prewarm),
+               PYTHONPATH=os.pathsep.join(filter(None, [BACKEND, os.environ.get("PYTHONPATH")])))
+    try:
+        if args.pdf:
+            run_child(_SETUP.format(pdf=os.path.abspath(args.pdf)), workdir, env)
+        results, profiles = [], []
+        for _ in range(args.runs):
+            stdout, stderr = run_child(_RUN.format(heavy=HEAVY, ask=bool(args.pdf)), workdir, env,
+                                       importtime=True)
+            results.append(json.loads(stdout.strip().splitlines()[-1]))
+            profiles.append(parse_importtime(stderr))
+        report(results, profiles, args.top)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"runs": results,
+                           "profile": {phase: dict(by_package(entries))
+                                       for phase, entries in profiles[-1].items()}}, f, indent=2)
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,125 @@
+"""Tokenizer overhead of embedding queries and chunks, with the network call excluded.
+
+The OpenAI client is replaced by an in-process stub that returns a canned
+response, so the timings are only what OpenAIEmbeddings does around the
+request: resolving the encoding, tokenizing, batching and decoding. Three
+measurements:
+
+* per query: embed_query before (encoding looked up and text tokenized on
+  every call, as the previous code did) and now,
+* per batch: tokenizing a batch of chunks serially and on tiktoken's threads,
+* packing: counting the tokens of retrieved chunks on every question versus
+  the TokenCounter cache and the counts stored in chunk metadata.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_tokenizer --queries 2000 --chunks 5000 --threads 1 4
+"""
+import argparse
+import base64
+import random
+import time
+
+import numpy as np
+import tiktoken
+from langchain.docstore.document import Document
+
+from context import pack_context
+from modify import OpenAIEmbeddings
+from tokenizer import TokenCounter, encode_batch, get_encoding
+
+MODEL = "text-embedding-ada-002"
+
+_WORDS = ["attention", "model", "layer", "sequence", "보고서", "시장", "encoder", "budget", "query", "정책"]
+
+
+class LocalClient:
+    """Stands in for ``openai.Embedding`` and answers without a network round trip."""
+
+    def __init__(self, dim):
+        self.row = base64.b64encode(np.ones(dim, dtype=np.float32).tobytes()).decode("ascii")
+
+    def create(self, input, **kwargs):
+        return {"data": [{"embedding": self.row} for _ in input]}
+
+
+def text(rng, words):
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def legacy_tokenize(texts, ctx_length=8191):
+    """Tokenization as OpenAIEmbeddings did it before the encoding was cached."""
+    tokens = []
+    indices = []
+    encoding = tiktoken.model.encoding_for_model(MODEL)
+    for i, value in enumerate(texts):
+        value = value.replace("\n", " ")
+        token = encoding.encode(value, disallowed_special=())
+        for j in range(0, len(token), ctx_length):
+            tokens += [token[j : j + ctx_length]]
+            indices += [i]
+    return tokens, indices
+
+
+def per_call_us(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--chunk-words", type=int, default=180)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    queries = [text(rng, 12) for _ in range(args.queries)]
+    chunks = [text(rng, args.chunk_words) for _ in range(args.chunks)]
+
+    embeddings = OpenAIEmbeddings(openai_api_key="fake")
+    embeddings.client = LocalClient(args.dim)
+    embed_legacy = embeddings.copy()
+    # The previous code path, with only the tokenizer swapped back
+    object.__setattr__(embed_legacy, "_tokenize", legacy_tokenize)
+    get_encoding(MODEL)
+
+    print(f"per query ({args.queries} calls, network excluded)")
+    for name, func in [
+        ("tokenize: legacy", lambda q: legacy_tokenize([q])),
+        ("tokenize: cached encoding", lambda q: embeddings._tokenize([q])),
+        ("embed_query: legacy", lambda q: OpenAIEmbeddings._embedding_func(embed_legacy, q, engine=MODEL)),
+        ("embed_query: now", lambda q: embeddings.embed_query(q)),
+    ]:
+        it = iter(queries * 2)
+        print(f"  {name:<28} {per_call_us(lambda: func(next(it)), args.queries):8.1f} us")
+
+    print(f"\nper batch ({args.chunks} chunks of {args.chunk_words} words)")
+    start = time.perf_counter()
+    legacy_tokenize(chunks)
+    print(f"  {'legacy loop':<28} {(time.perf_counter() - start) * 1000:8.1f} ms")
+    for threads in args.threads:
+        start = time.perf_counter()
+        encode_batch(get_encoding(MODEL), chunks, threads)
+        print(f"  {f'encode_batch, {threads} threads':<28} {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    # 20 candidates per question drawn from a small pool, as retrieval returns the same chunks often
+    pool = [Document(page_content=chunk) for chunk in chunks[:200]]
+    questions = [rng.sample(pool, 20) for _ in range(args.queries)]
+    encoding = get_encoding(MODEL)
+    counter = TokenCounter(MODEL)
+    stored = [
+        [Document(page_content=doc.page_content, metadata={"tokens": counter(doc.page_content)}) for doc in docs]
+        for docs in questions
+    ]
+    print(f"\ncontext packing ({args.queries} questions, 20 candidates each)")
+    for name, func in [
+        ("count every time", lambda i: pack_context(questions[i], 2000, lambda t: len(encoding.encode(t)))),
+        ("TokenCounter cache", lambda i: pack_context(questions[i], 2000, counter)),
+        ("metadata['tokens']", lambda i: pack_context(stored[i], 2000, counter)),
+    ]:
+        it = iter(range(args.queries))
+        print(f"  {name:<28} {per_call_us(lambda: func(next(it)), args.queries):8.1f} us")
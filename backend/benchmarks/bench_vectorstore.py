@@ -0,0 +1,75 @@
+"""Cold open and query latency of the memory-mapped vector store.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_vectorstore --rows 100000 --dim 1536
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from vectorstore import MemmapVectorStore
+
+
+class _NoEmbeddings:
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        raise NotImplementedError
+
+
+def query_latency(store, queries, k):
+    start = time.perf_counter()
+    results = [[doc.metadata["i"] for doc in store.similarity_search_by_vector(q, k=k)] for q in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--nprobe", type=int, default=8)
+    args = parser.parse_args()
+
+    # Clustered synthetic vectors, real embeddings are far from uniform
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((256, args.dim), dtype=np.float32)
+
+    def sample(n):
+        noise = rng.standard_normal((n, args.dim), dtype=np.float32)
+        return centers[rng.integers(len(centers), size=n)] + 0.5 * noise
+
+    directory = tempfile.mkdtemp(prefix="memmap_bench_")
+    try:
+        store = MemmapVectorStore(directory, _NoEmbeddings())
+        for start in range(0, args.rows, 10_000):
+            n = min(10_000, args.rows - start)
+            store.add_vectors(
+                [str(start + i) for i in range(n)],
+                sample(n),
+                [f"chunk {start + i}" for i in range(n)],
+                [{"i": start + i} for i in range(n)],
+            )
+        store.close()
+
+        start = time.perf_counter()
+        store = MemmapVectorStore(directory, _NoEmbeddings(), nprobe=args.nprobe, ivf_min_rows=0)
+        print(f"{args.rows} rows x {args.dim}: open {1000 * (time.perf_counter() - start):.1f} ms")
+
+        queries = sample(args.queries)
+        brute, exact = query_latency(store, queries, args.k)
+        print(f"brute force  {1000 * brute:7.2f} ms/query")
+
+        start = time.perf_counter()
+        store.build_ivf()
+        print(f"IVF build    {time.perf_counter() - start:7.2f} s")
+        ivf, approx = query_latency(store, queries, args.k)
+        recall = np.mean([len(set(a) & set(e)) / args.k for a, e in zip(approx, exact)])
+        print(f"IVF nprobe={args.nprobe:<3} {1000 * ivf:7.2f} ms/query  recall@{args.k}={recall:.2f}")
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,162 @@
+"""Collect the documents of a directory or archive for bulk ingestion."""
+from __future__ import annotations
+
+import hashlib
+import os
+import posixpath
+import tarfile
+import zipfile
+from typing import IO, Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+SUPPORTED_EXTENSIONS = (".pdf",)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Limits on what one archive may extract to, against zip bombs
+MAX_ARCHIVE_BYTES = 2 * 1024 * 1024 * 1024
+MAX_ARCHIVE_MEMBERS = 10_000
+
+
+class BulkFile(NamedTuple):
+    # Path relative to the directory or archive, '/'-separated; used as the source name
+    name: str
+    path: str
+    content_hash: str
+
+
+class ArchiveTooLarge(ValueError):
+    """An archive extracts to more bytes or members than allowed."""
+
+
+class CollectedFiles(NamedTuple):
+    files: List[BulkFile]
+    # Names of files left out because of their type or an unsafe path
+    skipped: List[str]
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 of a file, the same content hash uploads are stored under."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_archive(path: str) -> bool:
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def _safe_name(name: str) -> Optional[str]:
+    """Normalized relative member name, or None if it would leave the extraction directory."""
+    name = posixpath.normpath(name.replace("\\", "/"))
+    if name.startswith("/") or name == ".." or name.startswith("../") or ":" in name.split("/")[0]:
+        return None
+    return name
+
+
+def _archive_members(path: str) -> Iterator[Tuple[str, Optional[IO[bytes]]]]:
+    """Yield ``(name, file)`` for every regular file of a zip or tar archive."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as member:
+                        yield info.filename, member
+        return
+    with tarfile.open(path) as archive:
+        for info in archive:
+            # Links and devices are never extracted
+            if info.isfile():
+                yield info.name, archive.extractfile(info)
+
+
+def extract_archive(
+    path: str,
+    target: str,
+    extensions: Sequence[str] = SUPPORTED_EXTENSIONS,
+    max_bytes: int = MAX_ARCHIVE_BYTES,
+    max_members: int = MAX_ARCHIVE_MEMBERS,
+) -> CollectedFiles:
+    """Extract the supported files of a zip or tar archive into ``target``.
+
+    Members are streamed to disk one at a time; members with absolute paths
+    or ``..`` components are skipped rather than written outside ``target``.
+    Raises ``ArchiveTooLarge`` once more than ``max_members`` files are read
+    or more than ``max_bytes`` are written, counting the decompressed bytes
+    rather than the sizes the archive headers claim. Files extracted until
+    then are left in ``target``.
+    """
+    files, skipped = [], []
+    written = 0
+    for count, (raw_name, member) in enumerate(_archive_members(path), 1):
+        if count > max_members:
+            raise ArchiveTooLarge(f"Archive has more than {max_members} files")
+        name = _safe_name(raw_name)
+        if name is None or not name.lower().endswith(tuple(extensions)) or member is None:
+            skipped.append(raw_name)
+            continue
+        destination = os.path.join(target, *name.split("/"))
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        digest = hashlib.sha256()
+        with open(destination, "wb") as out:
+            for chunk in iter(lambda: member.read(HASH_CHUNK_SIZE), b""):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise ArchiveTooLarge(f"Archive extracts to more than {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+        files.append(BulkFile(name, destination, digest.hexdigest()))
+    return CollectedFiles(files, skipped)
+
+
+def collect_files(
+    path: str,
+    workdir: str,
+    name: Optional[str] = None,
+    extensions: Sequence[str] = SUPPORTED_EXTENSIONS,
+    max_bytes: int = MAX_ARCHIVE_BYTES,
+    max_members: int = MAX_ARCHIVE_MEMBERS,
+) -> CollectedFiles:
+    """Supported files under a directory, inside an archive, or ``path`` itself.
+
+    Directories are walked recursively in a stable order and their files are
+    read in place; archives are extracted into ``workdir``, which the caller
+    removes once the files are indexed, within the limits of
+    :func:`extract_archive`. ``name`` is the source name of a single file,
+    its base name by default.
+
+    Example:
+        .. code-block:: python
+
+            with tempfile.TemporaryDirectory() as workdir:
+                collected = collect_files("reports.zip", workdir)
+                chat.load_documents(collected.files)
+    """
+    if os.path.isdir(path):
+        files, skipped = [], []
+        for directory, subdirectories, names in os.walk(path):
+            subdirectories.sort()
+            for file_name in sorted(names):
+                file_path = os.path.join(directory, file_name)
+                relative = os.path.relpath(file_path, path).replace(os.sep, "/")
+                if file_name.lower().endswith(tuple(extensions)) and os.path.isfile(file_path):
+                    files.append(BulkFile(relative, file_path, file_hash(file_path)))
+                else:
+                    skipped.append(relative)
+        return CollectedFiles(files, skipped)
+    if is_archive(path):
+        os.makedirs(workdir, exist_ok=True)
+        return extract_archive(path, workdir, extensions, max_bytes, max_members)
+    name = name or os.path.basename(path)
+    if not name.lower().endswith(tuple(extensions)):
+        return CollectedFiles([], [name])
+    return CollectedFiles([BulkFile(name, path, file_hash(path))], [])
+
+
+def throughput(report: Dict[str, Any], seconds: float) -> Dict[str, Any]:
+    """Add the elapsed time and per-second rates of pages, chunks and added chunks."""
+    report["seconds"] = seconds
+    for key in ("pages", "chunks", "added"):
+        report[f"{key}_per_second"] = report.get(key, 0) / seconds if seconds > 0 else 0.0
+    return report
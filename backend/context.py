@@ -0,0 +1,126 @@
+"""Token-budgeted context packing for the "stuff" chain."""
+from __future__ import annotations
+
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from langchain.docstore.document import Document
+
+# Separator the stuff chain puts between documents
+DOCUMENT_SEPARATOR = "\n\n"
+
+# A chunk is a near-duplicate when this share of its word trigrams, or of the other
+# chunk's if that one is shorter, also occurs in the other chunk
+NEAR_DUPLICATE_CONTAINMENT = 0.9
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = text.lower().split()
+    return {tuple(words[i : i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def _containment(shingles_a: set, shingles_b: set) -> float:
+    return len(shingles_a & shingles_b) / min(len(shingles_a), len(shingles_b))
+
+
+def _text_overlap(a: str, b: str, probe: int = 50) -> Optional[int]:
+    """Length of the suffix of ``a`` that ``b`` starts with, if there is one."""
+    head = b[: min(len(b), probe)]
+    if not head:
+        return None
+    index = a.find(head)
+    while index >= 0:
+        if b.startswith(a[index:]):
+            return len(a) - index
+        index = a.find(head, index + 1)
+    return None
+
+
+def _same_page(a: Document, b: Document) -> bool:
+    return (
+        a.metadata.get("source") == b.metadata.get("source")
+        and a.metadata.get("page") == b.metadata.get("page")
+    )
+
+
+def _join(a: Document, b: Document) -> Optional[str]:
+    """Text of ``a`` followed by ``b`` if ``b`` continues ``a`` on the same page."""
+    if not _same_page(a, b):
+        return None
+    overlap = _text_overlap(a.page_content, b.page_content)
+    if overlap is not None:
+        return a.page_content + b.page_content[overlap:]
+    start_a, start_b = a.metadata.get("start_index"), b.metadata.get("start_index")
+    # Chunks split without overlap only touch, up to the separator dropped between them
+    if start_a is not None and start_b is not None and 0 <= start_b - (start_a + len(a.page_content)) <= 2:
+        return a.page_content + "\n" + b.page_content
+    return None
+
+
+def pack_context(
+    docs: Sequence[Document],
+    max_tokens: int,
+    count_tokens: Callable[[str], int],
+) -> Tuple[List[Document], int]:
+    """Select the chunks to stuff into the prompt, best first, within ``max_tokens``.
+
+    ``docs`` are ranked best first. Near-duplicates of better chunks are
+    dropped, chunks that continue each other on the same page are merged
+    into one passage, and passages are then taken in rank order as long as
+    they fit in the budget; a passage too large for the remaining budget is
+    skipped in favour of smaller, lower ranked ones. Chunks that carry their
+    size in ``metadata["tokens"]`` are not counted again.
+
+    Returns:
+        The packed documents and the number of context tokens they use,
+        separators included.
+    """
+    kept: List[Document] = []
+    # Shingles are built once per chunk, not once per comparison
+    kept_shingles: List[set] = []
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        if not any(_containment(shingles, other) >= NEAR_DUPLICATE_CONTAINMENT for other in kept_shingles):
+            kept.append(doc)
+            kept_shingles.append(shingles)
+
+    # Passages are (best rank, document); merge chains of adjacent chunks
+    passages: List[Tuple[int, Document]] = []
+    merged = [False] * len(kept)
+    by_position = sorted(
+        range(len(kept)),
+        key=lambda i: (
+            str(kept[i].metadata.get("source")),
+            str(kept[i].metadata.get("page")),
+            kept[i].metadata.get("start_index", -1),
+        ),
+    )
+    for position, i in enumerate(by_position):
+        if merged[i]:
+            continue
+        rank, doc = i, kept[i]
+        for j in by_position[position + 1 :]:
+            if merged[j]:
+                continue
+            text = _join(doc, kept[j])
+            if text is None:
+                break
+            metadata = {key: value for key, value in doc.metadata.items() if key != "tokens"}
+            doc = Document(page_content=text, metadata=metadata)
+            rank = min(rank, j)
+            merged[j] = True
+        passages.append((rank, doc))
+    passages.sort(key=lambda passage: passage[0])
+
+    packed: List[Document] = []
+    used = 0
+    separator = count_tokens(DOCUMENT_SEPARATOR)
+    for _, doc in passages:
+        size = doc.metadata.get("tokens")
+        if size is None:
+            size = count_tokens(doc.page_content)
+        tokens = size + (separator if packed else 0)
+        if used + tokens > max_tokens:
+            continue
+        packed.append(doc)
+        used += tokens
+    return packed, used
@@ -0,0 +1,434 @@
+"""Local stand-in for the OpenAI embeddings and chat completion endpoints.
+
+Serves deterministic vectors and replies with configurable artificial latency,
+rate limits and injected errors, so every OpenAI code path can be exercised
+and benchmarked without the live API. With ``lexical=True`` vectors are bags
+of tokens, so texts sharing words are close and retrieval quality can be
+compared too.
+
+Usage:
+    python fake_openai.py --port 8001 --latency 0.2 --rate-limit-rate 0.05
+    OPENAI_API_BASE=http://127.0.0.1:8001/v1 uvicorn main:app
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+_REPLY_WORDS = (
+    "the model attends to every position of the input sequence and combines "
+    "the values weighted by their similarity to the query which lets it learn "
+    "long range dependencies without recurrence"
+).split()
+
+
+def fake_embedding(value: Any, dim: int) -> np.ndarray:
+    """Return a unit float32 vector derived only from ``value``."""
+    seed = hashlib.md5(json.dumps(value).encode("utf-8")).digest()
+    rng = np.random.default_rng(int.from_bytes(seed[:8], "little"))
+    vector = rng.standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def lexical_embedding(value: Any, dim: int) -> np.ndarray:
+    """Return a unit float32 bag-of-tokens vector of ``value``.
+
+    ``value`` is a string or a list of token ids; strings are tokenized with the
+    ada-002 encoding so both forms of the same text give the same vector.
+    """
+    if isinstance(value, str):
+        import tiktoken
+
+        value = tiktoken.encoding_for_model("text-embedding-ada-002").encode(value)
+    tokens = np.unique(np.asarray(value, dtype=np.int64))
+    vector = np.zeros(dim, dtype=np.float32)
+    np.add.at(vector, (tokens * 2654435761) % dim, 1.0)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def fake_reply(prompt: Any, words: int) -> str:
+    """Return a reply of ``words`` words determined only by ``prompt``."""
+    seed = hashlib.md5(json.dumps(prompt).encode("utf-8")).digest()
+    rng = random.Random(seed)
+    return " ".join(rng.choice(_REPLY_WORDS) for _ in range(words))
+
+
+def _count_tokens(value: Any) -> int:
+    if isinstance(value, list):
+        return len(value)
+    return max(1, len(str(value)) // 4)
+
+
+class FakeOpenAIServer:
+    """Threaded HTTP server answering the OpenAI endpoints used by this app.
+
+    ``POST .../embeddings``, ``.../chat/completions`` (streamed or not) and
+    ``.../completions`` are served. ``rate_limit_rate`` and ``error_rate``
+    are the fractions of requests answered with a 429 (with ``Retry-After``)
+    or an ``error_status`` error; ``requests_per_minute`` additionally
+    enforces a real budget and reports it in ``x-ratelimit-*`` headers, and
+    embedding requests over ``max_batch_tokens`` tokens are rejected with a
+    400 as too large. Error injection is seeded, so a run with the same
+    settings fails the same requests. The rates can be changed while the
+    server runs, e.g. ``error_rate = 1.0`` to simulate an outage, and
+    :meth:`fail_next` scripts the outcome of the next requests exactly.
+
+    Example:
+        .. code-block:: python
+
+            server = FakeOpenAIServer(latency=0.1).start()
+            embeddings = OpenAIEmbeddings(openai_api_base=server.url)
+            ...
+            server.stop()
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        dim: int = 1536,
+        lexical: bool = False,
+        reply_words: int = 40,
+        token_latency: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        retry_after: float = 1.0,
+        requests_per_minute: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
+        seed: int = 0,
+        stall: float = 5.0,
+    ):
+        self.latency = latency
+        self.dim = dim
+        self.lexical = lexical
+        self.reply_words = reply_words
+        self.token_latency = token_latency
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.requests_per_minute = requests_per_minute
+        self.max_batch_tokens = max_batch_tokens
+        self.stall = stall
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.tokens = 0
+        self._random = random.Random(seed)
+        self._recent: Deque[float] = deque()
+        self._scripted: Deque[Union[int, str]] = deque()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def fail_next(self, *failures: Union[int, str]) -> None:
+        """Answer the next requests with ``failures``, in order, before any random ones.
+
+        A failure is an HTTP status, e.g. 429 (sent with ``retry_after``) or
+        503, or ``"timeout"`` to hold the response for ``stall`` seconds so a
+        client with a shorter timeout gives up on it.
+        """
+        with self._lock:
+            self._scripted.extend(failures)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "rate_limited": self.rate_limited,
+                "errors": self.errors,
+                "max_in_flight": self.max_in_flight,
+                "tokens": self.tokens,
+            }
+
+    def _admit(self) -> Tuple[Optional[Union[int, str]], Dict[str, str]]:
+        """Status of an injected failure (or ``None``) and the rate limit headers."""
+        now = time.monotonic()
+        with self._lock:
+            headers: Dict[str, str] = {}
+            if self._scripted:
+                status = self._scripted.popleft()
+                if status == "timeout":
+                    return status, headers
+                if status == 429:
+                    self.rate_limited += 1
+                    headers["Retry-After"] = str(self.retry_after)
+                else:
+                    self.errors += 1
+                return status, headers
+            if self.requests_per_minute:
+                while self._recent and self._recent[0] <= now - 60:
+                    self._recent.popleft()
+                remaining = self.requests_per_minute - len(self._recent)
+                reset = 60 - (now - self._recent[0]) if self._recent else 0.0
+                headers = {
+                    "x-ratelimit-limit-requests": str(self.requests_per_minute),
+                    "x-ratelimit-remaining-requests": str(max(0, remaining - 1)),
+                    "x-ratelimit-reset-requests": f"{reset:.3f}s",
+                }
+                if remaining <= 0:
+                    self.rate_limited += 1
+                    headers["Retry-After"] = f"{reset:.3f}"
+                    return 429, headers
+                self._recent.append(now)
+            draw = self._random.random()
+            if draw < self.rate_limit_rate:
+                self.rate_limited += 1
+                headers["Retry-After"] = str(self.retry_after)
+                return 429, headers
+            if draw < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return self.error_status, headers
+            return None, headers
+
+    def _count(self, tokens: int) -> None:
+        with self._lock:
+            self.tokens += tokens
+
+    @staticmethod
+    def _inputs(payload: Dict[str, Any]) -> List[Any]:
+        inputs = payload.get("input", [])
+        if not isinstance(inputs, list) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        return inputs
+
+    def too_large(self, payload: Dict[str, Any]) -> Optional[int]:
+        """Token count of an embedding request over ``max_batch_tokens``, else ``None``."""
+        if not self.max_batch_tokens:
+            return None
+        tokens = sum(_count_tokens(value) for value in self._inputs(payload))
+        return tokens if tokens > self.max_batch_tokens else None
+
+    def embeddings(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        inputs = self._inputs(payload)
+        as_base64 = payload.get("encoding_format") == "base64"
+        data: List[Dict[str, Any]] = []
+        for i, value in enumerate(inputs):
+            vector = lexical_embedding(value, self.dim) if self.lexical else fake_embedding(value, self.dim)
+            embedding = (
+                base64.b64encode(vector.tobytes()).decode("ascii")
+                if as_base64
+                else vector.tolist()
+            )
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(_count_tokens(value) for value in inputs)
+        self._count(tokens)
+        return {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _usage(self, prompt: Any, reply: str) -> Dict[str, int]:
+        prompt_tokens = _count_tokens(json.dumps(prompt))
+        completion_tokens = _count_tokens(reply)
+        self._count(prompt_tokens + completion_tokens)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def chat_completion(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        messages = payload.get("messages", [])
+        reply = fake_reply(messages, self.reply_words)
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-3.5-turbo"),
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}
+            ],
+            "usage": self._usage(messages, reply),
+        }
+
+    def chat_completion_chunks(self, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        messages = payload.get("messages", [])
+        reply = fake_reply(messages, self.reply_words)
+        self._usage(messages, reply)
+        base = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-3.5-turbo"),
+        }
+        words = reply.split(" ")
+        chunks = [dict(base, choices=[{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}])]
+        for i, word in enumerate(words):
+            content = word if i == 0 else " " + word
+            chunks.append(dict(base, choices=[{"index": 0, "delta": {"content": content}, "finish_reason": None}]))
+        chunks.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        return chunks
+
+    def completion(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = payload.get("prompt", "")
+        reply = fake_reply(prompt, self.reply_words)
+        return {
+            "id": "cmpl-fake",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "text-davinci-003"),
+            "choices": [{"text": reply, "index": 0, "logprobs": None, "finish_reason": "stop"}],
+            "usage": self._usage(prompt, reply),
+        }
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+                raw = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def _send_events(self, chunks: List[Dict[str, Any]], headers: Dict[str, str]) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                for chunk in chunks:
+                    if server.token_latency:
+                        time.sleep(server.token_latency)
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+            def _send_error(self, status: int, headers: Dict[str, str]) -> None:
+                if status == 429:
+                    error = {"message": "Rate limit reached for requests", "type": "requests",
+                             "code": "rate_limit_exceeded"}
+                else:
+                    error = {"message": "The server had an error while processing your request.",
+                             "type": "server_error", "code": None}
+                self._send_json(status, {"error": error}, headers)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    if server.latency:
+                        time.sleep(server.latency)
+                    status, headers = server._admit()
+                    if status == "timeout":
+                        time.sleep(server.stall)
+                        status = None
+                    if status is not None:
+                        self._send_error(status, headers)
+                    elif self.path.endswith("/embeddings"):
+                        tokens = server.too_large(payload)
+                        if tokens is not None:
+                            self._send_json(400, {"error": {
+                                "message": f"Request too large: {tokens} tokens, the maximum is "
+                                           f"{server.max_batch_tokens}.",
+                                "type": "invalid_request_error", "code": None}})
+                        else:
+                            self._send_json(200, server.embeddings(payload), headers)
+                    elif self.path.endswith("/chat/completions"):
+                        if payload.get("stream"):
+                            self._send_events(server.chat_completion_chunks(payload), headers)
+                        else:
+                            self._send_json(200, server.chat_completion(payload), headers)
+                    elif self.path.endswith("/completions"):
+                        self._send_json(200, server.completion(payload), headers)
+                    else:
+                        self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on the request, e.g. after a timeout
+                    self.close_connection = True
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--lexical", action="store_true", help="bag-of-tokens vectors instead of random ones")
+    parser.add_argument("--reply-words", type=int, default=40, help="words in every completion")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of injected errors")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of injected 429s")
+    parser.add_argument("--rpm", type=int, default=None, help="requests per minute before real 429s")
+    parser.add_argument("--max-batch-tokens", type=int, default=None, help="largest embedding request accepted")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stall", type=float, default=5.0, help="seconds a scripted timeout holds the response")
+    args = parser.parse_args()
+
+    fake = FakeOpenAIServer(
+        args.host,
+        args.port,
+        latency=args.latency,
+        dim=args.dim,
+        lexical=args.lexical,
+        reply_words=args.reply_words,
+        token_latency=args.token_latency,
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        requests_per_minute=args.rpm,
+        max_batch_tokens=args.max_batch_tokens,
+        seed=args.seed,
+        stall=args.stall,
+    )
+    print(f"Fake OpenAI server listening on {fake.url}")
+    fake.serve_forever()
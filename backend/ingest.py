@@ -0,0 +1,277 @@
+"""Streaming ingestion: page extract -> split -> embed batch -> upsert.
+
+Every stage runs in its own thread and hands items to the next one through a
+bounded queue, so only a few pages and batches are in memory at any time and
+the first batches are searchable while later pages are still being extracted.
+"""
+from __future__ import annotations
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TextSplitter
+
+from tokenizer import TokenCounter
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+def prefetch(iterable: Iterable[Any], maxsize: int = 4) -> Iterator[Any]:
+    """Run ``iterable`` in a background thread behind a bounded queue."""
+    items: "queue.Queue[Any]" = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as exc:  # forwarded to the consuming thread
+            put(_Failure(exc))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_pdf_pages(file_path: str) -> Iterator[Document]:
+    """Yield one ``Document`` per PDF page, like ``PyPDFLoader.load`` but lazily."""
+    import pypdf
+
+    with open(file_path, "rb") as pdf_file:
+        reader = pypdf.PdfReader(pdf_file)
+        for i, page in enumerate(reader.pages):
+            yield Document(
+                page_content=page.extract_text(),
+                metadata={"source": file_path, "page": i},
+            )
+
+
+# Parsed reader of the current document, kept per worker process
+_worker_reader: Dict[str, Any] = {}
+
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract the text of pages ``[start, end)``; runs inside a worker process."""
+    import pypdf
+
+    reader = _worker_reader.get(file_path)
+    if reader is None:
+        _worker_reader.clear()
+        reader = _worker_reader[file_path] = pypdf.PdfReader(file_path)
+    return [(i, reader.pages[i].extract_text()) for i in range(start, end)]
+
+
+def iter_pdf_pages_parallel(file_path: str, workers: int, pages_per_task: int = 8) -> Iterator[Document]:
+    """Like ``iter_pdf_pages`` but extracts page ranges across a process pool.
+
+    Pages are still yielded in page order with the same metadata, and only
+    ``2 * workers`` ranges are in flight so memory stays bounded.
+    """
+    import pypdf
+
+    with open(file_path, "rb") as pdf_file:
+        num_pages = len(pypdf.PdfReader(pdf_file).pages)
+
+    ranges = iter(
+        (start, min(start + pages_per_task, num_pages))
+        for start in range(0, num_pages, pages_per_task)
+    )
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: deque = deque()
+        for start, end in ranges:
+            pending.append(executor.submit(_extract_page_range, file_path, start, end))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            for i, text in pending.popleft().result():
+                yield Document(page_content=text, metadata={"source": file_path, "page": i})
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(executor.submit(_extract_page_range, file_path, *next_range))
+
+
+def token_text_splitter(
+    chunk_tokens: int = 256,
+    chunk_overlap: int = 32,
+    model_name: str = "text-embedding-ada-002",
+    token_counter: Optional[TokenCounter] = None,
+) -> TextSplitter:
+    """Recursive splitter whose chunk size and overlap are counted in tokens.
+
+    The same number of characters is a few tokens of English but several times
+    more of Korean, so a character budget gives chunks of very different cost.
+    Lengths here are measured with the tiktoken encoding of ``model_name``;
+    ``chunk_tokens=0`` returns the previous 500-character splitter. Chunks
+    record their ``start_index`` in the page so adjacent ones can be merged
+    again when building a prompt.
+
+    Lengths go through ``token_counter`` (a new :class:`TokenCounter` by
+    default), so separators and pieces measured again while merging are
+    not encoded twice.
+    """
+    if not chunk_tokens:
+        return RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=0, add_start_index=True)
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_tokens,
+        chunk_overlap=chunk_overlap,
+        length_function=token_counter or TokenCounter(model_name),
+        add_start_index=True,
+    )
+
+
+def batched(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch: List[Any] = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class IngestPipeline:
+    """Stream pages through splitting and embedding into a vector store.
+
+    Args:
+        embeddings: Embeddings used for the chunk batches.
+        text_splitter: Splitter applied to one page at a time.
+        batch_size: Number of chunks embedded and upserted together.
+        queue_size: Capacity of the queues between the stages.
+        stats: Optional dict to report progress into, e.g. a job's progress.
+        token_counter: Optional :class:`TokenCounter`; when given, every chunk
+            records its size in ``metadata["tokens"]`` so prompts can be
+            packed later without encoding it again.
+        embed_workers: Number of batches embedded at the same time. A batch
+            smaller than one embedding request is a single request, so this is
+            what keeps several requests in flight.
+
+    ``stats`` is updated while the pipeline runs and can be polled from other
+    threads to report progress.
+    """
+
+    def __init__(
+        self,
+        embeddings: Any,
+        text_splitter: Any,
+        batch_size: int = 256,
+        queue_size: int = 4,
+        stats: Optional[Dict[str, int]] = None,
+        token_counter: Optional[TokenCounter] = None,
+        embed_workers: int = 1,
+    ):
+        self.embeddings = embeddings
+        self.text_splitter = text_splitter
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.token_counter = token_counter
+        self.embed_workers = max(1, embed_workers)
+        self.ids: Set[str] = set()
+        self.stats: Dict[str, int] = stats if stats is not None else {}
+        self.stats.update({"pages": 0, "chunks": 0, "embedded": 0, "added": 0, "kept": 0})
+
+    def _split(self, pages: Iterable[Document]) -> Iterator[Document]:
+        for page in pages:
+            self.stats["pages"] += 1
+            chunks = self.text_splitter.split_documents([page])
+            if self.token_counter is not None:
+                counts = self.token_counter.count_many([chunk.page_content for chunk in chunks])
+                for chunk, count in zip(chunks, counts):
+                    chunk.metadata["tokens"] = count
+            for chunk in chunks:
+                self.stats["chunks"] += 1
+                yield chunk
+
+    def _select(
+        self,
+        chunks: Iterable[Document],
+        chunk_id: Callable[[Document], str],
+        is_stored: Callable[[str], bool],
+    ) -> Iterator[Any]:
+        # Skip repeated chunks and chunks the store already holds
+        for chunk in chunks:
+            id_ = chunk_id(chunk)
+            if id_ in self.ids:
+                continue
+            self.ids.add(id_)
+            if is_stored(id_):
+                self.stats["kept"] += 1
+                continue
+            yield id_, chunk
+
+    def _embed_batch(self, batch: List[Any]) -> Tuple[List[str], List[Document], Any]:
+        ids = [id_ for id_, _ in batch]
+        docs = [doc for _, doc in batch]
+        texts = [doc.page_content for doc in docs]
+        # Keep vectors as one float32 matrix when the embeddings support it
+        if hasattr(self.embeddings, "embed_documents_array"):
+            vectors = self.embeddings.embed_documents_array(texts)
+        else:
+            vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        return ids, docs, vectors
+
+    def _embed(self, batches: Iterable[List[Any]]) -> Iterator[Any]:
+        # Up to embed_workers batches are embedded at once and yielded in order
+        with ThreadPoolExecutor(max_workers=self.embed_workers) as executor:
+            pending: deque = deque()
+            try:
+                for batch in batches:
+                    pending.append(executor.submit(self._embed_batch, batch))
+                    if len(pending) >= self.embed_workers:
+                        yield self._embedded(pending.popleft().result())
+                while pending:
+                    yield self._embedded(pending.popleft().result())
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _embedded(self, result: Tuple[List[str], List[Document], Any]) -> Any:
+        self.stats["embedded"] += len(result[0])
+        return result
+
+    def run(
+        self,
+        pages: Iterable[Document],
+        chunk_id: Callable[[Document], str],
+        is_stored: Callable[[str], bool],
+        upsert: Callable[[List[str], List[Document], Any], None],
+    ) -> Dict[str, int]:
+        """Consume ``pages`` and ``upsert`` every new chunk batch as soon as it is embedded."""
+        pages = prefetch(pages, self.queue_size)
+        chunks = prefetch(self._split(pages), self.queue_size * self.batch_size)
+        new_chunks = self._select(chunks, chunk_id, is_stored)
+        embedded = prefetch(self._embed(batched(new_chunks, self.batch_size)), self.queue_size)
+        for ids, docs, vectors in embedded:
+            upsert(ids, docs, vectors)
+            self.stats["added"] += len(ids)
+        return self.stats
@@ -0,0 +1,93 @@
+"""Background job queue for ingestion work."""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """State of one background job.
+
+    ``progress`` is a plain dict the job function updates in place (e.g. the
+    ingest pipeline's page and chunk counters) and is reported as-is.
+    """
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """Run job functions on a bounded worker pool and keep their status.
+
+    Args:
+        workers: Number of jobs running at the same time.
+        max_jobs: Number of jobs remembered; the oldest finished ones are dropped.
+    """
+
+    def __init__(self, workers: int = 2, max_jobs: int = 1000):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, func: Callable[[Job], Any]) -> Job:
+        """Queue ``func(job)``; its return value becomes the job result."""
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        self._executor.submit(self._run, job, func)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job, func: Callable[[Job], Any]) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = func(job)
+            job.status = "done"
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job.id, job.kind)
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _trim(self) -> None:
+        finished = [id_ for id_, job in self._jobs.items() if job.finished_at is not None]
+        for id_ in finished[: max(0, len(self._jobs) - self.max_jobs)]:
+            del self._jobs[id_]
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,162 @@
+"""Local BM25 index of chunk texts and reciprocal rank fusion."""
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+from langchain.docstore.document import Document
+
+LEXICAL_INDEX_FILE = "lexical.sqlite3"
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+_HANGUL = re.compile(r"[가-힣]")
+
+
+def query_terms(query: str) -> List[str]:
+    """Lowercased word terms of ``query``, without duplicates."""
+    return list(dict.fromkeys(term.lower() for term in _TERM.findall(query)))
+
+
+def _match_expression(terms: Sequence[str]) -> str:
+    clauses = []
+    for term in terms:
+        clauses.append('"%s"' % term.replace('"', '""'))
+        # Korean attaches particles to words (코드는, 코드가), a prefix of the stem matches both
+        if len(term) > 2 and _HANGUL.search(term[-1]):
+            clauses.append('"%s"*' % term[:-1].replace('"', '""'))
+    return " OR ".join(clauses)
+
+
+class BM25Index:
+    """SQLite FTS5 inverted index over chunk texts, ranked by BM25.
+
+    Chunks are stored under the same ids as in the vector store, with their
+    page number so a search can be restricted to a page range before ranking.
+    Searching needs no embedding call. ``persist_directory=None`` keeps the
+    index in memory.
+
+    Example:
+        .. code-block:: python
+
+            index = BM25Index("db_index/default")
+            index.add(ids, docs)
+            docs = index.search("gpt-3.5-turbo context length", k=4)
+    """
+
+    def __init__(self, persist_directory: Optional[str]):
+        self.path = ":memory:"
+        if persist_directory is not None:
+            os.makedirs(persist_directory, exist_ok=True)
+            self.path = os.path.join(persist_directory, LEXICAL_INDEX_FILE)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " row INTEGER PRIMARY KEY,"
+            " id TEXT UNIQUE NOT NULL,"
+            " page INTEGER,"
+            " metadata TEXT NOT NULL);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5("
+            " document, tokenize = 'unicode61 remove_diacritics 2');"
+        )
+        self._conn.commit()
+
+    def add(self, ids: Sequence[str], docs: Sequence[Document]) -> None:
+        """Index ``docs`` under ``ids``, replacing chunks already stored with the same id."""
+        with self._lock:
+            self._delete(ids)
+            for id_, doc in zip(ids, docs):
+                cursor = self._conn.execute(
+                    "INSERT INTO chunks (id, page, metadata) VALUES (?, ?, ?)",
+                    (id_, doc.metadata.get("page"), json.dumps(doc.metadata, ensure_ascii=False)),
+                )
+                self._conn.execute(
+                    "INSERT INTO chunks_fts (rowid, document) VALUES (?, ?)",
+                    (cursor.lastrowid, doc.page_content),
+                )
+            self._conn.commit()
+
+    def _delete(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i : i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = [(row,) for (row,) in self._conn.execute(
+                f"SELECT row FROM chunks WHERE id IN ({placeholders})", batch
+            )]
+            self._conn.executemany("DELETE FROM chunks_fts WHERE rowid = ?", rows)
+            self._conn.executemany("DELETE FROM chunks WHERE row = ?", rows)
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def search(
+        self,
+        query: str,
+        k: int = 4,
+        page_range: Optional[Tuple[Optional[int], Optional[int]]] = None,
+    ) -> List[Document]:
+        """Best ``k`` chunks for ``query`` by BM25, optionally within 0-indexed pages ``[start, end)``."""
+        terms = query_terms(query)
+        if not terms:
+            return []
+        sql = (
+            "SELECT chunks_fts.document, chunks.metadata FROM chunks_fts"
+            " JOIN chunks ON chunks.row = chunks_fts.rowid"
+            " WHERE chunks_fts MATCH ?"
+        )
+        params: List[Any] = [_match_expression(terms)]
+        start, end = page_range or (None, None)
+        if start is not None:
+            sql += " AND chunks.page >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND chunks.page < ?"
+            params.append(end)
+        sql += " ORDER BY bm25(chunks_fts) LIMIT ?"
+        params.append(k)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [Document(page_content=text, metadata=json.loads(metadata)) for text, metadata in rows]
+
+    def resident_bytes(self) -> int:
+        """SQLite page cache held for this index (FTS data itself stays on disk)."""
+        with self._lock:
+            pages = self._conn.execute("PRAGMA cache_size").fetchone()[0]
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        return -pages * 1024 if pages < 0 else pages * page_size
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Document]],
+    k: int,
+    key: Callable[[Document], Hashable],
+    c: int = 60,
+) -> List[Document]:
+    """Merge ranked lists by reciprocal rank fusion, ``score = sum(1 / (c + rank))``.
+
+    Documents are matched across lists by ``key``; the first occurrence is kept.
+    """
+    scores: Dict[Hashable, float] = {}
+    documents: Dict[Hashable, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            id_ = key(doc)
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (c + rank)
+            documents.setdefault(id_, doc)
+    best = sorted(scores, key=scores.__getitem__, reverse=True)[:k]
+    return [documents[id_] for id_ in best]
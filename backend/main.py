@@ -1,25 +1,59 @@
 import os
+import json
+import logging
 import hashlib
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from functools import lru_cache, wraps
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from langchain.document_loaders import TextLoader, PyPDFLoader
-from langchain.chat_models import ChatOpenAI
-from langchain.docstore.document import Document
-from langchain.chains.summarize import load_summarize_chain
-from modify import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
-from langchain.chains import RetrievalQA
-from langchain.text_splitter import CharacterTextSplitter, RecursiveCharacterTextSplitter
-from PyPDF2 import PdfReader
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from jobs import JobQueue
+from registry import CollectionRegistry
+from metrics import LatencyRecorder, TokenRecorder
+from answer_cache import AnswerCache
+from rate_limit import RateLimiter
+from retry import CircuitOpenError
+from tokenizer import TokenCounter
+from uploads import UploadLimitMiddleware, save_upload
 from typing import List, Optional
 
-from langchain.agents import create_csv_agent
-from langchain.llms import OpenAI
-import pandas as pd
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# LangChain, OpenAI, Chroma, PyPDF2, pandas and DuckDB are imported where they are
+# first needed, not here: importing this module stays fast, so workers start quickly,
+# and the CSV stack (pandas, DuckDB, the pandas agent) is only loaded by CSV requests
+
+
+# Persisted collections are found at startup and opened on their first question;
+# the most used ones are opened ahead of it in the background
+def warm_start():
+    # Load the vector store stack now rather than on the first question
+    with _init_lock:
+        import vectorstore  # noqa: F401
+    found = registry.discover()
+    logger.info("Found %d persisted collections in %s", len(found), registry.root)
+    if PREWARM_COLLECTIONS and found:
+        registry.prewarm(PREWARM_COLLECTIONS, lambda chat: chat.warm())
+
+
+# Discovery needs the vector store module, so it runs in the background too and the
+# server accepts requests as soon as this module is imported. A legacy index is moved
+# first, before an upload to the default collection could create it empty
+@asynccontextmanager
+async def lifespan(app):
+    adopt_legacy_index(registry.root)
+    threading.Thread(target=warm_start, name="warm_start", daemon=True).start()
+    yield
+    registry.close_all()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS support
 app.add_middleware(
@@ -32,94 +66,503 @@ app.add_middleware(
 
 load_dotenv()  # load variables from .env file
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'embedding_cache.sqlite3')
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '100000'))
+# Concurrent embedding batches and the client-side budgets they share
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '1000'))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv('EMBEDDING_MAX_CONCURRENCY', '1'))
+EMBEDDING_RPM = int(os.getenv('EMBEDDING_RPM', '0')) or None
+EMBEDDING_TPM = int(os.getenv('EMBEDDING_TPM', '0')) or None
+# Number of chunks embedded and written to the index together while streaming
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '256'))
+# Ingest batches embedded at once. A batch takes ceil(INGEST_BATCH_SIZE / EMBEDDING_BATCH_SIZE)
+# requests, so this keeps EMBEDDING_MAX_CONCURRENCY requests in flight while ingesting
+INGEST_EMBED_WORKERS = max(1, EMBEDDING_MAX_CONCURRENCY // -(-INGEST_BATCH_SIZE // EMBEDDING_BATCH_SIZE))
+# Threads tokenizing large batches of chunks, tiktoken releases the GIL while encoding
+TOKENIZER_THREADS = int(os.getenv('TOKENIZER_THREADS', '1'))
+# Worker processes for PDF text extraction, 1 extracts in the calling thread
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', '1'))
+# Chunk size and overlap in tokens, CHUNK_TOKENS=0 keeps the old 500-character chunks
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '256'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '32'))
+# Ingestion jobs running at the same time
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '2'))
+# Memory budget for open collections, least recently used ones are closed first
+COLLECTION_CACHE_MB = int(os.getenv('COLLECTION_CACHE_MB', '512'))
+# Vector store for new collections: "chroma" or "memmap" (memory-mapped float32 vectors)
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma')
+# Retrieval for questions: "vector", "lexical" (BM25 only, no query embedding) or
+# "hybrid" (both, merged by reciprocal rank fusion)
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid')
+RETRIEVAL_MODES = ('vector', 'lexical', 'hybrid')
+# Candidates taken from each retriever before fusing them into the final k
+RETRIEVAL_FETCH_K = int(os.getenv('RETRIEVAL_FETCH_K', '20'))
+# Tokens of retrieved context stuffed into the prompt. Candidates are deduplicated,
+# adjacent chunks merged and the best ones packed up to this budget; 0 uses the top k as is
+CONTEXT_TOKENS = int(os.getenv('CONTEXT_TOKENS', '2000'))
+
+# Answers to repeated questions, optionally matched by query embedding similarity
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '3600'))
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.getenv('ANSWER_CACHE_SEMANTIC_THRESHOLD', '0')) or None
+
+# Map-reduce summaries: cached map/reduce outputs, concurrent calls and their budgets
+SUMMARY_CACHE_PATH = os.getenv('SUMMARY_CACHE_PATH', 'summary_cache.sqlite3')
+SUMMARY_MAX_CONCURRENCY = int(os.getenv('SUMMARY_MAX_CONCURRENCY', '4'))
+SUMMARY_RPM = int(os.getenv('SUMMARY_RPM', '0')) or None
+SUMMARY_TPM = int(os.getenv('SUMMARY_TPM', '0')) or None
+SUMMARY_GROUP_TOKENS = int(os.getenv('SUMMARY_GROUP_TOKENS', '3000'))
+
+# Collections opened and warmed in the background at startup, most used first
+PREWARM_COLLECTIONS = int(os.getenv('PREWARM_COLLECTIONS', '1'))
+
+# Largest accepted upload, refused before the body is read
+MAX_UPLOAD_MB = int(os.getenv('MAX_UPLOAD_MB', '200'))
+# Limits on what one uploaded zip/tar archive may extract to
+MAX_ARCHIVE_MB = int(os.getenv('MAX_ARCHIVE_MB', '2048'))
+MAX_ARCHIVE_FILES = int(os.getenv('MAX_ARCHIVE_FILES', '10000'))
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_MB * 1024 * 1024, paths=("/load_",))
+
+# Parquet copies and column statistics of uploaded CSV/Excel files
+TABLE_CACHE_DIR = os.getenv('TABLE_CACHE_DIR', 'table_cache')
+
+# Per-stage latency of the query path, reported by /metrics
+latency = LatencyRecorder()
+# Prompt tokens sent per question, reported by /metrics
+token_usage = TokenRecorder()
+
+
+# Chunks that were embedded before are served from the local cache
+def create_embeddings():
+    from embedding_cache import EmbeddingCache
+    from modify import OpenAIEmbeddings
+
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH,
+                                     max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+    return OpenAIEmbeddings(model=EMBEDDING_MODEL,
+                            cache=embedding_cache,
+                            chunk_size=EMBEDDING_BATCH_SIZE,
+                            max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+                            requests_per_minute=EMBEDDING_RPM,
+                            tokens_per_minute=EMBEDDING_TPM,
+                            tokenizer_threads=TOKENIZER_THREADS)
+
+
+# Summaries of chunks seen before are served from the local cache
+def create_summarizer(llm):
+    from summarize import MapReduceSummarizer, SummaryCache
+
+    rate_limiter = None
+    if SUMMARY_RPM or SUMMARY_TPM:
+        rate_limiter = RateLimiter(requests_per_minute=SUMMARY_RPM, tokens_per_minute=SUMMARY_TPM)
+    return MapReduceSummarizer(llm, cache=SummaryCache(SUMMARY_CACHE_PATH),
+                               max_concurrency=SUMMARY_MAX_CONCURRENCY,
+                               rate_limiter=rate_limiter,
+                               max_group_tokens=SUMMARY_GROUP_TOKENS)
 
 
 class Chat_With_PDFs_and_Summarize:
 
-    def __init__(self, model_name="gpt-3.5-turbo", temperature=0):
+    def __init__(self, model_name="gpt-3.5-turbo", temperature=0, extract_workers=PDF_EXTRACT_WORKERS,
+                 persist_directory="db_index", embeddings=None, llm_chat=None, llm_summarize=None,
+                 collection_id="default", answer_cache=None, llm_stream=None,
+                 vector_backend=VECTOR_BACKEND, retrieval_mode=RETRIEVAL_MODE, summarizer=None,
+                 table_cache=None, token_counter=None):
+
+        from ingest import token_text_splitter
+        from langchain.chat_models import ChatOpenAI
+        from vectorstore import detect_backend
 
-        # Initialize ChatOpenAI for summary and chat
-        self.llm_summarize = ChatOpenAI(model_name=model_name, temperature=temperature)
-        self.llm_chat = ChatOpenAI(model_name=model_name, temperature=temperature)
+        # Initialize ChatOpenAI for summary and chat, collections can share them
+        self.llm_summarize = llm_summarize or ChatOpenAI(model_name=model_name, temperature=temperature)
+        self.llm_chat = llm_chat or ChatOpenAI(model_name=model_name, temperature=temperature)
+        self.llm_stream = llm_stream or ChatOpenAI(model_name=model_name, temperature=temperature,
+                                                   streaming=True)
+        self.summarizer = summarizer or create_summarizer(self.llm_summarize)
+        # The table cache and planner load pandas and DuckDB, they are set up by the first CSV
+        self.table_cache = table_cache
+        self.table_planner = None
+        self.table = None
+        self.agent = None
 
         # Initialize varaibles to store document, pages and index information
         self.loader = None
         self.pages = None
         self.docs = None
         self.db_index = None
-        self.embeddings = OpenAIEmbeddings()
-        self.persist_directory = "db_index"
+        self.embeddings = embeddings or create_embeddings()
+        self.persist_directory = persist_directory
+        self.collection_id = collection_id
+        # Existing collections keep the backend they were written with
+        self.vector_backend = detect_backend(persist_directory, vector_backend)
+        self.answer_cache = answer_cache
+        # BM25 index of the same chunks, kept next to the vector store
+        self.lexical_index = None
+        self.retrieval_mode = retrieval_mode
         self.doc_hash = None
+        self.document_path = None
+        # Chunks are measured in tokens, so Korean and English text get the same budget
+        model = getattr(self.embeddings, "model", "text-embedding-ada-002")
+        # Token counts are cached and shared by the splitter, ingestion and context packing.
+        # The embedding and chat models both use the cl100k_base encoding
+        self.token_counter = token_counter or TokenCounter(model, num_threads=TOKENIZER_THREADS)
+        self.text_splitter = token_text_splitter(CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, model_name=model,
+                                                 token_counter=self.token_counter)
+        self.pipeline = None
+        self.extract_workers = extract_workers
+        # Ingestion jobs run on worker threads, index writes go one at a time
+        self._index_lock = threading.Lock()
+        # Opening the persisted index happens once, concurrent first users wait for it
+        self._open_lock = threading.Lock()
+        # Size reported to the registry, measured when the index is opened or written rather
+        # than on every lookup. on_resize is called after it grew, e.g. to trim the registry
+        self._size = 0
+        self.on_resize = None
+        # Chroma uses one DuckDB connection per store, which fails when two threads use it at once
+        self._store_lock = threading.Lock() if self.vector_backend == "chroma" else None
+        # RetrievalQA chain built on first query, rebuilt when the index changes
+        self._qa = None
+        self._qa_stream = None
+        self.index_version = 0
 
-    # Load a PDF document and split it into pages
-    def load_document(self, file_path, page_range=None):
-        # Load the document using PyPDFLoader
-        self.loader = PyPDFLoader(file_path)
+    # Open the persisted index of this collection on first use. Double-checked under
+    # _open_lock, so concurrent first questions and pre-warming open the stores once
+    def _open_index(self):
+        if self.db_index is None and os.path.exists(self.persist_directory):
+            opened = False
+            with self._open_lock:
+                if self.db_index is None:
+                    self._open_stores()
+                    opened = True
+            if opened:
+                self._resized()
+        return self.db_index
 
-        # Text Token cutting 방식으로 회귀 *한글이라 1000 -> 500 상황에 따라서 250도 가능?
-        self.pages = self.loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=0)
-        texts = text_splitter.split_documents(self.pages)
-        new_docs = [ t for t in texts]
+    # Called once no lock of this collection is held, so a trim can never wait on them
+    def _resized(self):
+        if self.on_resize is not None:
+            self.on_resize()
 
-        # Split the document into pages
-        # self.pages = self.loader.load_and_split()
+    def _open_stores(self):
+        from lexical import BM25Index
+        from vectorstore import open_vector_store, stored_documents
 
-        # if page_range is None:
-        #     new_docs = [Document(page_content=t.page_content) for t in self.pages]
-        # else:
-        #     new_docs = [Document(page_content=t.page_content) for t in self.pages[page_range[0]:page_range[1]]]
-        
-        # Calculate a hash for the Loaded documents
-        # new_hash = hashlib.md5(''.join([doc.page_content for doc in new_docs]).encode
-        #                        ()).hexdigest()
-        
-        # Check whether the db index already exists
-        # if not os.path.exists(self.persist_directory):
-        #     os.makedirs(self.persist_directory)
-        
-        # if os.path.exists(os.path.join(self.persist_directory, 'doc_hash.txt')):
-        #     with open(os.path.join(self.persist_directory, 'doc_hash.txt'), 'r') as f:
-        #         stored_hash = f.read().strip()
-            
-        #     if new_hash == stored_hash:
-        #         # Loading an existing index from disk
-        #         print("Loading the index from the disk...")
-        #         self.db_index = Chroma(persist_directory=self.persist_directory,
-        #                                embedding_function=self.embeddings)
-        #     else:
-        #         self.docs = new_docs
-        #         self.doc_hash = new_hash
-        #         # Create a new index
-        #         print("Creating a new index...")
-        #         self.db_index = Chroma.from_documents(self.docs, self.embeddings,
-        #                                               persist_directory=self.persist_directory)
-                
-        #         # Save the new Hash in the index directory
-        #         with open(os.path.join(self.persist_directory, 'doc_hash.txt'), 'w') as f:
-        #             f.write(self.doc_hash)
-        # else:
-        self.docs = new_docs
-        # self.doc_hash = new_hash
-        # Create a new Index
-        # print("Creating a new index...")
-        self.db_index = Chroma.from_documents(self.docs, self.embeddings,
-                                                persist_directory=self.persist_directory)
-        # Save the new Hash in the index directory
-        # with open(os.path.join(self.persist_directory, 'doc_hash.txt'), 'w') as f:
-        #     f.write(self.doc_hash)
-
-    # Generate a summary of the loaded document
-    def summarize(self, chain_type="map_reduce"):
+        db_index = open_vector_store(self.vector_backend, self.persist_directory, self.embeddings)
+        lexical_index = BM25Index(self.persist_directory)
+        # Collections indexed before the lexical index existed are backfilled once
+        if not lexical_index.count():
+            with self._store_access():
+                ids, docs = stored_documents(db_index)
+            lexical_index.add(ids, docs)
+        # The vector store is published last, whoever sees it also sees the lexical index
+        self.lexical_index = lexical_index
+        self.db_index = db_index
+        self._invalidate_index()
+        self._measure()
+
+    # Load the index and the vectors the first question would otherwise wait for
+    def warm(self):
+        from vectorstore import warm_up
+
+        if self._open_index() is None:
+            return
+        with self._store_access():
+            warm_up(self.db_index)
+        self._qa_chain()
+
+    # Serializes calls into the vector store when its backend is not thread-safe
+    def _store_access(self):
+        return self._store_lock or nullcontext()
+
+    # Used by the registry to decide which collections to close, without touching the stores
+    def estimated_bytes(self):
+        return self._size
+
+    def _measure(self):
+        from vectorstore import resident_bytes
+
+        with self._store_access():
+            self._size = resident_bytes(self.db_index) + self.lexical_index.resident_bytes()
+
+    def busy(self):
+        return self._index_lock.locked()
+
+    def close(self):
+        with self._index_lock, self._open_lock, self._store_access():
+            if self.db_index is not None and self.db_index._persist_directory:
+                self.db_index.persist()
+            if hasattr(self.db_index, 'close'):
+                self.db_index.close()
+            if self.lexical_index is not None:
+                self.lexical_index.close()
+            self.db_index = None
+            self.lexical_index = None
+            self.docs = None
+            self.pages = None
+            self._size = 0
+            self._invalidate_index()
+
+    # Stream a PDF document page by page into the index. Every page is indexed with its
+    # page number; questions about a page range filter on it instead of re-indexing
+    def load_document(self, file_path, progress=None, content_hash=None):
+        # Pages are extracted lazily and split one at a time
+        stats = self._sync_index(os.path.basename(file_path), self._iter_pages(file_path),
+                                 progress=progress, content_hash=content_hash)
+
+        self.document_path = file_path
+        self.docs = None
+        self.pages = None
+        return stats
+
+    def _iter_pages(self, file_path):
+        from ingest import iter_pdf_pages, iter_pdf_pages_parallel
+
+        if self.extract_workers > 1:
+            return iter_pdf_pages_parallel(file_path, self.extract_workers)
+        return iter_pdf_pages(file_path)
+
+    # Hash a chunk together with its source and page so moved chunks get fresh metadata
+    @staticmethod
+    def _chunk_hash(source, doc):
+        key = f"{source}\0{doc.metadata.get('page', '')}\0{doc.page_content}"
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def _manifest_path(self):
+        return os.path.join(self.persist_directory, 'chunk_hashes.json')
+
+    def _load_manifest(self):
+        if not os.path.exists(self._manifest_path()):
+            return {}
+        with open(self._manifest_path(), 'r') as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        with open(self._manifest_path(), 'w') as f:
+            json.dump(manifest, f)
+
+    # Content hashes of the files indexed in this collection, mapped to their source name
+    def _files_path(self):
+        return os.path.join(self.persist_directory, 'files.json')
+
+    def _load_files(self):
+        if not os.path.exists(self._files_path()):
+            return {}
+        with open(self._files_path(), 'r') as f:
+            return json.load(f)
+
+    # Source name of an already indexed file with this content, or None
+    def ingested_source(self, content_hash):
+        return self._load_files().get(content_hash)
+
+    # Only embed new chunks and drop stale ones, keyed by per-chunk hashes
+    def _sync_index(self, source, pages, progress=None, content_hash=None):
+        with self._index_lock:
+            result = self._sync_sources_locked([(source, pages)], progress)[source]
+            self._save_files([source], {content_hash: source} if content_hash is not None else {})
+        self._resized()
+        return {key: result[key] for key in ("pages", "added", "kept", "removed")}
+
+    # Record the content hashes of re-indexed sources. Their chunks were replaced, so the
+    # hashes of earlier versions are dropped, also when the new version has no hash
+    def _save_files(self, sources, new_files):
+        sources = set(sources)
+        files = {content_hash: source for content_hash, source in self._load_files().items()
+                 if source not in sources}
+        files.update(new_files)
+        with open(self._files_path(), 'w') as f:
+            json.dump(files, f)
+
+    # Index a sequence of (source, pages) through one pipeline: the next document is extracted
+    # while the previous one is embedded, and batches are filled across documents. A source
+    # whose pages fail to extract is reported to on_error and the next one goes on; without
+    # on_error the error is raised. Returns pages, chunks, added, kept, removed and error
+    # per source
+    def _sync_sources_locked(self, documents, progress, on_error=None):
+        from ingest import IngestPipeline
+        from vectorstore import add_embeddings, delete_ids, maybe_build_ivf
+
+        if not os.path.exists(self.persist_directory):
+            os.makedirs(self.persist_directory)
+        self._open_index()
+
+        manifest = self._load_manifest()
+        stored_hashes = set()
+        results = {}
+
+        # Pages carry their source name, chunks are attributed to it downstream
+        def all_pages():
+            for source, pages in documents:
+                # ids are the chunks the source consists of, stored the ones written so far
+                result = results[source] = {"pages": 0, "chunks": 0, "added": 0, "kept": 0,
+                                            "removed": 0, "error": None, "ids": set(),
+                                            "stored": set()}
+                stored_hashes.update(manifest.get(source, []))
+                try:
+                    for page in pages:
+                        page.metadata["source"] = source
+                        result["pages"] += 1
+                        yield page
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    result["error"] = str(e)
+                    on_error(source, e)
+
+        def chunk_id(doc):
+            source = doc.metadata["source"]
+            id_ = self._chunk_hash(source, doc)
+            results[source]["chunks"] += 1
+            results[source]["ids"].add(id_)
+            return id_
+
+        # Each embedded batch is written as soon as it is ready, to both indexes
+        def upsert(ids, docs, vectors):
+            with self._store_access():
+                add_embeddings(self.db_index, ids, docs, vectors)
+            self.lexical_index.add(ids, docs)
+            for id_, doc in zip(ids, docs):
+                result = results[doc.metadata["source"]]
+                result["added"] += 1
+                result["stored"].add(id_)
+
+        self.pipeline = IngestPipeline(self.embeddings, self.text_splitter,
+                                       batch_size=INGEST_BATCH_SIZE, stats=progress,
+                                       embed_workers=INGEST_EMBED_WORKERS,
+                                       token_counter=self.token_counter)
+        try:
+            self.pipeline.run(all_pages(), chunk_id=chunk_id,
+                              is_stored=stored_hashes.__contains__, upsert=upsert)
+        except BaseException:
+            # Keep track of what was written so a retry does not embed it again; chunks that
+            # were selected but not written yet stay out of the manifest
+            for source, result in results.items():
+                manifest[source] = list(set(manifest.get(source, [])) | result["stored"])
+            self._save_manifest(manifest)
+            with self._store_access():
+                self.db_index.persist()
+            raise
+
+        removed = []
+        for source, result in results.items():
+            previous = set(manifest.get(source, []))
+            result["kept"] = len(result["ids"]) - result["added"]
+            del result["stored"]
+            if result["error"] is None:
+                stale = previous - result["ids"]
+                removed.extend(stale)
+                result["removed"] = len(stale)
+                manifest[source] = list(result.pop("ids"))
+            else:
+                # A document that failed half way keeps its old chunks next to the new ones
+                manifest[source] = list(previous | result.pop("ids"))
+        if removed:
+            with self._store_access():
+                delete_ids(self.db_index, removed)
+            self.lexical_index.delete(removed)
+        if self.pipeline.stats["added"] or removed:
+            with self._store_access():
+                self.db_index.persist()
+            maybe_build_ivf(self.db_index)
+            self._invalidate_index()
+            self._measure()
+
+        self._save_manifest(manifest)
+        for source, result in results.items():
+            logger.info("Indexed %s: %d added, %d kept, %d removed",
+                        source, result['added'], result['kept'], result['removed'])
+        return results
+
+    # Index many PDFs at once. files are (name, path, content_hash) with unique names, e.g.
+    # from bulk.collect_files; files whose content is already indexed, here or earlier in
+    # the batch, are skipped. The result reports every file and the aggregate throughput
+    def load_documents(self, files, progress=None):
+        from bulk import throughput
+
+        start = time.perf_counter()
+        progress = progress if progress is not None else {}
+        report = {"files": [], "indexed": 0, "duplicates": 0, "failed": 0}
+        # (position in files, entry), so the report lists files in the order they were given
+        entries = []
+        progress["files"] = len(files)
+        with self._index_lock:
+            indexed = self._load_files()
+            todo = []
+            names = set()
+            for position, (name, path, content_hash) in enumerate(files):
+                if name in names:
+                    entries.append((position, {"file": name, "status": "failed",
+                                               "error": "Another file in the batch has the same name"}))
+                    report["failed"] += 1
+                    continue
+                duplicate_of = indexed.get(content_hash)
+                if duplicate_of is not None:
+                    entries.append((position, {"file": name, "status": "duplicate",
+                                               "duplicate_of": duplicate_of}))
+                    report["duplicates"] += 1
+                    continue
+                indexed[content_hash] = name
+                names.add(name)
+                todo.append((position, name, path, content_hash))
+            progress.update(duplicates=report["duplicates"], failed=report["failed"])
+
+            def on_error(source, e):
+                progress["failed"] += 1
+                logger.warning("Failed to index %s: %s", source, e)
+
+            results = self._sync_sources_locked(
+                ((name, self._iter_pages(path)) for _, name, path, _ in todo), progress, on_error)
+            self._save_files(results, {content_hash: name for _, name, _, content_hash in todo
+                                       if name in results and results[name]["error"] is None})
+        self._resized()
+
+        for position, name, _, _ in todo:
+            result = results.get(name, {"error": "not indexed"})
+            status = "failed" if result["error"] is not None else "indexed"
+            report[status] += 1
+            entries.append((position, {"file": name, "status": status, **result}))
+        report["files"] = [entry for _, entry in sorted(entries, key=lambda item: item[0])]
+        for key in ("pages", "chunks", "added", "kept", "removed"):
+            report[key] = sum(results[name][key] for name in results)
+        return throughput(report, time.perf_counter() - start)
+
+    # Generate a summary of a document in the collection, by default the last loaded one
+    # or, after a restart, every document. map_reduce uses the cached concurrent summarizer
+    def summarize(self, chain_type="map_reduce", source=None, progress=None):
+        self.docs = self._source_chunks(source)
         if not self.docs:
             raise ValueError("No document loaded. Please load a document first using 'load_document' method.")
-        
+
+        if chain_type == "map_reduce":
+            return self.summarizer.summarize(self.docs, progress=progress)
         # Load the summarization chain an run it on the loaded documents
+        from langchain.chains.summarize import load_summarize_chain
+
         chain = load_summarize_chain(self.llm_summarize, chain_type=chain_type)
         return chain.run(self.docs)
+
+    # Indexed chunks of one source in reading order, without extracting the PDF again
+    def _source_chunks(self, source=None):
+        if source is None and self.document_path:
+            source = os.path.basename(self.document_path)
+        if not self._open_index():
+            return []
+        from vectorstore import stored_documents
+
+        with self._store_access():
+            _, docs = stored_documents(self.db_index)
+        # Chunks indexed before sources were stored by name carry the path of the file
+        if source is not None:
+            docs = [doc for doc in docs
+                    if source in (doc.metadata.get('source'), os.path.basename(str(doc.metadata.get('source'))))]
+        return sorted(docs, key=lambda doc: (str(doc.metadata.get('source')),
+                                             doc.metadata.get('page', 0),
+                                             doc.metadata.get('start_index', 0)))
         
     # Print test pages for reference
     def print_test_pages(self, page_indices):
+        if self.pages is None and self.document_path:
+            self.pages = list(self._iter_pages(self.document_path))
         if not self.pages:
             raise ValueError("No document loaded. Please load a document first using 'load_document' method.")
         
@@ -128,119 +571,581 @@ class Chat_With_PDFs_and_Summarize:
             print(self.pages[index])
             print("\n")
         
-    # Ask a question and get an answer from the model
-    def ask_question(self, query):
-        if not self.db_index:
+    # Ask a question and get an answer from the model. page_range = (start, end) restricts
+    # retrieval to 0-indexed pages start <= page < end; either bound may be None.
+    # retrieval is one of RETRIEVAL_MODES and defaults to the collection's mode
+    def ask_question(self, query, page_range=None, retrieval=None):
+        return self.answer_question(query, page_range, retrieval)["answer"]
+
+    # ask_question with the prompt size: {"answer", "prompt_tokens", "context_chunks"}
+    def answer_question(self, query, page_range=None, retrieval=None):
+        version = self.index_version
+        response, embedding, docs = self._retrieve(query, page_range, retrieval)
+        if response is not None:
+            return {"answer": response, "prompt_tokens": 0, "context_chunks": 0}
+        if not docs and page_range and page_range != (None, None):
+            return {"answer": no_content_answer(page_range), "prompt_tokens": 0, "context_chunks": 0}
+
+        chain = self._qa_chain().combine_documents_chain
+        prompt_tokens = self._prompt_tokens(chain, docs, query)
+        with latency.time("llm"):
+            response = chain.run(input_documents=docs, question=query)
+        self._remember(query, version, response, embedding, page_range, retrieval)
+        return {"answer": response, "prompt_tokens": prompt_tokens, "context_chunks": len(docs)}
+
+    # Same as ask_question, but yields tokens as the LLM produces them
+    def stream_question(self, query, page_range=None, retrieval=None):
+        from streaming import stream_tokens
+
+        start = time.perf_counter()
+        version = self.index_version
+        response, embedding, docs = self._retrieve(query, page_range, retrieval)
+        first_token = None
+        prompt_tokens = 0
+        if response is None and not docs and page_range and page_range != (None, None):
+            response = no_content_answer(page_range)
+        if response is not None:
+            first_token = time.perf_counter() - start
+            yield {"token": response}
+        else:
+            chain = self._qa_chain(streaming=True).combine_documents_chain
+            prompt_tokens = self._prompt_tokens(chain, docs, query)
+            result = {}
+            llm_start = time.perf_counter()
+            for token in stream_tokens(lambda handler: chain.run(input_documents=docs,
+                                                                 question=query,
+                                                                 callbacks=[handler]), result):
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                    latency.record("time_to_first_token", first_token)
+                yield {"token": token}
+            latency.record("llm", time.perf_counter() - llm_start)
+            response = result["output"]
+            self._remember(query, version, response, embedding, page_range, retrieval)
+
+        yield {"done": True,
+               "answer": response,
+               "prompt_tokens": prompt_tokens,
+               "time_to_first_token_ms": first_token * 1000 if first_token is not None else None,
+               "total_ms": (time.perf_counter() - start) * 1000}
+
+    # Answer from the cache, or embed the query and fetch the relevant chunks
+    def _retrieve(self, query, page_range=None, retrieval=None):
+        from lexical import reciprocal_rank_fusion
+        from vectorstore import page_filter
+
+        validate_page_range(page_range)
+        retrieval = retrieval or self.retrieval_mode
+        if retrieval not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {retrieval!r}, expected one of {RETRIEVAL_MODES}")
+        if not self._open_index():
             raise ValueError("No document index. Please load a document first using 'load_document' method")
-        
-        # Initialize the RetrievalQA object and run the query
-        qa = RetrievalQA.from_chain_type(
-            llm=self.llm_chat,
-            chain_type="stuff",
-            retriever=self.db_index.as_retriever()
-        )
-
-        # Get the response from the model based on the query
-        response = qa.run(query)
-        return response
+
+        qa = self._qa_chain()
+        k = qa.retriever.search_kwargs.get("k", 4)
+        # With a context budget more candidates are fetched and packed down afterwards
+        if CONTEXT_TOKENS:
+            k = max(k, RETRIEVAL_FETCH_K)
+        cache = self.answer_cache
+        version = self.index_version
+        scope = self._scope(page_range, retrieval)
+
+        # Repeated questions are answered without embedding or LLM calls
+        if cache is not None:
+            response = cache.get(self.collection_id, version, query, scope)
+            if response is not None:
+                return response, None, None
+
+        # Lexical fast path, searched locally without an embedding round trip
+        if retrieval == "lexical":
+            with latency.time("lexical_search"):
+                docs = self.lexical_index.search(query, k=k, page_range=page_range)
+            return None, None, self._pack(docs)
+
+        # Same steps as qa.run(query), timed per stage
+        with latency.time("query_embedding"):
+            embedding = self.embeddings.embed_query(query)
+        if cache is not None:
+            response = cache.get_similar(self.collection_id, version, embedding, scope)
+            if response is not None:
+                return response, embedding, None
+        # The page filter is evaluated by the vector store before ranking, so the top k
+        # are the best chunks within the range rather than whatever survives of a global top k
+        fetch_k = max(k, RETRIEVAL_FETCH_K) if retrieval == "hybrid" else k
+        with latency.time("vector_search"), self._store_access():
+            docs = self.db_index.similarity_search_by_vector(
+                embedding, k=fetch_k, filter=page_filter(*page_range) if page_range else None)
+        # Exact terms, model names and numbers that dense retrieval misses come from BM25
+        if retrieval == "hybrid":
+            with latency.time("lexical_search"):
+                lexical_docs = self.lexical_index.search(query, k=fetch_k, page_range=page_range)
+            docs = reciprocal_rank_fusion(
+                [docs, lexical_docs], k,
+                key=lambda doc: self._chunk_hash(doc.metadata.get('source'), doc))
+        return None, embedding, self._pack(docs)
+
+    # Dedupe, merge and pack the ranked chunks into CONTEXT_TOKENS
+    def _pack(self, docs):
+        if not CONTEXT_TOKENS:
+            return docs
+        from context import pack_context
+
+        docs, _ = pack_context(docs, CONTEXT_TOKENS, self.token_counter)
+        return docs
+
+    # Size of the prompt the stuff chain sends for these documents
+    @staticmethod
+    def _prompt_tokens(chain, docs, query):
+        prompt_tokens = chain.prompt_length(docs, question=query)
+        token_usage.record("prompt", prompt_tokens)
+        return prompt_tokens
+
+    def _remember(self, query, version, response, embedding, page_range=None, retrieval=None):
+        if self.answer_cache is not None:
+            self.answer_cache.put(self.collection_id, version, query, response, embedding,
+                                  self._scope(page_range, retrieval))
+
+    # Answer cache scope of a retrieval mode and page range, answers retrieved differently
+    # never mix. CONTEXT_TOKENS is fixed for the process, like the in-memory cache itself
+    def _scope(self, page_range, retrieval=None):
+        scope = retrieval or self.retrieval_mode
+        if not page_range or page_range == (None, None):
+            return scope
+        return scope + "|pages:%s-%s" % tuple("" if p is None else p for p in page_range)
+
+    # Initialize the RetrievalQA objects once per index
+    def _qa_chain(self, streaming=False):
+        from langchain.chains import RetrievalQA
+
+        if streaming:
+            if self._qa_stream is None:
+                self._qa_stream = RetrievalQA.from_chain_type(
+                    llm=self.llm_stream,
+                    chain_type="stuff",
+                    retriever=self.db_index.as_retriever()
+                )
+            return self._qa_stream
+        if self._qa is None:
+            self._qa = RetrievalQA.from_chain_type(
+                llm=self.llm_chat,
+                chain_type="stuff",
+                retriever=self.db_index.as_retriever()
+            )
+        return self._qa
+
+    # Drop everything derived from the index after it changed
+    def _invalidate_index(self):
+        self._qa = None
+        self._qa_stream = None
+        self.index_version += 1
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate(self.collection_id)
     
 
-    # txt function 위해서 새로 만든 것. 1000 -> 500
-    def load_txt(self, file_path):
+    # txt function 위해서 새로 만든 것.
+    # Text files go through the same persisted, deduplicated index as PDFs, as one page
+    def load_txt(self, file_path, progress=None, content_hash=None):
+        from langchain.document_loaders import TextLoader
+
         # Load the document using TextLoader
         self.loader = TextLoader(file_path)
         documents = self.loader.load()
-        text_splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=0)
-        texts = text_splitter.split_documents(documents)
-        embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-        self.db_index = Chroma.from_documents(texts, embeddings)
+        return self._sync_index(os.path.basename(file_path), documents,
+                                progress=progress, content_hash=content_hash)
 
     
-    # New! csv function
-    def load_csv(self, file_path):
-        self.df = pd.read_csv(file_path)
-        self.agent = create_csv_agent(OpenAI(temperature=0),
-                                      file_path,
-                                      verbose=True
-                                     )
+    # New! csv function. CSV and Excel files are converted once to Parquet with column
+    # statistics, re-uploads of the same file reuse the cached copy
+    def load_csv(self, file_path, content_hash=None):
+        if self.table_cache is None:
+            self.table_cache = get_table_cache()
+        self.table = self.table_cache.load(file_path, content_hash=content_hash)
+        self.agent = None
+        return {"rows": self.table.rows, "columns": len(self.table.stats["columns"])}
 
+    # One LLM call turns the question into SQL that runs locally against the cached table;
+    # the agent loop is only the fallback when the query cannot be planned or run
     def ask_csv(self, query: str):
-        return self.agent.run(query)
+        if self.table is None:
+            raise ValueError("No csv loaded. Please load a csv file first using 'load_csv' method")
+        import duckdb
+        from tables import TablePlanner
+
+        if self.table_planner is None:
+            self.table_planner = TablePlanner(self.llm_chat)
+        try:
+            with latency.time("csv_query"):
+                return self.table_planner.answer(self.table, query)
+        except (duckdb.Error, ValueError) as e:
+            logger.warning("SQL plan failed, falling back to the agent: %s", e)
+        if self.agent is None:
+            from langchain.agents import create_pandas_dataframe_agent
+            from langchain.llms import OpenAI
+
+            self.agent = create_pandas_dataframe_agent(OpenAI(temperature=0), self.table.frame(),
+                                                       verbose=True)
+        return {"answer": self.agent.run(query), "sql": None}
+
+
+
+# Clients and caches are shared by every collection. The clients are built on first use
+answer_cache = AnswerCache(max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                           semantic_threshold=ANSWER_CACHE_SEMANTIC_THRESHOLD)
+token_counter = TokenCounter(EMBEDDING_MODEL, num_threads=TOKENIZER_THREADS)
+
+# Held while shared clients and collections are built. Building them runs the first imports
+# of LangChain, whose circular package init breaks when two threads run it at once
+_init_lock = threading.RLock()
+
+
+# Build once on first call, the same object is returned afterwards. For factories without
+# arguments, built() returns the object only if it was built already, without building it
+def shared(factory):
+    cached = lru_cache(maxsize=None)(factory)
+
+    @wraps(factory)
+    def get(*args):
+        with _init_lock:
+            return cached(*args)
+
+    get.built = lambda: cached() if cached.cache_info().currsize else None
+    return get
+
+
+@shared
+def get_embeddings():
+    return create_embeddings()
+
+
+# One ChatOpenAI client per use: "chat", "stream" or "summarize"
+@shared
+def get_llm(use):
+    from langchain.chat_models import ChatOpenAI
+
+    return ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, streaming=use == "stream")
+
+
+@shared
+def get_summarizer():
+    return create_summarizer(get_llm("summarize"))
+
+
+@shared
+def get_table_cache():
+    from tables import TableCache
+
+    return TableCache(TABLE_CACHE_DIR)
+
+
+# page_range is (start, end), 0-indexed with end exclusive; either bound may be None
+def validate_page_range(page_range):
+    start, end = page_range or (None, None)
+    if (start is not None and start < 0) or (end is not None and end < 0):
+        raise ValueError("Page numbers must not be negative")
+    if start is not None and end is not None and start >= end:
+        raise ValueError(f"Empty page range: start_page ({start}) must be lower than end_page ({end})")
+
+
+# Answer for a page range without indexed text, given without calling the LLM
+def no_content_answer(page_range):
+    start, end = page_range
+    return "No content in pages %s-%s." % ("" if start is None else start, "" if end is None else end)
+
+
+def open_collection(collection_id, persist_directory):
+    with _init_lock:
+        chat = Chat_With_PDFs_and_Summarize(persist_directory=persist_directory,
+                                            embeddings=get_embeddings(),
+                                            llm_chat=get_llm("chat"),
+                                            llm_summarize=get_llm("summarize"),
+                                            collection_id=collection_id,
+                                            answer_cache=answer_cache,
+                                            llm_stream=get_llm("stream"),
+                                            summarizer=get_summarizer(),
+                                            token_counter=token_counter)
+    # A collection opened lazily by its first question may push the registry over budget
+    chat.on_resize = registry.trim
+    return chat
+
+
+# A single store written by main_proto.py or earlier versions of this app sits directly in
+# db_index; move it into db_index/default so it is served like any other collection
+# Runs at startup, so it checks for Chroma's files itself instead of importing vectorstore
+def adopt_legacy_index(root, collection_id="default"):
+    target = os.path.join(root, collection_id)
+    if not os.path.exists(os.path.join(root, "chroma-collections.parquet")) or os.path.exists(target):
+        return
+    legacy = [name for name in os.listdir(root)
+              if name.startswith("chroma-") or name in ("index", "doc_hash.txt")]
+    os.makedirs(target)
+    for name in legacy:
+        shutil.move(os.path.join(root, name), os.path.join(target, name))
+    logger.info("Moved the index in %s to collection %r", root, collection_id)
+
+
+def is_collection(path):
+    from vectorstore import detect_backend
+
+    return detect_backend(path, None) is not None
+
+
+# One collection per document or tenant, persisted under db_index/<collection_id>
+registry = CollectionRegistry(open_collection, root="db_index",
+                              max_bytes=COLLECTION_CACHE_MB * 1024 * 1024,
+                              is_collection=is_collection)
+jobs = JobQueue(workers=INGEST_WORKERS)
+
+
+# While the embedding API keeps failing, requests fail fast instead of queueing retries
+@app.exception_handler(CircuitOpenError)
+async def circuit_open(request, exc):
+    return JSONResponse({"detail": str(exc)}, status_code=503,
+                        headers={"Retry-After": str(int(exc.retry_after) + 1)})
+
+
+# Lease a collection for a request; release it with registry.release(collection_id). Only
+# the ingestion endpoints create collections, reads of unknown ones are 404s
+def acquire_collection(collection_id, create=False):
+    try:
+        return registry.acquire(collection_id, create=create)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown collection {collection_id!r}")
+
+
+@contextmanager
+def collection_lease(collection_id, create=False):
+    chat = acquire_collection(collection_id, create)
+    try:
+        yield chat
+    finally:
+        registry.release(collection_id)
+
+
+def check_page_range(start_page, end_page):
+    try:
+        validate_page_range((start_page, end_page))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
+# Queue a job that holds its own lease until it finishes, so a queued or running job's
+# collection is never closed to make room for others
 
-chat = Chat_With_PDFs_and_Summarize()
+def submit_leased(kind, collection_id, run):
+    registry.acquire(collection_id)
+
+    def leased(job):
+        try:
+            return run(job)
+        finally:
+            registry.release(collection_id)
+
+    return jobs.submit(kind, leased)
 
 
 @app.post("/load_document/")
 async def load_document(
     file: UploadFile = File(...), 
-    start_page: Optional[int] = None, 
-    end_page: Optional[int] = None
+    collection_id: str = "default"
 ):
-    # Save the uploaded file to the "documents" directory
-    file_path = os.path.join("documents", file.filename)
-    with open(file_path, 'wb') as buffer:
-        buffer.write(file.file.read())
-
-    # Set the end_page to the length of the PDF file if it is None
-    if end_page is None:
-        with open(file_path, 'rb') as pdf_file:
-            pdf_reader = PdfReader(pdf_file)
-            end_page = len(pdf_reader.pages)
-
-    chat.load_document(file_path, page_range=(start_page, end_page))
-    
-    # Remove the uploaded file from the "documents" directory
-    # os.remove(file_path)
+    chat = await run_in_threadpool(acquire_collection, collection_id, True)
+    try:
+        # Uploads are streamed to documents/<sha256>/ in chunks and hashed on the way
+        upload = await save_upload(file)
 
-    return {"message": "Document loaded successfully."}
+        # A file with the same content is not indexed twice
+        source = await run_in_threadpool(chat.ingested_source, upload.content_hash)
+        if source is not None:
+            return {"message": "Document already loaded.", "job_id": None,
+                    "collection_id": collection_id, "source": source, "duplicate": True}
 
+        # Index in the background, progress is reported through /jobs/{job_id}
+        def run(job):
+            result = chat.load_document(upload.path, progress=job.progress,
+                                        content_hash=upload.content_hash)
+            registry.trim()
+            return result
 
-@app.post("/ask_question")
-async def ask_question(query: str):
+        job = submit_leased("load_document", collection_id, run)
+    finally:
+        registry.release(collection_id)
+
+    return {"message": "Document queued for loading.", "job_id": job.id,
+            "collection_id": collection_id}
+
+
+# Bulk ingestion: any number of PDFs and zip/tar archives of PDFs in one request. Files are
+# deduped by content hash and indexed through one pipeline; the job result reports every
+# file, with its error if it failed, and the aggregate throughput
+@app.post("/load_documents/")
+async def load_documents(files: List[UploadFile] = File(...), collection_id: str = "default"):
+    chat = await run_in_threadpool(acquire_collection, collection_id, True)
     try:
-        answer = chat.ask_question(query)
-        return {"answer": answer}
-    except ValueError as e:
-        return {"error": str(e)}
+        uploads = [(os.path.basename(file.filename or ""), await save_upload(file))
+                   for file in files]
+
+        def run(job):
+            from bulk import ArchiveTooLarge, collect_files
+
+            # Archives are extracted for the duration of the job. One over the limits is
+            # reported as failed and none of its files are indexed
+            with tempfile.TemporaryDirectory() as workdir:
+                found, skipped, too_large = [], [], []
+                for i, (filename, upload) in enumerate(uploads):
+                    try:
+                        collected = collect_files(upload.path, os.path.join(workdir, str(i)),
+                                                  name=filename or None,
+                                                  max_bytes=MAX_ARCHIVE_MB * 1024 * 1024,
+                                                  max_members=MAX_ARCHIVE_FILES)
+                    except ArchiveTooLarge as e:
+                        too_large.append({"file": filename, "status": "failed", "error": str(e)})
+                        continue
+                    found += collected.files
+                    skipped += collected.skipped
+                result = chat.load_documents(found, progress=job.progress)
+            registry.trim()
+            result["files"] += too_large
+            result["failed"] += len(too_large)
+            result["skipped"] = skipped
+            return result
+
+        job = submit_leased("load_documents", collection_id, run)
+    finally:
+        registry.release(collection_id)
+
+    return {"message": f"{len(uploads)} files queued for loading.", "job_id": job.id,
+            "collection_id": collection_id}
+
+
+# Plain def handlers run in FastAPI's threadpool, off the event loop
+# start_page/end_page (0-indexed, end exclusive) restrict the answer to a page range
+# retrieval overrides RETRIEVAL_MODE: "vector", "lexical" or "hybrid"
+@app.post("/ask_question")
+def ask_question(query: str, collection_id: str = "default",
+                 start_page: Optional[int] = None, end_page: Optional[int] = None,
+                 retrieval: Optional[str] = None):
+    check_page_range(start_page, end_page)
+    with collection_lease(collection_id) as chat:
+        try:
+            return chat.answer_question(query, page_range=(start_page, end_page),
+                                        retrieval=retrieval)
+        except ValueError as e:
+            return {"error": str(e)}
     
 
+# Server-Sent Events: one {"token"} event per token, then a final {"done"} event
+# carrying the full answer and the time to first token
+@app.post("/ask_question/stream")
+def ask_question_stream(query: str, collection_id: str = "default",
+                        start_page: Optional[int] = None, end_page: Optional[int] = None,
+                        retrieval: Optional[str] = None):
+    check_page_range(start_page, end_page)
+    chat = acquire_collection(collection_id)
+    from streaming import sse_events
+
+    # The lease is released by the stream itself once it ended, failed or the client went away
+    return StreamingResponse(sse_events(chat.stream_question(query, (start_page, end_page), retrieval),
+                                        on_close=lambda: registry.release(collection_id)),
+                             media_type="text/event-stream")
+
+
 @app.post("/load_txt/")
-async def load_txt(file: UploadFile = File(...)):
-    # Save the uploaded file to the "documents" directory
-    file_path = os.path.join("documents", file.filename)
-    with open(file_path, 'wb') as buffer:
-        buffer.write(file.file.read())
+async def load_txt(file: UploadFile = File(...), collection_id: str = "default"):
+    chat = await run_in_threadpool(acquire_collection, collection_id, True)
+    try:
+        upload = await save_upload(file)
 
-    chat.load_txt(file_path)
+        source = await run_in_threadpool(chat.ingested_source, upload.content_hash)
+        if source is not None:
+            return {"message": "Document already loaded.", "job_id": None,
+                    "collection_id": collection_id, "source": source, "duplicate": True}
 
-    # Remove the uploaded file from the "documents" directory
-    # os.remove(file_path)
+        def run(job):
+            result = chat.load_txt(upload.path, progress=job.progress,
+                                   content_hash=upload.content_hash)
+            registry.trim()
+            return result
 
-    return {"message": "Text file loaded successfully."}
+        job = submit_leased("load_txt", collection_id, run)
+    finally:
+        registry.release(collection_id)
 
+    return {"message": "Text file queued for loading.", "job_id": job.id,
+            "collection_id": collection_id}
 
-# csv 위해서 새로 만든 것.
-@app.post("/load_csv/")
-async def load_csv(file: UploadFile = File(...)):
-    # Save the uploaded file to the "documents" directory
-    file_path = os.path.join("documents", file.filename)
-    with open(file_path, 'wb') as buffer:
-        buffer.write(file.file.read())
 
-    chat.load_csv(file_path)
+# csv 위해서 새로 만든 것. Excel files (.xlsx, .xls) are accepted too
+@app.post("/load_csv/")
+async def load_csv(file: UploadFile = File(...), collection_id: str = "default"):
+    chat = await run_in_threadpool(acquire_collection, collection_id, True)
+    try:
+        upload = await save_upload(file)
 
-    # Remove the uploaded file from the "documents" directory
-    # os.remove(file_path)
+        job = submit_leased("load_csv", collection_id,
+                            lambda job: chat.load_csv(upload.path, content_hash=upload.content_hash))
+    finally:
+        registry.release(collection_id)
 
-    return {"message": "CSV file loaded successfully."}
+    return {"message": "CSV file queued for loading.", "job_id": job.id,
+            "collection_id": collection_id}
 
 
 @app.post("/ask_csv/")
-async def answer_csv(query: str):
+def answer_csv(query: str, collection_id: str = "default"):
+    with collection_lease(collection_id) as chat:
+        try:
+            return chat.ask_csv(query)
+        except ValueError as e:
+            return {"error": str(e)}
+
+
+# Summaries run as jobs, the summary is the result of /jobs/{job_id}. source is the
+# file name of a loaded document; without it the whole collection is summarized
+@app.post("/summarize")
+async def summarize(collection_id: str = "default", source: Optional[str] = None):
+    chat = await run_in_threadpool(acquire_collection, collection_id)
     try:
-        answer = chat.ask_csv(query)
-        return {"answer": answer}
-    except ValueError as e:
-        return {"error": str(e)}
\ No newline at end of file
+        def run(job):
+            return {"summary": chat.summarize(source=source, progress=job.progress)}
+
+        job = submit_leased("summarize", collection_id, run)
+    finally:
+        registry.release(collection_id)
+
+    return {"message": "Summary queued.", "job_id": job.id, "collection_id": collection_id}
+
+
+# Stats endpoints only report clients that are built already: building one imports
+# LangChain, which must not happen on a status request
+@app.get("/embedding_cache/stats")
+def embedding_cache_stats():
+    embeddings = get_embeddings.built()
+    return embeddings.cache.stats() if embeddings is not None else {}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job.to_dict()
+
+
+@app.get("/collections")
+def list_collections():
+    return registry.stats()
+
+
+@app.get("/metrics")
+def get_metrics():
+    summarizer = get_summarizer.built()
+    embeddings = get_embeddings.built()
+    return {"latency": latency.summary(),
+            "tokens": token_usage.summary(),
+            "token_counts": token_counter.stats(),
+            "summary_cache": summarizer.cache.stats() if summarizer is not None else None,
+            "embedding_cache": embeddings.cache.stats() if embeddings is not None else None,
+            "embedding_requests": embeddings.retry_policy.stats() if embeddings is not None else None,
+            "answer_cache": answer_cache.stats()}
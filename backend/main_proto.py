@@ -1,7 +1,11 @@
 # Import the necessary libraries and modules
 import os
+import sys
 import hashlib
 import glob
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from langchain.document_loaders import PyPDFLoader
 from langchain.chat_models import ChatOpenAI
@@ -131,8 +135,63 @@ class Chat_With_PDFs_and_Summarize:
         return response
         
 
+# Non-interactive bulk ingestion of a directory or zip/tar archive of PDFs into a collection
+# of the API server (db_index/<collection_id>), e.g.
+#   python main_proto.py ingest documents/ --collection reports
+# Returns the exit code: 1 if any file failed
+def ingest(path, collection_id):
+    import main
+    from bulk import ArchiveTooLarge, collect_files
+
+    progress = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            collected = collect_files(path, workdir, max_bytes=main.MAX_ARCHIVE_MB * 1024 * 1024,
+                                      max_members=main.MAX_ARCHIVE_FILES)
+        except ArchiveTooLarge as e:
+            console.print(f"Failed to extract {path}: {e}", style="red")
+            return 1
+        chat = main.registry.get(collection_id)
+        console.print(f"{len(collected.files)} PDF files in {path}, {len(collected.skipped)} other files skipped")
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(chat.load_documents, collected.files, progress)
+            with console.status("Indexing...") as status:
+                while not wait([future], timeout=0.5).done:
+                    status.update(f"Indexing: {progress.get('pages', 0)} pages, "
+                                  f"{progress.get('embedded', 0)} chunks embedded, "
+                                  f"{progress.get('failed', 0)} files failed")
+            report = future.result()
+    main.registry.close_all()
+
+    files_table = Table(title=f"Collection {collection_id}", show_header=True,
+                        header_style="bold magenta")
+    for column in ("File", "Status", "Pages", "Chunks", "Added", "Details"):
+        files_table.add_column(column, justify="left" if column in ("File", "Details") else "right")
+    for entry in report["files"]:
+        details = entry.get("error") or entry.get("duplicate_of") or ""
+        if entry["status"] == "duplicate":
+            details = f"already indexed as {details}"
+        files_table.add_row(entry["file"], entry["status"], str(entry.get("pages", "")),
+                            str(entry.get("chunks", "")), str(entry.get("added", "")), details)
+    console.print(files_table)
+    console.print(f"{report['indexed']} indexed, {report['duplicates']} duplicates, {report['failed']} failed "
+                  f"in {report['seconds']:.1f}s: {report['pages_per_second']:.1f} pages/s, "
+                  f"{report['chunks_per_second']:.1f} chunks/s, {report['added']} chunks added")
+    return 1 if report["failed"] else 0
+
+
 # Main script starts here
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat with PDFs and summarize them.")
+    subcommands = parser.add_subparsers(dest="command")
+    ingest_parser = subcommands.add_parser("ingest", help="index a directory or archive of PDFs without prompts")
+    ingest_parser.add_argument("path", help="directory or .zip/.tar(.gz) archive of PDF files")
+    ingest_parser.add_argument("--collection", default="default", help="collection id (default: default)")
+    args = parser.parse_args()
+    if args.command == "ingest":
+        sys.exit(ingest(args.path, args.collection))
+
     chat = Chat_With_PDFs_and_Summarize()
 
     # Search the 'documents' folder for PDF files
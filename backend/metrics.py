@@ -0,0 +1,119 @@
+"""In-process latency and token metrics for the query path."""
+from __future__ import annotations
+
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Union
+
+import numpy as np
+
+
+class LatencyRecorder:
+    """Keep the most recent ``window`` samples per stage and report percentiles.
+
+    Example:
+        .. code-block:: python
+
+            latency = LatencyRecorder()
+            with latency.time("llm"):
+                answer = chain.run(...)
+            latency.summary()["llm"]["p95_ms"]
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[stage].append(seconds)
+            self._counts[stage] += 1
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, mean and p50/p95/p99/max in milliseconds for every stage."""
+        with self._lock:
+            samples = {stage: np.array(values) * 1000 for stage, values in self._samples.items()}
+            counts = dict(self._counts)
+        result = {}
+        for stage, values in samples.items():
+            if not len(values):
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            result[stage] = {
+                "count": counts[stage],
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(values.max()),
+            }
+        return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+class TokenRecorder:
+    """Keep the most recent ``window`` token counts per kind (e.g. prompt tokens).
+
+    Example:
+        .. code-block:: python
+
+            tokens = TokenRecorder()
+            tokens.record("prompt", 1830)
+            tokens.summary()["prompt"]["p95"]
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: Dict[str, Deque[int]] = defaultdict(lambda: deque(maxlen=self.window))
+        self._totals: Dict[str, int] = defaultdict(int)
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, tokens: int) -> None:
+        with self._lock:
+            self._samples[kind].append(tokens)
+            self._totals[kind] += tokens
+            self._counts[kind] += 1
+
+    def summary(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        """Count, total and mean/p50/p95/max of the recent samples for every kind."""
+        with self._lock:
+            samples = {kind: np.array(values) for kind, values in self._samples.items()}
+            totals = dict(self._totals)
+            counts = dict(self._counts)
+        result = {}
+        for kind, values in samples.items():
+            if not len(values):
+                continue
+            p50, p95 = np.percentile(values, [50, 95])
+            result[kind] = {
+                "count": counts[kind],
+                "total": totals[kind],
+                "mean": float(values.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "max": int(values.max()),
+            }
+        return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+            self._counts.clear()
@@ -1,13 +1,18 @@
 """Wrapper around OpenAI embedding models."""
 from __future__ import annotations
 
+import base64
+import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import (
     Any,
     Callable,
     Dict,
     List,
     Literal,
+    Mapping,
     Optional,
     Set,
     Tuple,
@@ -16,51 +21,92 @@ from typing import (
 
 import numpy as np
 from pydantic import BaseModel, Extra, root_validator
-from tenacity import (
-    before_sleep_log,
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_exponential,
-)
 
 from langchain.embeddings.base import Embeddings
 from langchain.utils import get_from_dict_or_env
 
+from rate_limit import RateLimiter
+from retry import CircuitBreaker, RetryPolicy, error_kind
+from tokenizer import encode_batch, get_encoding
+
 logger = logging.getLogger(__name__)
 
 
-def _create_retry_decorator(embeddings: OpenAIEmbeddings) -> Callable[[Any], Any]:
-    import openai
-
-    min_seconds = 4
-    max_seconds = 10
-    # Wait 2^x * 1 second between each retry starting with
-    # 4 seconds, then up to 10 seconds, then 10 seconds afterwards
-    return retry(
-        reraise=True,
-        stop=stop_after_attempt(embeddings.max_retries),
-        wait=wait_exponential(multiplier=1, min=min_seconds, max=max_seconds),
-        retry=(
-            retry_if_exception_type(openai.error.Timeout)
-            | retry_if_exception_type(openai.error.APIError)
-            | retry_if_exception_type(openai.error.APIConnectionError)
-            | retry_if_exception_type(openai.error.RateLimitError)
-            | retry_if_exception_type(openai.error.ServiceUnavailableError)
-        ),
-        before_sleep=before_sleep_log(logger, logging.WARNING),
-    )
+class EmbeddingClient:
+    """Client of the embeddings endpoint that reports the headers of every response.
 
+    ``openai.Embedding.create`` drops the headers of successful responses, so
+    requests go through sessions owned by this client; the authentication
+    headers and error types are the ``openai`` package's. Nothing global is
+    changed, other ``openai`` calls are unaffected.
+    """
 
-def embed_with_retry(embeddings: OpenAIEmbeddings, **kwargs: Any) -> Any:
-    """Use tenacity to retry the embedding call."""
-    retry_decorator = _create_retry_decorator(embeddings)
+    def __init__(self, on_headers: Callable[[Mapping[str, Any]], None]):
+        self.on_headers = on_headers
+        self._local = threading.local()
+
+    def _session(self) -> Any:
+        import openai
+        import requests
+
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            if isinstance(openai.proxy, str):
+                session.proxies = {"http": openai.proxy, "https": openai.proxy}
+            elif isinstance(openai.proxy, dict):
+                session.proxies = dict(openai.proxy)
+        return session
+
+    def create(self, engine: Optional[str] = None, request_timeout: Any = None, **params: Any) -> Any:
+        import openai
+        import requests
+        from openai.api_requestor import TIMEOUT_SECS, APIRequestor
+
+        requestor = APIRequestor()
+        headers = requestor.request_headers("post", {"Content-Type": "application/json"}, None)
+        try:
+            response = self._session().post(
+                requestor.api_base + openai.Embedding.class_url(engine),
+                headers=headers,
+                data=json.dumps(params),
+                timeout=request_timeout or TIMEOUT_SECS,
+            )
+        except requests.exceptions.Timeout as e:
+            raise openai.error.Timeout(f"Request timed out: {e}") from e
+        except requests.exceptions.RequestException as e:
+            raise openai.error.APIConnectionError(f"Error communicating with OpenAI: {e}") from e
+        self.on_headers(response.headers)
+        if response.status_code == 503:
+            raise openai.error.ServiceUnavailableError(
+                "The server is overloaded or not ready yet.",
+                response.text,
+                response.status_code,
+                headers=response.headers,
+            )
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise openai.error.APIError(
+                f"HTTP code {response.status_code} from API ({response.text})",
+                response.text,
+                response.status_code,
+                headers=response.headers,
+            ) from e
+        if not 200 <= response.status_code < 300:
+            raise requestor.handle_error_response(
+                response.text, response.status_code, data, response.headers
+            )
+        return data
 
-    @retry_decorator
-    def _embed_with_retry(**kwargs: Any) -> Any:
-        return embeddings.client.create(**kwargs)
 
-    return _embed_with_retry(**kwargs)
+def embed_with_retry(embeddings: OpenAIEmbeddings, **kwargs: Any) -> Any:
+    """Call the embedding endpoint through the embeddings' shared retry policy."""
+    inputs = kwargs.get("input") or []
+    tokens = sum(len(value) for value in inputs if isinstance(value, list))
+    return embeddings.retry_policy.call(
+        lambda: embeddings.client.create(**kwargs), tokens=tokens
+    )
 
 
 class OpenAIEmbeddings(BaseModel, Embeddings):
@@ -108,6 +154,7 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
     query_model_name: str = "text-embedding-ada-002"
     embedding_ctx_length: int = 8191
     openai_api_key: Optional[str] = None
+    openai_api_base: Optional[str] = None
     openai_organization: Optional[str] = None
     allowed_special: Union[Literal["all"], Set[str]] = set()
     disallowed_special: Union[Literal["all"], Set[str], Tuple[()]] = "all"
@@ -115,11 +162,36 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
     """Maximum number of texts to embed in each batch"""
     max_retries: int = 6
     """Maximum number of retries to make when generating."""
+    retry_base_delay: float = 1.0
+    """Backoff window of the first retry in seconds, doubled on every retry."""
+    retry_max_delay: float = 60.0
+    """Largest backoff window in seconds."""
+    circuit_failure_threshold: int = 5
+    """Consecutive server failures after which calls fail fast."""
+    circuit_reset_timeout: float = 30.0
+    """Seconds calls fail fast before one is let through to probe the API."""
+    cache: Optional[Any] = None
+    """Optional ``EmbeddingCache`` consulted before calling the API."""
+    max_concurrency: int = 1
+    """Maximum number of batches sent to the API at the same time."""
+    requests_per_minute: Optional[int] = None
+    """Client-side request budget shared by all concurrent batches."""
+    tokens_per_minute: Optional[int] = None
+    """Client-side token budget shared by all concurrent batches."""
+    rate_limiter: Optional[RateLimiter] = None  #: :meta private:
+    retry_policy: Optional[RetryPolicy] = None  #: :meta private:
+    adaptive_batch_size: Optional[int] = None
+    """Largest batch accepted after the API rejected a larger one, learned at runtime."""
+    tokenizer_threads: int = 1
+    """Threads used to tokenize large batches of texts."""
+    request_timeout: Optional[float] = None
+    """Timeout in seconds of each request; timed out requests are retried."""
 
     class Config:
         """Configuration for this pydantic object."""
 
         extra = Extra.forbid
+        arbitrary_types_allowed = True
 
     # TODO: deprecate this
     @root_validator(pre=True)
@@ -172,19 +244,44 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
         openai_api_key = get_from_dict_or_env(
             values, "openai_api_key", "OPENAI_API_KEY"
         )
+        openai_api_base = get_from_dict_or_env(
+            values,
+            "openai_api_base",
+            "OPENAI_API_BASE",
+            default="",
+        )
         openai_organization = get_from_dict_or_env(
             values,
             "openai_organization",
             "OPENAI_ORGANIZATION",
             default="",
         )
+        # Budgets start from the configured limits, if any, and follow the server's headers
+        if values.get("rate_limiter") is None:
+            values["rate_limiter"] = RateLimiter(
+                requests_per_minute=values.get("requests_per_minute"),
+                tokens_per_minute=values.get("tokens_per_minute"),
+            )
+        if values.get("retry_policy") is None:
+            values["retry_policy"] = RetryPolicy(
+                max_retries=values["max_retries"],
+                base_delay=values["retry_base_delay"],
+                max_delay=values["retry_max_delay"],
+                rate_limiter=values["rate_limiter"],
+                breaker=CircuitBreaker(
+                    values["circuit_failure_threshold"], values["circuit_reset_timeout"]
+                ),
+            )
         try:
             import openai
 
             openai.api_key = openai_api_key
+            if openai_api_base:
+                openai.api_base = openai_api_base
             if openai_organization:
                 openai.organization = openai_organization
-            values["client"] = openai.Embedding
+            # Budgets follow the x-ratelimit-* headers of this client's responses
+            values["client"] = EmbeddingClient(values["rate_limiter"].observe_headers)
         except ImportError:
             raise ValueError(
                 "Could not import openai python package. "
@@ -192,54 +289,32 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
             )
         return values
 
+    def _tokenize(self, texts: List[str]) -> Tuple[List[List[int]], List[int]]:
+        """Token pieces of at most ``embedding_ctx_length`` and the text each came from."""
+        # replace newlines, which can negatively affect performance.
+        encoded = encode_batch(
+            get_encoding(self.document_model_name),
+            [text.replace("\n", " ") for text in texts],
+            self.tokenizer_threads,
+        )
+        ctx = self.embedding_ctx_length
+        if all(len(token) <= ctx for token in encoded):
+            return encoded, list(range(len(texts)))
+        tokens: List[List[int]] = []
+        indices: List[int] = []
+        for i, token in enumerate(encoded):
+            pieces = [token[j : j + ctx] for j in range(0, len(token), ctx)]
+            tokens.extend(pieces)
+            indices.extend([i] * len(pieces))
+        return tokens, indices
+
     # please refer to
     # https://github.com/openai/openai-cookbook/blob/main/examples/Embedding_long_inputs.ipynb
     def _get_len_safe_embeddings(
         self, texts: List[str], *, engine: str, chunk_size: Optional[int] = None
-    ) -> List[List[float]]:
-        embeddings: List[List[float]] = [[] for i in range(len(texts))]
+    ) -> np.ndarray:
         try:
-            import tiktoken
-
-            tokens = []
-            indices = []
-            encoding = tiktoken.model.encoding_for_model(self.document_model_name)
-            for i, text in enumerate(texts):
-                # replace newlines, which can negatively affect performance.
-                text = text.replace("\n", " ")
-                # Disable the check for disallowed special tokens
-                disallowed_special = ()
-                token = encoding.encode(
-                    text,
-                    disallowed_special=disallowed_special
-                )
-
-                for j in range(0, len(token), self.embedding_ctx_length):
-                    tokens += [token[j : j + self.embedding_ctx_length]]
-                    indices += [i]
-
-            batched_embeddings = []
-            _chunk_size = chunk_size or self.chunk_size
-            for i in range(0, len(tokens), _chunk_size):
-                response = embed_with_retry(
-                    self,
-                    input=tokens[i : i + _chunk_size],
-                    engine=self.document_model_name,
-                )
-                batched_embeddings += [r["embedding"] for r in response["data"]]
-
-            results: List[List[List[float]]] = [[] for i in range(len(texts))]
-            lens: List[List[int]] = [[] for i in range(len(texts))]
-            for i in range(len(indices)):
-                results[indices[i]].append(batched_embeddings[i])
-                lens[indices[i]].append(len(batched_embeddings[i]))
-
-            for i in range(len(texts)):
-                average = np.average(results[i], axis=0, weights=lens[i])
-                embeddings[i] = (average / np.linalg.norm(average)).tolist()
-
-            return embeddings
-
+            tokens, indices = self._tokenize(texts)
         except ImportError:
             raise ValueError(
                 "Could not import tiktoken python package. "
@@ -247,7 +322,72 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
                 "Please install it with `pip install tiktoken`."
             )
 
-    def _embedding_func(self, text: str, *, engine: str) -> List[float]:
+        _chunk_size = chunk_size or self.chunk_size
+        batches = [
+            tokens[i : i + _chunk_size] for i in range(0, len(tokens), _chunk_size)
+        ]
+        batched_embeddings = np.concatenate(self._embed_batches(batches))
+
+        # Most texts fit in one context window and need no averaging.
+        if len(indices) == len(texts):
+            average = batched_embeddings
+        else:
+            # Average the pieces of each text weighted by their token counts.
+            index = np.asarray(indices)
+            weights = np.fromiter((len(t) for t in tokens), np.float32, len(tokens))
+            average = np.zeros((len(texts), batched_embeddings.shape[1]), np.float32)
+            np.add.at(average, index, batched_embeddings * weights[:, None])
+            average /= np.bincount(index, weights, len(texts))[:, None].astype(np.float32)
+        return average / np.linalg.norm(average, axis=1, keepdims=True)
+
+    @staticmethod
+    def _response_matrix(response: Any) -> np.ndarray:
+        """Decode the embeddings of a response into a float32 matrix."""
+        rows = [r["embedding"] for r in response["data"]]
+        if rows and isinstance(rows[0], str):
+            return np.frombuffer(
+                b"".join(base64.b64decode(row) for row in rows), dtype=np.float32
+            ).reshape(len(rows), -1)
+        return np.asarray(rows, dtype=np.float32)
+
+    def _embed_batch(self, batch: List[Any]) -> np.ndarray:
+        limit = self.adaptive_batch_size
+        if limit and len(batch) > limit:
+            return np.concatenate([
+                self._embed_batch(batch[i : i + limit]) for i in range(0, len(batch), limit)
+            ])
+        try:
+            # Ask for base64 so vectors are decoded straight into float32 arrays
+            response = embed_with_retry(
+                self,
+                input=batch,
+                engine=self.document_model_name,
+                encoding_format="base64",
+                request_timeout=self.request_timeout,
+            )
+        except Exception as exc:
+            if len(batch) == 1 or error_kind(exc) != "size":
+                raise
+            # Rejected for its size: split in halves and send smaller batches from now on
+            half = len(batch) // 2
+            self.adaptive_batch_size = min(limit or half, half)
+            self.retry_policy.record("split_batches")
+            logger.warning("Batch of %d inputs rejected for its size, splitting: %s", len(batch), exc)
+            return np.concatenate([self._embed_batch(batch[:half]), self._embed_batch(batch[half:])])
+        return self._response_matrix(response)
+
+    def _embed_batches(self, batches: List[List[Any]]) -> List[np.ndarray]:
+        """Embed batches, up to ``max_concurrency`` of them in flight.
+
+        Results are returned in the same order as ``batches``.
+        """
+        if self.max_concurrency <= 1 or len(batches) <= 1:
+            return [self._embed_batch(batch) for batch in batches]
+        workers = min(self.max_concurrency, len(batches))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self._embed_batch, batches))
+
+    def _embedding_func(self, text: str, *, engine: str) -> np.ndarray:
         """Call out to OpenAI's embedding endpoint."""
         # handle large input text
         if self.embedding_ctx_length > 0:
@@ -255,9 +395,59 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
         else:
             # replace newlines, which can negatively affect performance.
             text = text.replace("\n", " ")
-            return embed_with_retry(self, input=[text], engine=engine)["data"][0][
-                "embedding"
-            ]
+            response = embed_with_retry(
+                self,
+                input=[text],
+                engine=engine,
+                encoding_format="base64",
+                request_timeout=self.request_timeout,
+            )
+            return self._response_matrix(response)[0]
+
+    def _embed_with_cache(
+        self,
+        texts: List[str],
+        model: str,
+        embed_func: Callable[[List[str]], np.ndarray],
+    ) -> np.ndarray:
+        """Serve ``texts`` from the cache and only embed the misses."""
+        cached = self.cache.get_many(model, texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            # Embed every distinct missing text once, even if it repeats.
+            unique: Dict[str, int] = {}
+            for i in missing:
+                unique.setdefault(texts[i], len(unique))
+            new_texts = list(unique)
+            new_vectors = embed_func(new_texts)
+            self.cache.put_many(model, new_texts, new_vectors)
+            for i in missing:
+                cached[i] = new_vectors[unique[texts[i]]]
+        logger.debug(
+            "Embedding cache: %d hits, %d misses", len(texts) - len(missing), len(missing)
+        )
+        return np.stack(cached) if cached else np.empty((0, 0), dtype=np.float32)
+
+    def embed_documents_array(
+        self, texts: List[str], chunk_size: Optional[int] = 0
+    ) -> np.ndarray:
+        """Embed search docs into a contiguous float32 matrix.
+
+        Args:
+            texts: The list of texts to embed.
+            chunk_size: The chunk size of embeddings. If None, will use the chunk size
+                specified by the class.
+
+        Returns:
+            Matrix of shape ``(len(texts), dim)`` with one unit vector per text.
+        """
+        if self.cache is not None:
+            return self._embed_with_cache(
+                texts,
+                self.document_model_name,
+                lambda missing: self._embed_documents(missing, chunk_size),
+            )
+        return self._embed_documents(texts, chunk_size)
 
     def embed_documents(
         self, texts: List[str], chunk_size: Optional[int] = 0
@@ -272,20 +462,22 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
         Returns:
             List of embeddings, one for each text.
         """
+        return self.embed_documents_array(texts, chunk_size).tolist()
+
+    def _embed_documents(
+        self, texts: List[str], chunk_size: Optional[int] = 0
+    ) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
         # handle batches of large input text
         if self.embedding_ctx_length > 0:
             return self._get_len_safe_embeddings(texts, engine=self.document_model_name)
         else:
-            results = []
             _chunk_size = chunk_size or self.chunk_size
-            for i in range(0, len(texts), _chunk_size):
-                response = embed_with_retry(
-                    self,
-                    input=texts[i : i + _chunk_size],
-                    engine=self.document_model_name,
-                )
-                results += [r["embedding"] for r in response["data"]]
-            return results
+            batches = [
+                texts[i : i + _chunk_size] for i in range(0, len(texts), _chunk_size)
+            ]
+            return np.concatenate(self._embed_batches(batches))
 
     def embed_query(self, text: str) -> List[float]:
         """Call out to OpenAI's embedding endpoint for embedding query text.
@@ -296,5 +488,14 @@ class OpenAIEmbeddings(BaseModel, Embeddings):
         Returns:
             Embedding for the text.
         """
+        if self.cache is not None:
+            return self._embed_with_cache(
+                [text],
+                self.query_model_name,
+                lambda missing: np.stack([
+                    self._embedding_func(t, engine=self.query_model_name)
+                    for t in missing
+                ]),
+            )[0].tolist()
         embedding = self._embedding_func(text, engine=self.query_model_name)
-        return embedding
+        return embedding.tolist()
@@ -0,0 +1,133 @@
+"""Client-side request and token budgets for OpenAI calls."""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+
+
+class _Bucket:
+    """Token bucket holding at most one minute worth of budget."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def observe(self, limit: float, remaining: float, now: float) -> None:
+        """Follow the budget the server reports, which also counts other clients' use."""
+        self.refill(now)
+        if limit != self.capacity:
+            self.capacity = float(limit)
+            self.rate = self.capacity / 60.0
+        self.level = min(self.level, float(remaining), self.capacity)
+
+    def wait_time(self, amount: float) -> float:
+        # A single request larger than the whole budget waits for a full bucket.
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+class RateLimiter:
+    """Thread-safe limiter enforcing requests- and tokens-per-minute budgets.
+
+    Either budget may be ``None`` to leave it unlimited. ``acquire`` blocks the
+    calling thread until both buckets can cover the request, so a pool of
+    workers sharing one limiter never exceeds the configured budgets.
+
+    Budgets also follow the server: ``observe_headers`` adopts the limits and
+    remaining budget of OpenAI's ``x-ratelimit-*`` response headers, creating
+    a bucket if none was configured, and ``pause`` holds every caller back
+    after a rate limit error until its ``Retry-After`` has passed.
+
+    Example:
+        .. code-block:: python
+
+            limiter = RateLimiter(requests_per_minute=3000, tokens_per_minute=1_000_000)
+            limiter.acquire(tokens=812)
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        self._requests = _Bucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = _Bucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.waits = 0
+        self.waited_seconds = 0.0
+        self.pauses = 0
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until one request of ``tokens`` tokens fits the budget.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = max(0.0, self._paused_until - now)
+                if self._requests is not None:
+                    self._requests.refill(now)
+                    delay = max(delay, self._requests.wait_time(1))
+                if self._tokens is not None:
+                    self._tokens.refill(now)
+                    delay = max(delay, self._tokens.wait_time(tokens))
+                if delay == 0.0:
+                    if self._requests is not None:
+                        self._requests.level -= 1
+                    if self._tokens is not None:
+                        self._tokens.level -= min(tokens, self._tokens.capacity)
+                    if waited:
+                        self.waits += 1
+                        self.waited_seconds += waited
+                    return waited
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller of ``acquire`` for at least ``seconds`` from now."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                self.pauses += 1
+
+    def observe_headers(self, headers: Mapping[str, Any]) -> None:
+        """Update the budgets from ``x-ratelimit-{limit,remaining}-{requests,tokens}`` headers."""
+        with self._lock:
+            now = time.monotonic()
+            for kind in ("requests", "tokens"):
+                try:
+                    limit = float(headers[f"x-ratelimit-limit-{kind}"])
+                    remaining = float(headers[f"x-ratelimit-remaining-{kind}"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if limit <= 0:
+                    continue
+                bucket = getattr(self, f"_{kind}")
+                if bucket is None:
+                    bucket = _Bucket(limit)
+                    setattr(self, f"_{kind}", bucket)
+                bucket.observe(limit, remaining, now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "waits": self.waits,
+                "waited_seconds": self.waited_seconds,
+                "pauses": self.pauses,
+                "requests_per_minute": self._requests.capacity if self._requests else None,
+                "tokens_per_minute": self._tokens.capacity if self._tokens else None,
+            }
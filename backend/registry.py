@@ -0,0 +1,255 @@
+"""Registry of named, separately persisted document collections."""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_COLLECTION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def validate_collection_id(collection_id: str) -> str:
+    """Reject ids that are not safe to use as a directory name."""
+    if not _COLLECTION_ID.match(collection_id or ""):
+        raise ValueError(
+            "Invalid collection id. Use 1-64 letters, digits, '_' or '-'."
+        )
+    return collection_id
+
+
+class CollectionRegistry:
+    """LRU cache of open collections, bounded by their estimated memory.
+
+    Every collection lives in ``<root>/<collection_id>``. ``factory`` opens
+    one given its id and directory; the returned object must provide
+    ``estimated_bytes()``, ``busy()`` and ``close()``; ``estimated_bytes()``
+    is called under the registry lock and must be cheap, e.g. a size cached
+    when the collection last changed. When the open collections exceed
+    ``max_bytes`` the least recently used idle ones are closed; they are
+    reopened from disk on their next use. A collection is idle when it is
+    not ``busy()`` and nobody holds a lease on it: queries and queued jobs
+    take one with :meth:`acquire` or :meth:`lease`.
+
+    The registry trims when it creates a collection; collections that grow
+    later, by being opened from disk or by ingestion, call :meth:`trim`
+    themselves.
+
+    ``is_collection`` tells persisted collections apart from other
+    directories under ``root``. How often each collection is used is kept in
+    ``<root>/usage.json`` so that, after a restart, :meth:`prewarm` can open
+    the busiest ones before their first question arrives.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str, str], Any],
+        root: str = "db_index",
+        max_bytes: int = 512 * 1024 * 1024,
+        is_collection: Optional[Callable[[str], bool]] = None,
+        usage_save_interval: float = 60.0,
+    ):
+        self.factory = factory
+        self.root = root
+        self.max_bytes = max_bytes
+        self.is_collection = is_collection or os.path.isdir
+        self.usage_save_interval = usage_save_interval
+        self.evictions = 0
+        self.prewarmed: List[str] = []
+        self._open: "OrderedDict[str, Any]" = OrderedDict()
+        self._leases: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._usage = self._load_usage()
+        self._usage_saved = time.monotonic()
+
+    def path(self, collection_id: str) -> str:
+        return os.path.join(self.root, validate_collection_id(collection_id))
+
+    def get(self, collection_id: str, count_use: bool = True, create: bool = True) -> Any:
+        """Return the collection, opening or creating it if needed.
+
+        With ``create=False`` ids that are neither open nor persisted raise
+        ``KeyError`` instead of registering an empty collection.
+        """
+        with self._lock:
+            collection = self._open.get(collection_id)
+            if collection is None:
+                path = self.path(collection_id)
+                if not create and not self.is_collection(path):
+                    raise KeyError(collection_id)
+                collection = self.factory(collection_id, path)
+                self._open[collection_id] = collection
+                self.trim()
+            self._open.move_to_end(collection_id)
+            if count_use:
+                self._count_use(collection_id)
+            return collection
+
+    def acquire(self, collection_id: str, create: bool = True, count_use: bool = True) -> Any:
+        """Like :meth:`get`, and keep the collection open until :meth:`release`."""
+        with self._lock:
+            collection = self.get(collection_id, count_use=count_use, create=create)
+            self._leases[collection_id] = self._leases.get(collection_id, 0) + 1
+            return collection
+
+    def release(self, collection_id: str) -> None:
+        with self._lock:
+            count = self._leases.get(collection_id, 0) - 1
+            if count > 0:
+                self._leases[collection_id] = count
+            else:
+                self._leases.pop(collection_id, None)
+
+    @contextmanager
+    def lease(self, collection_id: str, create: bool = True, count_use: bool = True) -> Iterator[Any]:
+        """Hold the collection open for the duration of a ``with`` block.
+
+        Example:
+            .. code-block:: python
+
+                with registry.lease("reports", create=False) as chat:
+                    chat.answer_question("What changed?")
+        """
+        collection = self.acquire(collection_id, create=create, count_use=count_use)
+        try:
+            yield collection
+        finally:
+            self.release(collection_id)
+
+    def trim(self) -> None:
+        """Close least recently used idle collections until within ``max_bytes``."""
+        with self._lock:
+            sizes = {id_: c.estimated_bytes() for id_, c in self._open.items()}
+            total = sum(sizes.values())
+            # Never evict the most recently used collection
+            for id_ in list(self._open)[:-1]:
+                if total <= self.max_bytes:
+                    break
+                collection = self._open[id_]
+                if self._leases.get(id_) or collection.busy():
+                    continue
+                logger.info("Closing collection %s (%d bytes)", id_, sizes[id_])
+                collection.close()
+                del self._open[id_]
+                total -= sizes[id_]
+                self.evictions += 1
+
+    def ids(self) -> List[str]:
+        """Ids of every collection persisted under ``root`` or currently open."""
+        with self._lock:
+            return sorted(set(self.discover()) | set(self._open))
+
+    def discover(self) -> List[str]:
+        """Ids of the collections persisted under ``root``, without opening them."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if _COLLECTION_ID.match(name) and self.is_collection(os.path.join(self.root, name))
+        )
+
+    # -- usage -------------------------------------------------------------
+
+    def _usage_path(self) -> str:
+        return os.path.join(self.root, "usage.json")
+
+    def _load_usage(self) -> Dict[str, Dict[str, float]]:
+        try:
+            with open(self._usage_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _count_use(self, collection_id: str) -> None:
+        entry = self._usage.setdefault(collection_id, {"uses": 0, "last_used": 0.0})
+        entry["uses"] += 1
+        entry["last_used"] = time.time()
+        if time.monotonic() - self._usage_saved >= self.usage_save_interval:
+            self.save_usage()
+
+    def save_usage(self) -> None:
+        """Write the usage counts to ``<root>/usage.json``."""
+        with self._lock:
+            if not self._usage:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = self._usage_path() + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._usage, f)
+            os.replace(tmp_path, self._usage_path())
+            self._usage_saved = time.monotonic()
+
+    def most_used(self, limit: Optional[int] = None) -> List[str]:
+        """Persisted collections, most used first, then most recently used."""
+        with self._lock:
+            usage = {id_: dict(entry) for id_, entry in self._usage.items()}
+        ranked = sorted(
+            self.discover(),
+            key=lambda id_: (usage.get(id_, {}).get("uses", 0), usage.get(id_, {}).get("last_used", 0.0)),
+            reverse=True,
+        )
+        return ranked[:limit] if limit is not None else ranked
+
+    def prewarm(self, limit: int, warm: Callable[[Any], None]) -> threading.Thread:
+        """Open and ``warm`` the ``limit`` most used collections on a background thread.
+
+        Stops early once the open collections reach ``max_bytes``, so warming
+        never evicts what it just loaded. Opening does not count as a use.
+        """
+
+        def run() -> None:
+            for collection_id in self.most_used(limit):
+                with self._lock:
+                    open_bytes = sum(c.estimated_bytes() for c in self._open.values())
+                    evictions = self.evictions
+                if open_bytes >= self.max_bytes:
+                    break
+                start = time.perf_counter()
+                try:
+                    # Leased, so a trim by another collection cannot close it mid-warm
+                    with self.lease(collection_id, count_use=False) as collection:
+                        warm(collection)
+                except Exception:
+                    logger.exception("Failed to pre-warm collection %s", collection_id)
+                    continue
+                self.prewarmed.append(collection_id)
+                logger.info("Pre-warmed collection %s in %.2fs", collection_id, time.perf_counter() - start)
+                # Warming this one pushed a colder collection out, the cache is full
+                with self._lock:
+                    self.trim()
+                    if self.evictions > evictions:
+                        break
+
+        thread = threading.Thread(target=run, name="prewarm", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            open_sizes = {id_: c.estimated_bytes() for id_, c in self._open.items()}
+            usage = {id_: entry["uses"] for id_, entry in self._usage.items()}
+            leases = dict(self._leases)
+        return {
+            "collections": self.ids(),
+            "open": open_sizes,
+            "leases": leases,
+            "open_bytes": sum(open_sizes.values()),
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "prewarmed": list(self.prewarmed),
+            "usage": usage,
+        }
+
+    def close_all(self) -> None:
+        self.save_usage()
+        with self._lock:
+            for collection in self._open.values():
+                collection.close()
+            self._open.clear()
@@ -0,0 +1,238 @@
+"""Retries with jittered backoff, a circuit breaker and counters for OpenAI calls."""
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Mapping, Optional, TypeVar
+
+from rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Phrases of OpenAI errors that reject a request for its size, not its rate
+_SIZE_ERRORS = ("too large", "maximum context length", "too many inputs", "maximum request size")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"OpenAI API unavailable, not retrying for {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def error_kind(exc: BaseException) -> Optional[str]:
+    """Classify an ``openai`` exception.
+
+    Returns ``"size"`` for requests rejected for their size, ``"rate_limit"``
+    for 429s, ``"server"`` for 5xx, timeouts and connection errors, and
+    ``None`` for errors retrying cannot fix.
+    """
+    import openai
+
+    status = getattr(exc, "http_status", None)
+    message = str(exc).lower()
+    if status == 413 or (
+        isinstance(exc, (openai.error.InvalidRequestError, openai.error.RateLimitError))
+        and any(phrase in message for phrase in _SIZE_ERRORS)
+    ):
+        return "size"
+    if isinstance(exc, openai.error.RateLimitError) or status == 429:
+        return "rate_limit"
+    if isinstance(exc, (
+        openai.error.Timeout,
+        openai.error.APIConnectionError,
+        openai.error.ServiceUnavailableError,
+    )) or (isinstance(exc, openai.error.APIError) and (status is None or status >= 500)):
+        return "server"
+    return None
+
+
+def retry_after(headers: Optional[Mapping[str, Any]]) -> Optional[float]:
+    """Seconds to wait from ``Retry-After`` or ``retry-after-ms``, if the server sent them."""
+    if not headers:
+        return None
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return float(value) * scale
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class CircuitBreaker:
+    """Fail fast after ``failure_threshold`` consecutive server failures.
+
+    While open, calls raise :class:`CircuitOpenError` without touching the
+    network. After ``reset_timeout`` seconds one trial call is let through
+    (half-open): success closes the circuit again, failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            # Only one trial call at a time while half-open
+            if remaining > 0 or self._trial:
+                self.rejected += 1
+                raise CircuitOpenError(max(remaining, 0.0))
+            self._trial = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self._opened_at is None and self.failures >= self.failure_threshold):
+                self.opened += 1
+                self._opened_at = time.monotonic()
+                logger.warning("Circuit opened after %d failures", self.failures)
+            self._trial = False
+
+
+class RetryPolicy:
+    """Shared retry loop for API calls.
+
+    Every attempt first waits for the :class:`RateLimiter` budget and the
+    :class:`CircuitBreaker`. Rate limit errors update the limiter from their
+    headers and pause all callers for ``Retry-After``; each caller then adds
+    its own random delay, so concurrent batches do not retry in lockstep.
+    Server errors back off with full jitter, ``uniform(0, min(max_delay,
+    base_delay * 2 ** attempt))``, and count towards opening the circuit.
+    Size errors and other client errors are raised at once. ``max_retries``
+    is the total number of attempts, as with tenacity's ``stop_after_attempt``.
+
+    Example:
+        .. code-block:: python
+
+            policy = RetryPolicy(rate_limiter=RateLimiter(), breaker=CircuitBreaker())
+            response = policy.call(lambda: openai.Embedding.create(...), tokens=812)
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        rate_limiter: Optional[RateLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        classify: Callable[[BaseException], Optional[str]] = error_kind,
+        sleep: Callable[[float], None] = time.sleep,
+        seed: Optional[int] = None,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker
+        self.classify = classify
+        self.sleep = sleep
+        self._random = random.Random(seed)
+        self._counts: Dict[str, int] = {
+            "calls": 0, "retries": 0, "rate_limited": 0, "server_errors": 0, "gave_up": 0,
+            "split_batches": 0,
+        }
+        self._lock = threading.Lock()
+
+    def record(self, event: str) -> None:
+        """Count ``event``, reported with the other counters by :meth:`stats`."""
+        with self._lock:
+            self._counts[event] = self._counts.get(event, 0) + 1
+
+    def backoff(self, attempt: int, wait: Optional[float] = None) -> float:
+        """Delay before retry number ``attempt`` (0-based), at least ``wait`` seconds."""
+        window = min(self.max_delay, self.base_delay * 2 ** attempt)
+        with self._lock:
+            jitter = self._random.uniform(0, window)
+        if wait is not None:
+            return wait + jitter * 0.5
+        return jitter
+
+    def call(self, func: Callable[[], T], tokens: int = 0) -> T:
+        """Run ``func`` until it succeeds, fails for good or runs out of retries."""
+        self.record("calls")
+        attempt = 0
+        while True:
+            if self.breaker is not None:
+                self.breaker.before_call()
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(tokens)
+            try:
+                result = func()
+            except Exception as exc:
+                kind = self.classify(exc)
+                # Anything but a server error means the API is up
+                if kind != "server" and self.breaker is not None:
+                    self.breaker.record_success()
+                if kind is None or kind == "size":
+                    raise
+                headers = getattr(exc, "headers", None)
+                wait = None
+                if kind == "rate_limit":
+                    self.record("rate_limited")
+                    wait = retry_after(headers)
+                    if self.rate_limiter is not None:
+                        if headers:
+                            self.rate_limiter.observe_headers(headers)
+                        if wait is not None:
+                            self.rate_limiter.pause(wait)
+                else:
+                    self.record("server_errors")
+                    if self.breaker is not None:
+                        self.breaker.record_failure()
+                if attempt + 1 >= self.max_retries:
+                    self.record("gave_up")
+                    raise
+                delay = self.backoff(attempt, wait)
+                logger.warning("Retrying in %.2fs after %s: %s", delay, kind, exc)
+                self.record("retries")
+                self.sleep(delay)
+                attempt += 1
+                continue
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counts)
+        if self.breaker is not None:
+            stats["circuit"] = {
+                "state": self.breaker.state,
+                "opened": self.breaker.opened,
+                "rejected": self.breaker.rejected,
+            }
+        if self.rate_limiter is not None:
+            stats["rate_limiter"] = self.rate_limiter.stats()
+        return stats
@@ -0,0 +1,71 @@
+"""Token streaming from LangChain callbacks to Server-Sent Events."""
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class TokenQueueHandler(BaseCallbackHandler):
+    """Callback handler forwarding every new LLM token into a queue."""
+
+    def __init__(self, tokens: "queue.Queue[Any]"):
+        self.tokens = tokens
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.tokens.put(token)
+
+
+def stream_tokens(run: Callable[[BaseCallbackHandler], Any], result: Dict[str, Any]) -> Iterator[str]:
+    """Call ``run(handler)`` in a thread and yield tokens as they arrive.
+
+    The return value of ``run`` is stored in ``result["output"]``; an exception
+    raised by it is re-raised once the tokens produced so far are yielded.
+    """
+    tokens: "queue.Queue[Any]" = queue.Queue()
+
+    def target() -> None:
+        try:
+            result["output"] = run(TokenQueueHandler(tokens))
+        except Exception as e:
+            result["error"] = e
+        finally:
+            tokens.put(_DONE)
+
+    threading.Thread(target=target, daemon=True).start()
+    while True:
+        token = tokens.get()
+        if token is _DONE:
+            break
+        yield token
+    if "error" in result:
+        raise result["error"]
+
+
+def sse_events(
+    events: Iterable[Dict[str, Any]], on_close: Optional[Callable[[], None]] = None
+) -> Iterator[str]:
+    """Format ``events`` as Server-Sent Events, turning errors into an error event.
+
+    The response has already started when an error is raised, so it can only
+    be reported in the stream. ``on_close`` runs once the stream ends, fails
+    or is abandoned by the client.
+    """
+    try:
+        for event in events:
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+    except Exception as e:
+        if not isinstance(e, ValueError):
+            logger.exception("Streaming an answer failed")
+        yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+    finally:
+        if on_close is not None:
+            on_close()
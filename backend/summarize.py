@@ -0,0 +1,190 @@
+"""Concurrent, cached map-reduce summarization."""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain.base_language import BaseLanguageModel
+from langchain.chains import LLMChain
+from langchain.chains.summarize.map_reduce_prompt import PROMPT
+from langchain.docstore.document import Document
+from langchain.prompts import PromptTemplate
+
+from embedding_cache import cache_key
+from rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryCache:
+    """SQLite cache of LLM summaries keyed by ``(model, step, sha256(text))``.
+
+    Like :class:`embedding_cache.EmbeddingCache`, the least recently used
+    entries are evicted once the table grows past ``max_entries``.
+    """
+
+    def __init__(self, path: str = "summary_cache.sqlite3", max_entries: int = 100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " key TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS summaries_last_used ON summaries (last_used)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE summaries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, summary: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, last_used) VALUES (?, ?, ?)",
+                (key, summary, time.time()),
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM summaries WHERE key IN ("
+                    " SELECT key FROM summaries ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "max_entries": self.max_entries,
+            }
+
+
+class MapReduceSummarizer:
+    """Map-reduce summarization with concurrent, rate limited and cached LLM calls.
+
+    Every chunk is summarized on its own (map), then consecutive summaries are
+    combined in groups of at most ``max_group_tokens`` tokens, level by level,
+    until one summary is left (reduce). Each call is cached by the hash of its
+    input text, so summarizing an unchanged document again makes no LLM calls
+    and an edited one only redoes the changed chunks and the groups above them.
+
+    Args:
+        llm: Model used for every map and reduce call.
+        cache: Optional :class:`SummaryCache`.
+        max_concurrency: LLM calls in flight at the same time.
+        rate_limiter: Optional budget shared by all calls.
+        max_group_tokens: Largest input of a single reduce call.
+        map_prompt: Prompt with a ``{text}`` variable for chunks.
+        reduce_prompt: Prompt with a ``{text}`` variable for joined summaries.
+    """
+
+    def __init__(
+        self,
+        llm: BaseLanguageModel,
+        cache: Optional[SummaryCache] = None,
+        max_concurrency: int = 4,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_group_tokens: int = 3000,
+        map_prompt: PromptTemplate = PROMPT,
+        reduce_prompt: PromptTemplate = PROMPT,
+    ):
+        self.llm = llm
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter
+        self.max_group_tokens = max_group_tokens
+        self.map_chain = LLMChain(llm=llm, prompt=map_prompt)
+        self.reduce_chain = LLMChain(llm=llm, prompt=reduce_prompt)
+        self._lock = threading.Lock()
+
+    @property
+    def model(self) -> str:
+        return getattr(self.llm, "model_name", type(self.llm).__name__)
+
+    def _count_tokens(self, text: str) -> int:
+        return self.llm.get_num_tokens(text)
+
+    def _run(self, step: str, chain: LLMChain, text: str, stats: Dict[str, Any]) -> str:
+        key = cache_key(f"{self.model}\0{step}\0{chain.prompt.template}", text)
+        if self.cache is not None:
+            summary = self.cache.get(key)
+            if summary is not None:
+                with self._lock:
+                    stats["cached"] += 1
+                return summary
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self._count_tokens(text))
+        summary = chain.run(text=text).strip()
+        with self._lock:
+            stats["llm_calls"] += 1
+        if self.cache is not None:
+            self.cache.put(key, summary)
+        return summary
+
+    def _run_all(self, step: str, chain: LLMChain, texts: Sequence[str], stats: Dict[str, Any]) -> List[str]:
+        if self.max_concurrency <= 1 or len(texts) <= 1:
+            return [self._run(step, chain, text, stats) for text in texts]
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(texts))) as pool:
+            return list(pool.map(lambda text: self._run(step, chain, text, stats), texts))
+
+    def _groups(self, summaries: Sequence[str]) -> List[List[str]]:
+        groups: List[List[str]] = [[]]
+        size = 0
+        for summary in summaries:
+            tokens = self._count_tokens(summary)
+            if groups[-1] and size + tokens > self.max_group_tokens:
+                groups.append([])
+                size = 0
+            groups[-1].append(summary)
+            size += tokens
+        return groups
+
+    def summarize(
+        self,
+        docs: Sequence[Document],
+        progress: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Summarize ``docs`` in order.
+
+        ``progress`` receives the chunk count, reduce levels done and the
+        number of LLM calls and cache hits so far.
+        """
+        if not docs:
+            raise ValueError("Nothing to summarize")
+        progress = progress if progress is not None else {}
+        progress.update(chunks=len(docs), levels=0, llm_calls=0, cached=0)
+        summaries = self._run_all("map", self.map_chain, [doc.page_content for doc in docs], progress)
+        while len(summaries) > 1:
+            groups = self._groups(summaries)
+            # A group of one summary cannot shrink any further by itself
+            if len(groups) == len(summaries) and len(groups) > 1:
+                groups = [summaries[i : i + 2] for i in range(0, len(summaries), 2)]
+            summaries = self._run_all(
+                "reduce", self.reduce_chain, ["\n\n".join(group) for group in groups], progress
+            )
+            progress["levels"] += 1
+        logger.info("Summarized %d chunks with %d LLM calls", len(docs), progress["llm_calls"])
+        return summaries[0]
@@ -0,0 +1,194 @@
+"""Columnar cache of CSV/Excel uploads and a single-call SQL planner over it."""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+import duckdb
+import pandas as pd
+from langchain.base_language import BaseLanguageModel
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = "data"
+EXCEL_EXTENSIONS = (".xlsx", ".xls")
+
+_PLAN_PROMPT = PromptTemplate(
+    input_variables=["schema", "question"],
+    template=(
+        "You write DuckDB SQL. {schema}\n\n"
+        "Write one SELECT statement over the table that answers the question below. "
+        "Quote column names with double quotes. Return only the SQL, no explanation.\n\n"
+        "Question: {question}\nSQL:"
+    ),
+)
+_CODE_FENCE = re.compile(r"^```(?:sql)?\s*|\s*```$", re.IGNORECASE)
+
+
+def _file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Table:
+    """A cached upload: Parquet data, column statistics and an open DuckDB view.
+
+    The DuckDB connection holds the data in memory and has file system access
+    disabled, so generated SQL can only read the table itself.
+    """
+
+    def __init__(self, parquet_path: str, stats: Dict[str, Any]):
+        self.parquet_path = parquet_path
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._conn = duckdb.connect()
+        self._conn.execute(f"CREATE TABLE {TABLE_NAME} AS SELECT * FROM read_parquet(?)", [parquet_path])
+        self._conn.execute("SET enable_external_access = false")
+        self._conn.execute("SET lock_configuration = true")
+
+    @property
+    def rows(self) -> int:
+        return self.stats["rows"]
+
+    def schema_summary(self) -> str:
+        """Compact description of the table used as planner context."""
+        lines = [f'Table "{TABLE_NAME}" has {self.rows} rows and these columns:']
+        for column in self.stats["columns"]:
+            line = f'- "{column["name"]}" {column["type"]}, {column["distinct"]} distinct'
+            if column["null_percentage"]:
+                line += f', {column["null_percentage"]:.0f}% null'
+            if column.get("values"):
+                line += ", values: " + ", ".join(repr(value) for value in column["values"])
+            elif column["min"] is not None:
+                line += f', range {column["min"]} .. {column["max"]}'
+            lines.append(line)
+        return "\n".join(lines)
+
+    def query(self, sql: str) -> pd.DataFrame:
+        with self._lock:
+            return self._conn.execute(sql).fetchdf()
+
+    def frame(self) -> pd.DataFrame:
+        return self.query(f"SELECT * FROM {TABLE_NAME}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class TableCache:
+    """Convert CSV/Excel files once to Parquet with precomputed column statistics.
+
+    Files are keyed by the sha256 of their bytes, so uploading the same file
+    again, under any name, reuses ``<root>/<hash>.parquet`` and its
+    ``<hash>.json`` statistics without parsing it.
+
+    Example:
+        .. code-block:: python
+
+            table = TableCache("table_cache").load("documents/sales.csv")
+            print(table.schema_summary())
+    """
+
+    def __init__(self, root: str = "table_cache", top_values: int = 8):
+        self.root = root
+        self.top_values = top_values
+        os.makedirs(root, exist_ok=True)
+
+    def load(self, file_path: str, content_hash: Optional[str] = None) -> Table:
+        """Open the cached table of ``file_path``, converting it on first use.
+
+        ``content_hash`` is the file's sha256 when the caller already computed it.
+        """
+        key = content_hash or _file_hash(file_path)
+        parquet_path = os.path.join(self.root, key + ".parquet")
+        stats_path = os.path.join(self.root, key + ".json")
+        if not (os.path.exists(parquet_path) and os.path.exists(stats_path)):
+            self._convert(file_path, parquet_path, stats_path)
+        with open(stats_path, "r") as f:
+            stats = json.load(f)
+        return Table(parquet_path, stats)
+
+    def _convert(self, file_path: str, parquet_path: str, stats_path: str) -> None:
+        conn = duckdb.connect()
+        try:
+            # DuckDB's CSV reader detects numeric and date columns; Excel goes through pandas
+            if file_path.lower().endswith(EXCEL_EXTENSIONS):
+                conn.register("upload", pd.read_excel(file_path))
+                conn.execute(f"CREATE TABLE {TABLE_NAME} AS SELECT * FROM upload")
+            else:
+                conn.execute(f"CREATE TABLE {TABLE_NAME} AS SELECT * FROM read_csv_auto(?)", [file_path])
+            # Written under a temporary name so readers never see a partial file
+            conn.execute(f"COPY {TABLE_NAME} TO '{parquet_path}.tmp' (FORMAT PARQUET)")
+            os.replace(parquet_path + ".tmp", parquet_path)
+            stats = {
+                "source": os.path.basename(file_path),
+                "rows": conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0],
+                "columns": self._column_stats(conn),
+            }
+        finally:
+            conn.close()
+        with open(stats_path, "w") as f:
+            json.dump(stats, f, ensure_ascii=False, default=str)
+        logger.info("Cached %s as %s (%d rows)", file_path, parquet_path, stats["rows"])
+
+    def _column_stats(self, conn: duckdb.DuckDBPyConnection) -> List[Dict[str, Any]]:
+        columns = []
+        for row in conn.execute(f"SUMMARIZE {TABLE_NAME}").fetchdf().to_dict("records"):
+            column = {
+                "name": row["column_name"],
+                "type": row["column_type"],
+                "distinct": int(row["approx_unique"]),
+                "null_percentage": float(row["null_percentage"]),
+                "min": None if pd.isna(row["min"]) else row["min"],
+                "max": None if pd.isna(row["max"]) else row["max"],
+            }
+            if row["column_type"] == "VARCHAR" and column["distinct"] <= 2 * self.top_values:
+                name = column["name"].replace('"', '""')
+                column["values"] = [
+                    value for (value,) in conn.execute(
+                        f'SELECT "{name}" FROM {TABLE_NAME} WHERE "{name}" IS NOT NULL'
+                        f' GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT {self.top_values}'
+                    ).fetchall()
+                ]
+            columns.append(column)
+        return columns
+
+
+class TablePlanner:
+    """Answer questions about a :class:`Table` with one LLM call.
+
+    The model sees only the schema summary and writes a single SQL query, which
+    runs locally in DuckDB. The result table is the answer; no agent loop and
+    no second call to phrase it.
+    """
+
+    def __init__(self, llm: BaseLanguageModel, max_rows: int = 50):
+        self.chain = LLMChain(llm=llm, prompt=_PLAN_PROMPT)
+        self.max_rows = max_rows
+
+    def plan(self, table: Table, question: str) -> str:
+        sql = self.chain.run(schema=table.schema_summary(), question=question)
+        sql = _CODE_FENCE.sub("", sql.strip()).strip().rstrip(";")
+        if not re.match(r"^(SELECT|WITH)\b", sql, re.IGNORECASE) or ";" in sql:
+            raise ValueError(f"Planner did not return a single SELECT statement: {sql!r}")
+        return sql
+
+    def answer(self, table: Table, question: str, sql: Optional[str] = None) -> Dict[str, Any]:
+        sql = sql or self.plan(table, question)
+        result = table.query(sql)
+        if result.shape == (1, 1):
+            answer = str(result.iat[0, 0])
+        else:
+            answer = result.head(self.max_rows).to_markdown(index=False)
+        return {"answer": answer, "sql": sql, "rows": len(result)}
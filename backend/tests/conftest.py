@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules live directly in backend/, as when the app and benchmarks are run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,151 @@
+"""Retries, the circuit breaker and the rate limiter against the fake OpenAI server.
+
+Token ids come from a stub encoding, one per word, so the tests run offline
+without tiktoken's downloaded encodings.
+"""
+import time
+
+import openai
+import pytest
+
+import modify
+from fake_openai import FakeOpenAIServer
+from modify import OpenAIEmbeddings
+from retry import CircuitOpenError
+
+
+class StubEncoding:
+    def encode(self, text, **kwargs):
+        return [len(word) for word in text.split()]
+
+    def encode_batch(self, texts, **kwargs):
+        return [self.encode(text) for text in texts]
+
+
+@pytest.fixture(autouse=True)
+def stub_encoding(monkeypatch):
+    monkeypatch.setattr(modify, "get_encoding", lambda model_name: StubEncoding())
+
+
+@pytest.fixture
+def server():
+    server = FakeOpenAIServer(dim=8, retry_after=0.2, stall=1.0).start()
+    yield server
+    server.stop()
+
+
+def make_embeddings(server, **kwargs):
+    options = dict(openai_api_key="fake", openai_api_base=server.url,
+                   retry_base_delay=0.01, retry_max_delay=0.05)
+    options.update(kwargs)
+    return OpenAIEmbeddings(**options)
+
+
+def test_server_errors_are_retried(server):
+    embeddings = make_embeddings(server)
+    server.fail_next(500, 502, 503)
+
+    embeddings.embed_query("three failures then an answer")
+
+    assert server.stats()["requests"] == 4
+    stats = embeddings.retry_policy.stats()
+    assert (stats["retries"], stats["server_errors"], stats["gave_up"]) == (3, 3, 0)
+
+
+def test_max_retries_counts_attempts(server):
+    embeddings = make_embeddings(server, max_retries=3)
+    server.fail_next(*[500] * 5)
+
+    with pytest.raises(openai.error.APIError):
+        embeddings.embed_query("never answered")
+
+    assert server.stats()["requests"] == 3
+    assert embeddings.retry_policy.stats()["gave_up"] == 1
+
+
+def test_client_errors_are_not_retried(server):
+    embeddings = make_embeddings(server)
+    server.fail_next(401)
+
+    with pytest.raises(openai.error.AuthenticationError):
+        embeddings.embed_query("bad key")
+
+    assert server.stats()["requests"] == 1
+
+
+def test_rate_limit_waits_for_retry_after(server):
+    embeddings = make_embeddings(server)
+    server.fail_next(429)
+
+    start = time.perf_counter()
+    embeddings.embed_query("rate limited once")
+
+    assert time.perf_counter() - start >= server.retry_after
+    assert server.stats()["requests"] == 2
+    stats = embeddings.retry_policy.stats()
+    assert stats["rate_limited"] == 1
+    assert stats["rate_limiter"]["pauses"] == 1
+    # Rate limits say nothing about the server's health
+    assert stats["circuit"]["state"] == "closed"
+
+
+def test_timeouts_are_retried(server):
+    embeddings = make_embeddings(server, request_timeout=0.2)
+    server.fail_next("timeout")
+
+    embeddings.embed_query("slow then fast")
+
+    assert server.stats()["requests"] == 2
+    assert embeddings.retry_policy.stats()["server_errors"] == 1
+
+
+def test_circuit_opens_and_fails_fast(server):
+    embeddings = make_embeddings(server, max_retries=2, circuit_failure_threshold=2,
+                                 circuit_reset_timeout=60)
+    server.fail_next(500, 500)
+
+    with pytest.raises(openai.error.APIError):
+        embeddings.embed_query("outage")
+    with pytest.raises(CircuitOpenError):
+        embeddings.embed_query("during the outage")
+
+    assert server.stats()["requests"] == 2
+    circuit = embeddings.retry_policy.stats()["circuit"]
+    assert (circuit["state"], circuit["opened"], circuit["rejected"]) == ("open", 1, 1)
+
+
+def test_circuit_closes_after_a_successful_trial(server):
+    embeddings = make_embeddings(server, max_retries=1, circuit_failure_threshold=1,
+                                 circuit_reset_timeout=0.2)
+    server.fail_next(500)
+    with pytest.raises(openai.error.APIError):
+        embeddings.embed_query("outage")
+    assert embeddings.retry_policy.breaker.state == "open"
+
+    time.sleep(0.25)
+    embeddings.embed_query("recovered")
+
+    assert embeddings.retry_policy.breaker.state == "closed"
+
+
+def test_token_budget_waits(server):
+    # 600 tokens a minute refill at 10 per second
+    embeddings = make_embeddings(server, tokens_per_minute=600)
+    embeddings.embed_documents([" ".join(["word"] * 600)])
+
+    start = time.perf_counter()
+    embeddings.embed_query("five more tokens to send")
+
+    assert time.perf_counter() - start >= 0.4
+    limiter = embeddings.rate_limiter.stats()
+    assert limiter["waits"] == 1
+    assert server.stats()["requests"] == 2
+
+
+def test_budget_follows_response_headers(server):
+    server.requests_per_minute = 1000
+    embeddings = make_embeddings(server)
+
+    embeddings.embed_query("learn the budget")
+
+    assert embeddings.rate_limiter.stats()["requests_per_minute"] == 1000
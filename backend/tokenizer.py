@@ -0,0 +1,116 @@
+"""Shared tiktoken encodings and a cache of token counts."""
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Sequence
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str) -> Any:
+    """The tiktoken encoding of ``model_name``, resolved once per process."""
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model_name)
+
+
+def encode_batch(encoding: Any, texts: Sequence[str], num_threads: int = 1) -> List[List[int]]:
+    """Token ids of every text, special tokens encoded as plain text.
+
+    With ``num_threads > 1`` large batches are encoded on tiktoken's thread
+    pool, which releases the GIL; small ones are not worth the hand-off.
+    """
+    if num_threads > 1 and len(texts) >= 4 * num_threads:
+        return encoding.encode_batch(list(texts), num_threads=num_threads, disallowed_special=())
+    return [encoding.encode(text, disallowed_special=()) for text in texts]
+
+
+class TokenCounter:
+    """Count tokens with the encoding of ``model_name``, remembering recent counts.
+
+    Splitters measure the same separators and pieces over and over, and the
+    same retrieved chunks are measured on every question that returns them;
+    each distinct text is only encoded once while it stays among the
+    ``max_entries`` most recently counted. Counts are keyed by a 16-byte
+    digest of the text, so the cache does not keep chunk texts alive and its
+    memory stays flat however large the corpus. Instances are callable, so one
+    can be passed wherever a ``length_function`` or ``count_tokens`` is
+    expected.
+
+    Example:
+        .. code-block:: python
+
+            count_tokens = TokenCounter("gpt-3.5-turbo")
+            splitter = RecursiveCharacterTextSplitter(chunk_size=256, length_function=count_tokens)
+    """
+
+    def __init__(
+        self,
+        model_name: str = "text-embedding-ada-002",
+        max_entries: int = 10_000,
+        num_threads: int = 1,
+    ):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.num_threads = num_threads
+        self.hits = 0
+        self.misses = 0
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def encoding(self) -> Any:
+        return get_encoding(self.model_name)
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    def __call__(self, text: str) -> int:
+        return self.count_many([text])[0]
+
+    def count_many(self, texts: Sequence[str]) -> List[int]:
+        """Token counts of ``texts``, encoding the ones not seen recently as one batch."""
+        counts: List[Any] = [None] * len(texts)
+        keys = [self._key(text) for text in texts]
+        missing: Dict[bytes, List[int]] = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                count = self._counts.get(key)
+                if count is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self._counts.move_to_end(key)
+                    counts[i] = count
+            self.hits += len(texts) - sum(len(indices) for indices in missing.values())
+            self.misses += len(missing)
+        if missing:
+            new_keys = list(missing)
+            new_texts = [texts[missing[key][0]] for key in new_keys]
+            new_counts = [len(tokens) for tokens in encode_batch(self.encoding, new_texts, self.num_threads)]
+            self._store(new_keys, new_counts)
+            for key, count in zip(new_keys, new_counts):
+                for i in missing[key]:
+                    counts[i] = count
+        return counts
+
+    def _store(self, keys: Sequence[bytes], counts: Sequence[int]) -> None:
+        with self._lock:
+            for key, count in zip(keys, counts):
+                self._counts[key] = count
+                self._counts.move_to_end(key)
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._counts),
+                "max_entries": self.max_entries,
+            }
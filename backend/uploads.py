@@ -0,0 +1,134 @@
+"""Streaming uploads: request size limits, chunked writes and content hashes."""
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Sequence
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class _TooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    """Reject request bodies larger than ``max_bytes`` before they are parsed.
+
+    A ``Content-Length`` over the limit is refused without reading the body;
+    chunked bodies are counted as they arrive and cut off at the limit. Only
+    requests whose path starts with one of ``paths`` are checked.
+    """
+
+    def __init__(
+        self,
+        app: Callable[..., Awaitable[None]],
+        max_bytes: int,
+        paths: Sequence[str] = ("/",),
+    ):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        response = JSONResponse(
+            {"detail": f"Request body exceeds {self.max_bytes} bytes"}, status_code=413
+        )
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and int(length) > self.max_bytes:
+            await response(scope, receive, send)
+            return
+
+        received = 0
+        too_large = False
+        started = False
+
+        async def limited_receive() -> Dict[str, Any]:
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    too_large = True
+                    raise _TooLarge()
+            return message
+
+        # The framework may turn the aborted read into its own error response, send 413 instead
+        async def limited_send(message: Dict[str, Any]) -> None:
+            nonlocal started
+            if too_large:
+                if message["type"] == "http.response.start" and not started:
+                    started = True
+                    await response(scope, receive, send)
+                return
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except _TooLarge:
+            if not started:
+                await response(scope, receive, send)
+
+
+class StoredUpload(NamedTuple):
+    path: str
+    content_hash: str
+    size: int
+    # True when a file with the same content was already stored
+    existing: bool
+
+
+async def save_upload(
+    file: UploadFile,
+    root: str = "documents",
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> StoredUpload:
+    """Stream ``file`` to ``<root>/<sha256>/<filename>`` in chunks, hashing it on the way.
+
+    Files are stored by content, so uploads that share a name never overwrite
+    each other. If the same content was stored before, the new copy is
+    discarded and the existing path is returned.
+    """
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                await run_in_threadpool(out.write, chunk)
+
+        content_hash = digest.hexdigest()
+        directory = os.path.join(root, content_hash)
+        existing = _stored_file(directory)
+        if existing is not None:
+            return StoredUpload(existing, content_hash, size, True)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, os.path.basename(file.filename or "") or "upload")
+        os.replace(tmp_path, path)
+        return StoredUpload(path, content_hash, size, False)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _stored_file(directory: str) -> Optional[str]:
+    if not os.path.isdir(directory):
+        return None
+    names = sorted(os.listdir(directory))
+    return os.path.join(directory, names[0]) if names else None
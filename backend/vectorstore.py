@@ -0,0 +1,504 @@
+"""Memory-mapped float32 vector store and the helpers selecting a backend."""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.f32"
+METADATA_FILE = "store.sqlite3"
+IVF_CENTROIDS_FILE = "ivf_centroids.npy"
+IVF_LISTS_FILE = "ivf_lists.i32"
+
+# Rough resident size of one Chroma chunk: float32 ada-002 vector plus text and metadata
+CHROMA_BYTES_PER_CHUNK = 1536 * 4 + 2048
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+_OPERATORS = {
+    "$eq": np.equal,
+    "$ne": np.not_equal,
+    "$gt": np.greater,
+    "$gte": np.greater_equal,
+    "$lt": np.less,
+    "$lte": np.less_equal,
+}
+
+
+def _compare(values: np.ndarray, condition: Any) -> np.ndarray:
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    mask = np.ones(len(values), dtype=bool)
+    for operator, operand in condition.items():
+        mask &= _OPERATORS[operator](values, operand).astype(bool)
+    return mask
+
+
+def page_filter(start_page: Optional[int] = None, end_page: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Filter for 0-indexed pages ``start_page <= page < end_page``; either bound may be open."""
+    clauses = []
+    if start_page is not None:
+        clauses.append({"page": {"$gte": start_page}})
+    if end_page is not None:
+        clauses.append({"page": {"$lt": end_page}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class MemmapVectorStore(VectorStore):
+    """Vector store keeping float32 vectors in a memory-mapped file.
+
+    Rows are appended to ``vectors.f32``; ids, texts and metadata live in a
+    SQLite sidecar table next to it. Opening a store only maps the file, so it
+    is near-instant regardless of corpus size, and several worker processes
+    reading the same directory share the OS page cache. Search is a brute-force
+    matrix-vector product, or, once ``build_ivf`` has run, an inverted-file
+    search probing the ``nprobe`` closest clusters.
+
+    Scores returned by ``similarity_search_with_score`` are cosine similarities
+    (higher is closer).
+
+    Example:
+        .. code-block:: python
+
+            store = MemmapVectorStore("db_index/default", embeddings)
+            store.add_texts(["first chunk", "second chunk"])
+            store.similarity_search("chunk", k=1)
+    """
+
+    def __init__(
+        self,
+        persist_directory: str,
+        embedding_function: Embeddings,
+        nprobe: int = 8,
+        ivf_min_rows: int = 20_000,
+    ):
+        self._persist_directory = persist_directory
+        self._embedding_function = embedding_function
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        os.makedirs(persist_directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            os.path.join(persist_directory, METADATA_FILE), check_same_thread=False
+        )
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            " row INTEGER PRIMARY KEY,"
+            " id TEXT NOT NULL,"
+            " document TEXT NOT NULL,"
+            " metadata TEXT NOT NULL,"
+            " deleted INTEGER NOT NULL DEFAULT 0,"
+            " page INTEGER);"
+            "CREATE INDEX IF NOT EXISTS rows_id ON rows (id);"
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);"
+        )
+        columns = [column for _, column, *_ in self._conn.execute("PRAGMA table_info(rows)")]
+        if "page" not in columns:
+            # Stores written before page filtering; their rows have no page column yet
+            self._conn.execute("ALTER TABLE rows ADD COLUMN page INTEGER")
+            for row, metadata in self._conn.execute("SELECT row, metadata FROM rows").fetchall():
+                page = json.loads(metadata).get("page")
+                self._conn.execute("UPDATE rows SET page = ? WHERE row = ?", (page, row))
+        self._conn.commit()
+        self._size = -1
+        self._data_version = -1
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._pages = np.zeros(0, dtype=np.int32)
+        self._centroids: Optional[np.ndarray] = None
+        self._lists = np.zeros(0, dtype=np.int32)
+        self._refresh()
+
+    # -- storage -----------------------------------------------------------
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._persist_directory, name)
+
+    @property
+    def dim(self) -> int:
+        row = self._conn.execute("SELECT value FROM settings WHERE key = 'dim'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _refresh(self) -> None:
+        """Remap the vectors if another connection or process changed the store."""
+        path = self._path(VECTORS_FILE)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        (data_version,) = self._conn.execute("PRAGMA data_version").fetchone()
+        if size == self._size and data_version == self._data_version:
+            return
+        dim = self.dim
+        rows = size // (4 * dim) if dim else 0
+        self._vectors = (
+            np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim))
+            if rows
+            else np.empty((0, dim), dtype=np.float32)
+        )
+        self._alive = np.zeros(rows, dtype=bool)
+        # Page numbers of live rows, -1 when a chunk has none; used for range filters
+        self._pages = np.full(rows, -1, dtype=np.int32)
+        live = self._conn.execute(
+            "SELECT row, page FROM rows WHERE deleted = 0 AND row < ?", (rows,)
+        ).fetchall()
+        if live:
+            live_rows = np.array([row for row, _ in live])
+            self._alive[live_rows] = True
+            self._pages[live_rows] = [-1 if page is None else page for _, page in live]
+        self._load_ivf(rows)
+        self._size = size
+        self._data_version = data_version
+
+    def _load_ivf(self, rows: int) -> None:
+        centroids_path = self._path(IVF_CENTROIDS_FILE)
+        lists_path = self._path(IVF_LISTS_FILE)
+        if not os.path.exists(centroids_path) or not os.path.exists(lists_path):
+            self._centroids = None
+            return
+        self._centroids = np.load(centroids_path)
+        lists = np.fromfile(lists_path, dtype=np.int32)
+        if len(lists) < rows:
+            # Rows appended by a writer without the index; assign them now
+            extra = self._assign(np.asarray(self._vectors[len(lists) : rows]))
+            lists = np.concatenate([lists, extra])
+        self._lists = lists[:rows]
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if len(vectors) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def add_vectors(
+        self,
+        ids: Sequence[str],
+        vectors: np.ndarray,
+        texts: Sequence[str],
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+    ) -> List[str]:
+        """Append precomputed ``vectors``; rows with an existing id are replaced."""
+        vectors = _unit(np.ascontiguousarray(vectors, dtype=np.float32))
+        metadatas = metadatas or [{} for _ in texts]
+        with self._lock:
+            self._refresh()
+            if not self.dim:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO settings (key, value) VALUES ('dim', ?)",
+                    (str(vectors.shape[1]),),
+                )
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(
+                    f"Vector dimension {vectors.shape[1]} does not match the store ({self.dim})."
+                )
+            self._mark_deleted(ids)
+            start = self._size // (4 * vectors.shape[1])
+            with open(self._path(VECTORS_FILE), "ab") as f:
+                f.write(vectors.tobytes())
+            if self._centroids is not None:
+                with open(self._path(IVF_LISTS_FILE), "ab") as f:
+                    f.write(self._assign(vectors).tobytes())
+            self._conn.executemany(
+                "INSERT INTO rows (row, id, document, metadata, page) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (start + i, id_, text, json.dumps(metadata, ensure_ascii=False), metadata.get("page"))
+                    for i, (id_, text, metadata) in enumerate(zip(ids, texts, metadatas))
+                ],
+            )
+            self._conn.commit()
+            self._refresh()
+        return list(ids)
+
+    def _mark_deleted(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i : i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT row FROM rows WHERE deleted = 0 AND id IN ({placeholders})", batch
+            ).fetchall()
+            self._conn.execute(
+                f"UPDATE rows SET deleted = 1 WHERE id IN ({placeholders})", batch
+            )
+            self._alive[[r for (r,) in rows if r < len(self._alive)]] = False
+
+    def delete(self, ids: Sequence[str]) -> None:
+        with self._lock:
+            self._mark_deleted(ids)
+            self._conn.commit()
+
+    def count(self) -> int:
+        self._refresh()
+        return int(self._alive.sum())
+
+    def resident_bytes(self) -> int:
+        """Memory held by this process; the mapped vectors live in the page cache."""
+        return self._alive.nbytes + self._lists.nbytes + (
+            self._centroids.nbytes if self._centroids is not None else 0
+        )
+
+    def persist(self) -> None:
+        """Rows are written through on every add; kept for Chroma parity."""
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+
+    # -- IVF ---------------------------------------------------------------
+
+    @property
+    def has_ivf(self) -> bool:
+        return self._centroids is not None
+
+    def build_ivf(self, nlist: Optional[int] = None, iterations: int = 10, sample: int = 50_000) -> None:
+        """Cluster the live vectors with spherical k-means and save an IVF index."""
+        with self._lock:
+            self._refresh()
+            rows = np.flatnonzero(self._alive)
+            if not len(rows):
+                return
+            nlist = nlist or max(1, int(np.sqrt(len(rows))))
+            rng = np.random.default_rng(0)
+            train = np.asarray(self._vectors[np.sort(rng.choice(rows, min(sample, len(rows)), replace=False))])
+            centroids = train[rng.choice(len(train), min(nlist, len(train)), replace=False)]
+            for _ in range(iterations):
+                assign = np.argmax(train @ centroids.T, axis=1)
+                for c in range(len(centroids)):
+                    members = train[assign == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = _unit(centroids)
+            self._centroids = centroids.astype(np.float32)
+            lists = np.concatenate([
+                self._assign(np.asarray(self._vectors[i : i + 65536]))
+                for i in range(0, len(self._vectors), 65536)
+            ])
+            np.save(self._path(IVF_CENTROIDS_FILE), self._centroids)
+            lists.tofile(self._path(IVF_LISTS_FILE))
+            self._lists = lists
+            logger.info("Built IVF index with %d lists over %d rows", len(centroids), len(rows))
+
+    # -- search ------------------------------------------------------------
+
+    def _candidates(self, query: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        if self._centroids is not None and mask.sum() >= self.ivf_min_rows:
+            probes = np.argsort(self._centroids @ query)[-self.nprobe :]
+            mask = mask & np.isin(self._lists, probes)
+        return np.flatnonzero(mask)
+
+    def _search(self, embedding: Sequence[float], k: int, filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        query = _unit(np.asarray(embedding, dtype=np.float32))
+        with self._lock:
+            self._refresh()
+            if not len(self._vectors):
+                return []
+            rows = self._candidates(query, self._filter_mask(filter))
+            if not len(rows):
+                return []
+            if len(rows) > len(self._vectors) // 2:
+                # One BLAS pass over the whole mapping beats gathering most rows
+                scores = (self._vectors @ query)[rows]
+            else:
+                scores = self._vectors[rows] @ query
+            top = np.argpartition(-scores, min(k, len(rows)) - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return self._documents(rows[top], scores[top])
+
+    def _filter_mask(self, filter: Optional[Dict[str, Any]]) -> np.ndarray:
+        """Rows matching a Chroma-style ``where`` filter, applied before scoring."""
+        if not filter:
+            return self._alive
+        return self._alive & self._where(filter)
+
+    def _where(self, filter: Dict[str, Any]) -> np.ndarray:
+        mask = np.ones_like(self._alive)
+        for key, condition in filter.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._where(clause)
+            elif key == "$or":
+                mask &= np.logical_or.reduce([self._where(clause) for clause in condition])
+            elif key == "page":
+                mask &= _compare(self._pages, condition)
+            else:
+                values = np.zeros(len(mask), dtype=object)
+                for row, metadata in self._conn.execute(
+                    "SELECT row, metadata FROM rows WHERE deleted = 0 AND row < ?", (len(mask),)
+                ):
+                    values[row] = json.loads(metadata).get(key)
+                mask &= _compare(values, condition)
+        return mask
+
+    def _documents(self, rows: np.ndarray, scores: np.ndarray) -> List[Tuple[Document, float]]:
+        placeholders = ",".join("?" * len(rows))
+        found = {
+            row: (document, metadata)
+            for row, document, metadata in self._conn.execute(
+                f"SELECT row, document, metadata FROM rows WHERE row IN ({placeholders})",
+                [int(row) for row in rows],
+            )
+        }
+        return [
+            (Document(page_content=found[int(row)][0], metadata=json.loads(found[int(row)][1])), float(score))
+            for row, score in zip(rows, scores)
+        ]
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid1()) for _ in texts]
+        if hasattr(self._embedding_function, "embed_documents_array"):
+            vectors = self._embedding_function.embed_documents_array(texts)
+        else:
+            vectors = np.asarray(self._embedding_function.embed_documents(texts), dtype=np.float32)
+        return self.add_vectors(ids, vectors, texts, metadatas)
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Document]:
+        embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector(embedding, k=k, filter=filter)
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self._search(embedding, k, filter)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        embedding = self._embedding_function.embed_query(query)
+        return self._search(embedding, k, filter)
+
+    def _similarity_search_with_relevance_scores(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score(query, k, **kwargs)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        persist_directory: str = "db_index",
+        **kwargs: Any,
+    ) -> "MemmapVectorStore":
+        store = cls(persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+
+# Backend-neutral helpers used by the collections
+
+VECTOR_BACKENDS = ("chroma", "memmap")
+
+
+def detect_backend(persist_directory: str, default: str) -> str:
+    """Backend that wrote ``persist_directory``, or ``default`` for a new one."""
+    if os.path.exists(os.path.join(persist_directory, METADATA_FILE)):
+        return "memmap"
+    if os.path.exists(os.path.join(persist_directory, "chroma-collections.parquet")):
+        return "chroma"
+    return default
+
+
+def open_vector_store(backend: str, persist_directory: str, embedding_function: Embeddings) -> VectorStore:
+    """Open the persisted store of ``backend`` in ``persist_directory``."""
+    if backend == "memmap":
+        return MemmapVectorStore(persist_directory, embedding_function)
+    if backend == "chroma":
+        from langchain.vectorstores import Chroma
+
+        return Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
+    raise ValueError(f"Unknown vector backend {backend!r}, expected one of {VECTOR_BACKENDS}")
+
+
+def add_embeddings(store: VectorStore, ids: List[str], docs: List[Document], vectors: np.ndarray) -> None:
+    """Write chunks with precomputed vectors without embedding them again.
+
+    Chunks whose id is already stored are replaced, so writing a batch twice,
+    e.g. when an interrupted ingest is retried, does not duplicate it.
+    """
+    texts = [doc.page_content for doc in docs]
+    metadatas = [doc.metadata for doc in docs]
+    if isinstance(store, MemmapVectorStore):
+        store.add_vectors(ids, vectors, texts, metadatas)
+    else:
+        store._collection.upsert(ids=ids, embeddings=np.asarray(vectors).tolist(),
+                                 documents=texts, metadatas=metadatas)
+
+
+def delete_ids(store: VectorStore, ids: List[str]) -> None:
+    if isinstance(store, MemmapVectorStore):
+        store.delete(ids)
+    else:
+        store._collection.delete(ids=ids)
+
+
+def stored_documents(store: VectorStore) -> Tuple[List[str], List[Document]]:
+    """Ids and documents of every chunk in ``store``."""
+    if isinstance(store, MemmapVectorStore):
+        with store._lock:
+            rows = store._conn.execute("SELECT id, document, metadata FROM rows WHERE deleted = 0").fetchall()
+        return [id_ for id_, _, _ in rows], [
+            Document(page_content=text, metadata=json.loads(metadata)) for _, text, metadata in rows
+        ]
+    result = store._collection.get(include=["documents", "metadatas"])
+    return result["ids"], [
+        Document(page_content=text, metadata=metadata or {})
+        for text, metadata in zip(result["documents"], result["metadatas"])
+    ]
+
+
+def maybe_build_ivf(store: VectorStore) -> None:
+    """Build the IVF index of a memmap store once it is large enough to need one."""
+    if isinstance(store, MemmapVectorStore) and not store.has_ivf and store.count() >= store.ivf_min_rows:
+        store.build_ivf()
+
+
+def warm_up(store: VectorStore) -> None:
+    """Load what a store would otherwise load on its first search.
+
+    Memmap vectors are read once so their pages sit in the OS page cache;
+    Chroma loads its HNSW index into memory on the first query, so one is
+    run with a stored vector.
+    """
+    if isinstance(store, MemmapVectorStore):
+        with store._lock:
+            store._refresh()
+            vectors = store._vectors
+        for start in range(0, len(vectors), 65_536):
+            np.asarray(vectors[start : start + 65_536]).sum()
+        return
+    if not store._collection.count():
+        return
+    sample = store._collection.get(limit=1, include=["embeddings"])
+    store._collection.query(query_embeddings=sample["embeddings"], n_results=1)
+
+
+def resident_bytes(store: VectorStore) -> int:
+    """Estimated memory a store keeps resident in this process."""
+    if isinstance(store, MemmapVectorStore):
+        return store.resident_bytes()
+    return store._collection.count() * CHROMA_BYTES_PER_CHUNK